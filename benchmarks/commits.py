@@ -0,0 +1,149 @@
+# Craig Tomkow
+# 2023-01-29
+
+# commits and time per RPC, each RPC called the old way (every write commits on its own) and the way the daemon
+#   calls it now (one transaction per RPC), e.g. python benchmarks/commits.py --calls 200 --dir /var/tmp
+#   writes that became one executemany (rekey_db, environment statuses) are counted as one commit both ways. a
+#   commit is cheap on tmpfs, use --dir for a disk that really syncs
+
+# python imports
+import argparse
+import base64
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# local imports
+from gluetube.gluetubed import GluetubeDaemon  # noqa: E402
+from gluetube.db import Database, Pipeline, Store  # noqa: E402
+from gluetube.config import Gluetube  # noqa: E402
+from gluetube.provision import Provisioner  # noqa: E402
+from scheduler import Scheduler  # noqa: E402
+
+DEPENDENTS = 3
+KEYS = 3
+REKEYS = 1  # every key is decrypted and encrypted again, 500k PBKDF2 rounds each
+MODIFIED = 20
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description='commits per RPC benchmark')
+    parser.add_argument('--calls', type=int, default=200, help='calls of each RPC')
+    parser.add_argument('--dir', help='where the databases go (default: the temp dir)')
+    args = parser.parse_args()
+
+    results = {}
+    transaction = Database.transaction
+    for mode in ('per write', 'per rpc'):
+        Database.transaction = transaction if mode == 'per rpc' else _commit_each
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp_dir:
+            results[mode] = _run(Path(tmp_dir), args.calls, mode == 'per rpc')
+    Database.transaction = transaction
+
+    print(f"{'rpc':>26} {'commits before':>15} {'commits after':>14} {'ms before':>10} {'ms after':>9}")
+    for rpc in results['per write']:
+        before, after = results['per write'][rpc], results['per rpc'][rpc]
+        print(f"{rpc:>26} {before[0]:>15.1f} {after[0]:>14.1f} {before[1]:>10.2f} {after[1]:>9.2f}")
+
+
+# the old way, no unit of work. every write commits, a block that was a transaction of its own commits when it ends
+@contextmanager
+def _commit_each(self: Database) -> Iterator[None]:
+
+    yield
+    self._conn.commit()
+
+
+# (commits, ms) per call of each RPC
+def _run(tmp_dir: Path, calls: int, per_rpc: bool) -> Dict[str, Tuple[float, float]]:
+
+    kwargs = _daemon_state(tmp_dir)
+    commits = []
+    for db in (kwargs['db_p'], kwargs['db_s']):
+        db._conn.set_trace_callback(lambda x: commits.append(x) if x == 'COMMIT' else None)
+    daemon = GluetubeDaemon()
+
+    def call(func: str, args: list) -> None:
+        if per_rpc:
+            daemon._call_rpc(func, args, kwargs)
+        else:
+            getattr(daemon, func)(*args, **kwargs)
+
+    db_p = kwargs['db_p']
+    new_password = [kwargs['db_s'].sys_password]
+    modified = [[x, 0.0] for x in range(2, 2 + MODIFIED)]
+
+    # (name, what's reset before each call and not measured, the call)
+    rpcs: List[Tuple[str, Callable[[int], None], Callable[[int], None]]] = [
+        ('set_schedule_cron', lambda i: (db_p.update_pipeline_schedule_cron(1, ''),
+                                         db_p.update_pipeline_schedule_at(1, '2099-01-01 00:00:00')),
+         lambda i: call('set_schedule_cron', [1, '* * * * *'])),
+        ('set_schedule_now', lambda i: db_p.update_pipeline_schedule_cron(1, '* * * * *'),
+         lambda i: call('set_schedule_now', [1])),
+        ('set_pipeline', lambda i: None,
+         lambda i: call('set_pipeline', [f"bench_{i}", 'bench.py', f"bench_{i}", '0'])),
+        ('set_pipeline_run_finished', lambda i: db_p.insert_pipeline_run(1, 1, 'running', i),
+         lambda i: call('set_pipeline_run_finished', [i + 1, 'finished', '', i + 1])),
+        ('reconcile_pipelines', lambda i: [x.__setitem__(1, float(i)) for x in modified],
+         lambda i: call('reconcile_pipelines', [[], [], modified])),
+        ('rekey_db', lambda i: new_password.append(base64.urlsafe_b64encode(os.urandom(32)).decode()),
+         lambda i: call('rekey_db', [new_password[-1]])),
+    ]
+
+    results = {}
+    for name, reset, rpc in rpcs:
+        elapsed = 0.0
+        committed = 0
+        n = min(calls, REKEYS) if name == 'rekey_db' else calls
+        for i in range(n):
+            reset(i)
+            db_p._conn.commit()
+            commits.clear()
+            start = time.perf_counter()
+            rpc(i)
+            elapsed += time.perf_counter() - start
+            committed += len(commits)
+        results[name] = (committed / n, elapsed / n * 1000)
+
+    kwargs['scheduler'].shutdown(wait=False)
+    kwargs['provisioner'].stop()
+    return results
+
+
+# databases on disk, so a commit costs what it costs the daemon. schedule 1 has DEPENDENTS downstream schedules,
+#   the store KEYS keys and there are MODIFIED more pipelines for auto-discovery to report
+def _daemon_state(tmp_dir: Path) -> dict:
+
+    shutil.copy(Path(Path(__file__).resolve().parent.parent, 'gluetube', 'cfg', 'gluetube.cfg'), tmp_dir)
+    gt_cfg = Gluetube([Path(tmp_dir, 'gluetube.cfg').as_posix()])
+    gt_cfg.parse()
+    gt_cfg.pipeline_dir = Path(tmp_dir, 'pipelines').as_posix()
+    gt_cfg.artifact_dir = Path(tmp_dir, 'artifacts').as_posix()
+
+    db_p = Pipeline(db_path=Path(tmp_dir, 'gluetube.db'), read_only=False)
+    db_p.create_schema()
+    for i in range(1 + DEPENDENTS + MODIFIED):
+        db_p.insert_pipeline(f"pipeline_{i}", 'pipeline.py', f"pipeline_{i}", 0.0)
+        db_p.insert_pipeline_schedule(i + 1)
+    for i in range(DEPENDENTS):
+        db_p.insert_pipeline_schedule_dependency(i + 2, 1)
+
+    db_s = Store(base64.urlsafe_b64encode(os.urandom(32)), db_path=Path(tmp_dir, 'store.db'), read_only=False)
+    db_s.create_table('common')
+    for i in range(KEYS):
+        db_s.insert_key_value('common', f"key_{i}", f"value_{i}")
+
+    return {'scheduler': Scheduler(1, lambda x: None), 'db_p': db_p, 'db_s': db_s, 'gt_cfg': gt_cfg,
+            'supervisor': None, 'provisioner': Provisioner(gt_cfg)}
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# Craig Tomkow
+# 2023-01-16
+
+# times pipeline discovery over a generated tree, e.g. python benchmarks/discovery.py --files 10000
+
+# python imports
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# local imports
+from gluetube.autodiscovery import PipelineScanner  # noqa: E402
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description='pipeline discovery benchmark')
+    parser.add_argument('--files', type=int, default=10000, help='number of py files in the tree')
+    parser.add_argument('--per-dir', type=int, default=10, help='py files per pipeline directory')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        _build_tree(Path(tmp_dir), args.files, args.per_dir)
+        scanner = PipelineScanner(Path(tmp_dir), Path('sock'), db_name='memory', exclude=['tests/'])
+
+        pipelines = len(scanner._enumerate_fs_pipelines())
+        walk = min(timeit.repeat(scanner._enumerate_fs_pipelines, number=1, repeat=args.repeat))
+        scanner._fingerprint = scanner._walk(scanner.pipeline_dir)[3]
+        poll = min(timeit.repeat(scanner.scan_if_changed, number=1, repeat=args.repeat))
+
+    print(f"{args.files} files, {pipelines} pipelines found")
+    print(f"full walk:        {walk * 1000:.1f} ms")
+    print(f"unchanged poll:   {poll * 1000:.1f} ms")
+
+
+# team/project/pipeline directories, each with a .venv and __pycache__ that discovery must not descend into
+def _build_tree(root: Path, files: int, per_dir: int) -> None:
+
+    for i in range(0, files, per_dir):
+        dir = Path(root, f"team_{i // 1000}", f"project_{i // 100}", f"pipeline_{i}")
+        Path(dir, '.venv', 'lib').mkdir(parents=True)
+        Path(dir, '__pycache__').mkdir()
+        Path(dir, 'tests').mkdir()
+        for j in range(min(per_dir, files - i)):
+            Path(dir, f"step_{j}.py").write_text('')
+        Path(dir, 'requirements.txt').write_text('')
+        Path(dir, '.venv', 'lib', 'site.py').write_text('')
+        Path(dir, 'tests', 'test_step.py').write_text('')
+        os.utime(dir)
+
+
+if __name__ == '__main__':
+    main()
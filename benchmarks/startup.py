@@ -0,0 +1,95 @@
+# Craig Tomkow
+# 2023-01-23
+
+# daemon startup time and memory with many schedules, e.g. python benchmarks/startup.py --schedules 10000 100000
+#   each engine loads the same database in a fresh process. --apscheduler also loads it the old way, one
+#   APScheduler job holding a Runner per schedule
+
+# python imports
+import argparse
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# local imports
+from gluetube.db import Pipeline  # noqa: E402
+
+CRONTABS = ['* * * * *', '*/5 * * * *', '0 * * * *', '15 3 * * *', '0 0 * * 0', '30 */2 * * 1-5']
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description='scheduler startup benchmark')
+    parser.add_argument('--schedules', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--apscheduler', action='store_true', help='also load the schedules into APScheduler')
+    parser.add_argument('--load', choices=['heap', 'apscheduler'], help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.load:
+        _load(args.load, Path(args.db))
+        return
+
+    engines = ['heap', 'apscheduler'] if args.apscheduler else ['heap']
+    print(f"{'schedules':>10} {'engine':>12} {'jobs':>8} {'startup':>10} {'memory':>10}")
+    for schedules in args.schedules:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = Path(tmp_dir, 'gluetube.db')
+            _build_db(db_path, schedules)
+            for engine in engines:
+                out = subprocess.check_output([sys.executable, __file__, '--load', engine, '--db', str(db_path)])
+                jobs, startup, memory = out.decode().split()
+                print(f"{schedules:>10} {engine:>12} {jobs:>8} {float(startup) * 1000:>8.0f}ms {int(memory) // 1024:>8}MB")
+
+
+# 80% cron, 10% paused, 10% never scheduled. like most installs, many schedules share a handful of crontabs
+def _build_db(db_path: Path, schedules: int) -> None:
+
+    db = Pipeline(db_path=db_path, read_only=False)
+    db.create_schema()
+    ids = db.reconcile_pipelines([(f"pipeline_{i}", 'main.py', f"dir_{i}", 0.0) for i in range(schedules)], [], [])
+    with db._conn:
+        db._conn.executemany("UPDATE pipeline_schedule SET cron = ?, paused = ? WHERE id = ?",
+                             [(CRONTABS[i % len(CRONTABS)] if i % 10 else '', 1 if i % 10 == 1 else 0, s_id)
+                              for i, (_, s_id) in enumerate(ids)])
+    db.close()
+
+
+# runs in its own process, prints: jobs, startup seconds, KB of memory the jobs took
+def _load(engine: str, db_path: Path) -> None:
+
+    from gluetube.config import Gluetube
+    from gluetube.gluetubed import GluetubeDaemon
+    from gluetube.runner import Runner
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.triggers.cron import CronTrigger
+
+    gt_cfg = Gluetube(Path(Path(__file__).resolve().parent.parent, 'tests', 'cfg', 'gluetube.cfg').as_posix())
+    gt_cfg.parse()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    db = Pipeline(db_path=db_path)
+    if engine == 'heap':
+        scheduler = GluetubeDaemon._setup_scheduler(101, gt_cfg)
+        GluetubeDaemon._schedule_pipelines(scheduler, db)
+        jobs = len(scheduler)
+    else:
+        scheduler = BackgroundScheduler()
+        for pipeline in db.all_pipelines_scheduling():
+            runner = Runner(pipeline[0], pipeline[1], pipeline[2], pipeline[3], pipeline[4], gt_cfg)
+            trigger = CronTrigger.from_crontab(pipeline[5]) if pipeline[5] else None
+            scheduler.add_job(runner.run, trigger=trigger, id=str(pipeline[4]))
+        jobs = len(scheduler.get_jobs())
+    startup = time.perf_counter() - start
+
+    print(jobs, startup, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline)
+
+
+if __name__ == '__main__':
+    main()
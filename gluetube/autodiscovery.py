@@ -9,8 +9,22 @@ import util
 # python imports
 from pathlib import Path
 import re
+import fnmatch
 import random
-from typing import List, Tuple
+import os
+import sys
+import select
+import struct
+import threading
+import logging
+import time
+import ctypes
+import ctypes.util
+from typing import Dict, List, Set, Tuple
+
+# every this many polls scan_if_changed scans even though nothing changed. the reconcile rpc is fire and forget, one
+#   the daemon rejected or rolled back is sent again
+FULL_SCAN_POLLS = 10
 
 
 # TODO: error handling
@@ -21,7 +35,7 @@ class PipelineScanner:
     db = None
 
     def __init__(self, pipeline_dir_path: Path, socket_file: Path, db_dir: Path = Path('.'),
-                 db_name: str = 'gluetube.db') -> list:
+                 db_name: str = 'gluetube.db', include: List[str] = ('*.py',), exclude: List[str] = ()) -> list:
 
         self.pipeline_dir = pipeline_dir_path
         if not self.pipeline_dir.exists():
@@ -30,22 +44,53 @@ class PipelineScanner:
         self.socket_file = socket_file
         self.db_name = db_name
         self.db_dir_path = db_dir
+        self._include = _PathPatterns(include)
+        self._exclude = _PathPatterns(exclude)
+
+        # the watcher thread and the polling job can both trigger a scan
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._polls = 0
+        self._env_dirs = {}
 
     # steps
     #  1. get tuple (py_file, directory, timestamp) of all pipelines on filesystem
     #  2. get tuple (py_file, directory, timestamp) of all pipelines from database
-    #  3. compare; generate list of pipelines to be deleted and to be added
-    #  4. make RPC calls
+    #  3. compare; generate list of pipelines to be deleted, to be added and modified (py_file timestamp differs)
+    #  4. send the whole diff in one RPC call
     def scan(self) -> None:
 
-        # must do this within the scan method not the constructor, otherwise the db obj gets created in another thread
+        with self._lock:
+            walk = self._walk(self.pipeline_dir)
+            self._scan(walk)
+            self._fingerprint = walk[3]
+            self._polls = 0
+
+    # polling, only scan when a directory or a tracked file (added, removed or edited in place) changed since the last
+    #   scan, or every FULL_SCAN_POLLS polls. the walk is the one the scan then works from, a poll costs a single pass
+    #   over the tree. a scan that failed leaves the fingerprint as it was, the next poll tries again
+    def scan_if_changed(self) -> None:
+
+        with self._lock:
+            walk = self._walk(self.pipeline_dir)
+            self._polls += 1
+            if walk[3] == self._fingerprint and self._polls < FULL_SCAN_POLLS:
+                return
+            self._scan(walk)
+            self._fingerprint = walk[3]
+            self._polls = 0
+
+    def _scan(self, walk: Tuple[List[Path], List[Tuple[str, str, float]], Dict[str, float], dict]) -> None:
+
+        # must do this within the scan method not the constructor, otherwise the db obj gets created in another thread.
+        #   the connection is the pooled one of the thread the scan runs on
         self.db = self._connect_to_db(self.db_name, self.db_dir_path)
 
         # a tuple (py_file, directory, py_file_timestamp), representing a complete pipeline
-        pipeline_dirs = self._all_dirs(self.pipeline_dir)
-        fs_pipelines_with_timestamp = self._enumerate_fs_pipelines(pipeline_dirs)
+        _, fs_pipelines_with_timestamp, requirements, _ = walk
         # tuple (py_file, directory) representing a pipeline
         fs_pipelines_no_timestamp = [x[:2] for x in fs_pipelines_with_timestamp]
+        fs_timestamps = {x[:2]: x[2] for x in fs_pipelines_with_timestamp}
 
         # a tuple (py_file, directory, py_file_timestamp), representing a complete pipeline
         db_data = self.db.all_pipelines()
@@ -59,30 +104,34 @@ class PipelineScanner:
         # this consists of pipelines in the db that don't exist on the file system anymore
         missing_db_pipelines = self._cmp_two_elems(db_pipelines_no_timestamp, fs_pipelines_no_timestamp)
 
-        # ### Now make RPC Calls ###
+        # this consists of pipelines on both, but the py_file changed since the db last saw it
+        modified_pipelines = self._modified_pipelines(fs_pipelines_with_timestamp, db_data)
+
+        # pipeline directories that are new, or whose requirements.txt changed, since the last scan. they get their
+        #   environment built in the background. the first scan after a start reports all of them
+        env_dirs = {x[1]: requirements.get(x[1], 0.0) for x in fs_pipelines_with_timestamp}
+        provision = sorted(x for x in env_dirs if self._env_dirs.get(x) != env_dirs[x])
+
+        # ### Now make one RPC Call with the whole diff ###
+
+        if not (missing_fs_pipelines or missing_db_pipelines or modified_pipelines or provision):
+            return
 
-        # add new pipeline (to scheduler and db)
-        for pipeline in missing_fs_pipelines:
-            msg = util.craft_rpc_msg('set_pipeline',
-                                     [
-                                         self._generate_unique_pipeline_name(self.db),
-                                         pipeline[0],
-                                         pipeline[1],
-                                         0.0
-                                     ])
-            util.send_rpc_msg_to_daemon(msg, self.socket_file)
+        db_ids = {(x[2], x[3]): x[0] for x in db_data}
+        added = [[x[0], x[1], fs_timestamps[x]] for x in missing_fs_pipelines]
+        removed = [db_ids[x] for x in missing_db_pipelines]
+        modified = [list(x) for x in modified_pipelines]
 
-        # remove orphaned pipelines (from scheduler and db)
-        for pipeline in missing_db_pipelines:
-            pipeline_id = self.db.pipeline_id_from_tuple(pipeline[0], pipeline[1])
-            util.send_rpc_msg_to_daemon(util.craft_rpc_msg('delete_pipeline', [pipeline_id]), self.socket_file)
+        msg = util.craft_rpc_msg('reconcile_pipelines', [added, removed, modified, provision])
+        util.send_rpc_msg_to_daemon(msg, self.socket_file)
+        self._env_dirs = env_dirs
 
     def _connect_to_db(self, name: str, dir_path: Path) -> Pipeline:
         try:
             if name == 'memory':
                 db = Pipeline(in_memory=True)
             else:
-                db = Pipeline(db_path=Path(dir_path, name))
+                db = Pipeline(db_path=Path(dir_path, name), pooled=True)
         except exception.dbError:
             raise
 
@@ -90,43 +139,74 @@ class PipelineScanner:
 
     def _all_dirs(self, current_dir: Path) -> List[Path]:
 
-        dirs = [x for x in current_dir.iterdir() if x.is_dir()]
-
-        # remove 'None' dir or hidden dir
-        for dir in dirs.copy():
-            if (dir.name == 'None') or (re.search(r"^\.", dir.name)) or (re.search(r"^__", dir.name)):
-                dirs.remove(dir)
-            else:
-                pass
-
-        pipeline_dir_list = []
-        for dir in dirs:
-            pipeline_dir_list.append(dir.absolute())
-        return pipeline_dir_list
-
-    def _all_py_files(self, current_dir: Path) -> List[Path]:
-
-        files = [x for x in current_dir.iterdir() if x.is_file()]
-
-        # remove all non .py files
-        for file in files.copy():
-            if not re.search(r"\.py$", file.name):
-                files.remove(file)
-            else:
-                pass
-
-        return files
+        return self._walk(current_dir, files=False)[0]
 
     # list of tuples representing the pipelines (py_file, directory, py_file_timestamp)
-    def _enumerate_fs_pipelines(self, pipeline_dirs: List[Path]) -> List[Tuple[str, str, float]]:
-
-        tuples = []
-        for dir in pipeline_dirs:
-            py_files = self._all_py_files(dir)
-            for py_file in py_files:
-                tuples.append((py_file.name, dir.name, py_file.lstat().st_mtime))
-
-        return tuples
+    def _enumerate_fs_pipelines(self) -> List[Tuple[str, str, float]]:
+
+        return self._walk(self.pipeline_dir)[1]
+
+    # one os.scandir pass over the whole pipeline tree, returns (directories, pipelines, requirements.txt timestamps,
+    #   fingerprint). a pipeline's directory is its path relative to the pipeline dir. scandir already knows each
+    #   entry's type, so only included files and requirements.txt get a stat. the fingerprint has every directory and
+    #   the (mtime, size) of those files, keyed by relative path, what scan_if_changed compares
+    def _walk(self, top: Path,
+              files: bool = True) -> Tuple[List[Path], List[Tuple[str, str, float]], Dict[str, float], dict]:
+
+        dirs = []
+        pipelines = []
+        requirements = {}
+        fingerprint = {}
+        seen = {os.path.realpath(top)}
+        stack = [(top.absolute(), '')]
+
+        while stack:
+            current_dir, rel_dir = stack.pop()
+            try:
+                with os.scandir(current_dir) as it:
+                    entries = list(it)
+            except OSError:  # removed since it was listed, or not readable
+                continue
+
+            for entry in entries:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                try:
+                    if entry.is_dir():
+                        if self._skip_dir(entry.name, rel_path):
+                            continue
+                        # a symlinked directory is followed once, a link back up the tree would never end
+                        if entry.is_symlink():
+                            real_path = os.path.realpath(entry.path)
+                            if real_path in seen:
+                                continue
+                            seen.add(real_path)
+                        dirs.append(Path(entry.path))
+                        fingerprint[rel_path] = None
+                        stack.append((entry.path, rel_path))
+                    # py files in the pipeline dir itself aren't pipelines, they have no directory of their own
+                    elif not files or not rel_dir or not entry.is_file():
+                        continue
+                    elif entry.name == 'requirements.txt':
+                        stat = entry.stat(follow_symlinks=False)
+                        requirements[rel_dir] = stat.st_mtime
+                        fingerprint[rel_path] = (stat.st_mtime_ns, stat.st_size)
+                    elif self._include_file(entry.name, rel_path):
+                        stat = entry.stat(follow_symlinks=False)
+                        pipelines.append((entry.name, rel_dir, stat.st_mtime))
+                        fingerprint[rel_path] = (stat.st_mtime_ns, stat.st_size)
+                except OSError:  # removed since it was listed
+                    continue
+
+        return dirs, pipelines, requirements, fingerprint
+
+    # never descend into 'None', hidden (.venv, .git) or dunder (__pycache__) directories, nor excluded ones
+    def _skip_dir(self, name: str, rel_path: str) -> bool:
+
+        return name == 'None' or name.startswith(('.', '__')) or self._exclude.match(name, rel_path, is_dir=True)
+
+    def _include_file(self, name: str, rel_path: str) -> bool:
+
+        return self._include.match(name, rel_path) and not self._exclude.match(name, rel_path)
 
     def _enumerate_db_pipelines(self,
                                 pipeline_data: List[Tuple[int, str, str, str, float]]) -> List[Tuple[str, str, float]]:
@@ -138,6 +218,20 @@ class PipelineScanner:
 
         return enum
 
+    # list of (pipeline_id, py_file_timestamp) for pipelines whose py_file timestamp differs from the database
+    def _modified_pipelines(self, fs_pipelines: List[Tuple[str, str, float]],
+                            pipeline_data: List[Tuple[int, str, str, str, float]]) -> List[Tuple[int, float]]:
+
+        fs_timestamps = {x[:2]: x[2] for x in fs_pipelines}
+
+        modified = []
+        for pipeline in pipeline_data:
+            fs_timestamp = fs_timestamps.get((pipeline[2], pipeline[3]))
+            if fs_timestamp is not None and fs_timestamp != pipeline[4]:
+                modified.append((pipeline[0], fs_timestamp))
+
+        return modified
+
     def _cmp_two_elems(self, a: list, b: list, cmp_type: str = 'a_diff_b') -> list:
 
         if cmp_type == 'a_diff_b':
@@ -151,49 +245,225 @@ class PipelineScanner:
         else:
             return []
 
-    # source: https://www.uibk.ac.at/anglistik/staff/herdina/kursunterlagen/mayhew_a_a_concise_dictionary_of_middle_englishbooksee.org.pdf
-    def _random_middle_english_adjective_and_noun(self) -> str:
-
-        adjectives = [
-            'admod',  # humble, gentle
-            'aht',  # worthy, valiant
-            'brant',  # steep, high
-            'bel',  # beautiful
-            'calme',  # calm
-            'cant',  # lively, brave, cheerful
-            'drery',  # sad, dreary
-            'dilitable',  # delightful
-            'ender',  # latter
-            'erly',  # early
-        ]
-        nouns = [
-            'abbay',  # church
-            'alemaunde',  # almond
-            'banere',  # banner
-            'beere',  # beer
-            'camamelle',  # camomile
-            'candel',  # candle
-            'disour',  # minstrel
-            'duk',  # duke
-            'elf',  # elf
-            'ey',  # egg
-        ]
-
-        adj = adjectives[random.randint(0, len(adjectives) - 1)]
-        noun = nouns[random.randint(0, len(nouns) - 1)]
-
-        return f"{adj}-{noun}"
-
-    def _generate_unique_pipeline_name(self, db: Pipeline) -> str:
-
-        name = self._random_middle_english_adjective_and_noun()
-        tries = 1
-
-        while db.pipeline_id_from_name(name):
-            name = self._random_middle_english_adjective_and_noun()
-            if tries >= 3:
-                name = name + '_' + str(random.randint(0, 999))
-                break
-            tries += 1
-
-        return name
+
+# calls a scan shortly after something changes in the pipeline directory, using linux inotify
+class PipelineWatcher:
+
+    def __init__(self, scanner: PipelineScanner, debounce: float = 0.5) -> None:
+
+        self.scanner = scanner
+        self.debounce = debounce
+        self._inotify = None
+        self._watches = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def available() -> bool:
+
+        if not sys.platform.startswith('linux'):
+            return False
+        try:
+            _Inotify().close()
+        except (OSError, AttributeError):
+            return False
+        return True
+
+    def start(self) -> None:
+
+        self._inotify = _Inotify()
+        self._sync_watches()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='pipeline_watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+
+    def _run(self) -> None:
+
+        # a burst of events (e.g. git pull) is coalesced into one scan once it has been quiet for the debounce period.
+        #   a never ending burst is still scanned every 10 debounce periods
+        first_event = None
+        while not self._stop.is_set():
+            if self._inotify.wait(self.debounce if first_event else 1.0):
+                self._inotify.drain()
+                if first_event is None:
+                    first_event = time.monotonic()
+                if time.monotonic() - first_event < self.debounce * 10:
+                    continue
+            if first_event is None:
+                continue
+            first_event = None
+
+            try:
+                self._sync_watches()
+                self.scanner.scan()
+            except Exception as e:  # catch all exceptions, the watcher thread must keep going
+                logging.error(f"Pipeline scan failed. {e}")
+
+    # watch the pipeline directory and every pipeline directory in it, new directories are picked up before each scan
+    def _sync_watches(self) -> None:
+
+        dirs = [self.scanner.pipeline_dir] + self.scanner._all_dirs(self.scanner.pipeline_dir)
+        for dir in dirs:
+            if dir in self._watches:
+                continue
+            try:
+                self._watches[dir] = self._inotify.add_watch(dir)
+            except OSError as e:  # removed since it was listed, or out of watches
+                logging.warning(f"Can't watch {dir}. {e}")
+
+        # the kernel drops the watch of a removed directory by itself
+        for dir in set(self._watches) - set(dirs):
+            del self._watches[dir]
+
+
+# gitignore style patterns, matched with fnmatch. a pattern with a slash is matched against the path relative to the
+#   pipeline dir, otherwise against the name at any depth. a trailing slash only matches directories
+class _PathPatterns:
+
+    def __init__(self, patterns: List[str]) -> None:
+
+        self._name_patterns = []
+        self._path_patterns = []
+
+        for pattern in patterns:
+            dir_only = pattern.endswith('/')
+            pattern = pattern.strip('/') if dir_only else pattern.lstrip('/')
+            if not pattern:
+                continue
+            compiled = (re.compile(fnmatch.translate(pattern)), dir_only)
+            if '/' in pattern:
+                self._path_patterns.append(compiled)
+            else:
+                self._name_patterns.append(compiled)
+
+    def match(self, name: str, rel_path: str, is_dir: bool = False) -> bool:
+
+        for regex, dir_only in self._name_patterns:
+            if (is_dir or not dir_only) and regex.match(name):
+                return True
+        for regex, dir_only in self._path_patterns:
+            if (is_dir or not dir_only) and regex.match(rel_path):
+                return True
+        return False
+
+
+# a minimal ctypes binding of linux inotify, the python standard library doesn't have one
+class _Inotify:
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_ONLYDIR = 0x01000000
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = os.O_CLOEXEC
+
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | \
+        IN_MOVE_SELF | IN_ONLYDIR
+
+    def __init__(self) -> None:
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path: Path) -> int:
+
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(path))
+        return wd
+
+    def wait(self, timeout: float) -> bool:
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        return bool(readable)
+
+    # the watcher only cares that something changed, not what, so the events are read and thrown away
+    def drain(self) -> int:
+
+        count = 0
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return count
+            offset = 0
+            while offset < len(data):
+                _, _, _, name_len = struct.unpack_from('iIII', data, offset)
+                offset += struct.calcsize('iIII') + name_len
+                count += 1
+
+    def close(self) -> None:
+
+        os.close(self.fd)
+
+
+# helper functions
+
+
+# source:
+#   https://www.uibk.ac.at/anglistik/staff/herdina/kursunterlagen/mayhew_a_a_concise_dictionary_of_middle_englishbooksee.org.pdf
+def _random_middle_english_adjective_and_noun() -> str:
+
+    adjectives = [
+        'admod',  # humble, gentle
+        'aht',  # worthy, valiant
+        'brant',  # steep, high
+        'bel',  # beautiful
+        'calme',  # calm
+        'cant',  # lively, brave, cheerful
+        'drery',  # sad, dreary
+        'dilitable',  # delightful
+        'ender',  # latter
+        'erly',  # early
+    ]
+    nouns = [
+        'abbay',  # church
+        'alemaunde',  # almond
+        'banere',  # banner
+        'beere',  # beer
+        'camamelle',  # camomile
+        'candel',  # candle
+        'disour',  # minstrel
+        'duk',  # duke
+        'elf',  # elf
+        'ey',  # egg
+    ]
+
+    adj = adjectives[random.randint(0, len(adjectives) - 1)]
+    noun = nouns[random.randint(0, len(nouns) - 1)]
+
+    return f"{adj}-{noun}"
+
+
+# the daemon names new pipelines against the set of names it already has, no database lookup per try
+def generate_unique_pipeline_name(names: Set[str]) -> str:
+
+    name = _random_middle_english_adjective_and_noun()
+    tries = 1
+
+    while name in names:
+        name = _random_middle_english_adjective_and_noun()
+        if tries >= 3:
+            name = name + '_' + str(random.randint(0, 999))
+        tries += 1
+
+    return name
@@ -5,6 +5,11 @@
 from db import Pipeline, Store
 import util
 from gluetubed import GluetubeDaemon
+from scheduler import cron_trigger, fire_times
+from sketch import DurationSketch
+import plan
+import export
+from worker import Worker
 import exception
 
 # python imports
@@ -14,10 +19,21 @@ import os
 import signal
 import shutil
 import base64
+import sqlite3
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, List, Union
 
 # 3rd party imports
 from prettytable import PrettyTable
 from prettytable import SINGLE_BORDER
+from apscheduler.util import convert_to_datetime
+
+# runs read from the database at a time by gt runs
+RUNS_PAGE = 500
+
+# runs read from the database, and written to the file, at a time by gt runs --export
+EXPORT_CHUNK = 10000
 
 
 # this should be idempotent
@@ -28,6 +44,8 @@ def gluetube_configure() -> None:
     Path(app_dir, 'db').mkdir(parents=True, exist_ok=True)
     Path(app_dir, 'var').mkdir(parents=True, exist_ok=True)
     Path(app_dir, 'etc').mkdir(parents=True, exist_ok=True)
+    Path(app_dir, 'artifacts').mkdir(parents=True, exist_ok=True)
+    Path(app_dir, 'venvs').mkdir(parents=True, exist_ok=True)
     incl_cfg_location = Path(Path(__file__).parent.resolve() / 'cfg' / 'gluetube.cfg')
     depl_cfg_location = Path(app_dir / 'etc' / 'gluetube.cfg')
     if not depl_cfg_location.exists():
@@ -45,8 +63,8 @@ def summary() -> PrettyTable:
     table = PrettyTable()
     table.set_style(SINGLE_BORDER)
     table.field_names = [
-        'pipeline name', 'file name', 'schedule ID', 'cron', 'run at (IS0 8601)', 'paused', 'status', 'stage message',
-        'end time (ISO 8601)'
+        'pipeline name', 'file name', 'environment', 'schedule ID', 'cron', 'run at (IS0 8601)', 'paused', 'status',
+        'stage message', 'end time (ISO 8601)', 'failures in a row', 'next run (ISO 8601)'
     ]
 
     try:
@@ -54,11 +72,154 @@ def summary() -> PrettyTable:
     except exception.dbError:
         raise
 
-    details = db.summary_pipelines()
+    details = [x[:9] + (util.iso_time(x[9]),) + x[10:] for x in db.summary_pipelines()]
     table.add_rows(details)
     return table
 
 
+# every active cron and at schedule over the horizon, each run taking its pipeline's p95 duration, replayed against
+#   the given number of slots. shows the peak concurrency, how long runs wait for a slot and the worst minutes
+def capacity_plan(horizon: int, slots: int) -> str:
+    try:
+        gt_cfg = util.conf()
+    except (exception.ConfigFileParseError, exception.ConfigFileNotFoundError) as e:
+        raise e
+
+    try:
+        db = Pipeline(db_path=Path(gt_cfg.sqlite_dir, gt_cfg.sqlite_app_name))
+    except exception.dbError:
+        raise
+
+    durations = plan.p95_durations(db.recent_run_durations(plan.DURATION_WINDOW))
+
+    start = datetime.now(timezone.utc)
+    end = start + timedelta(seconds=horizon)
+    cron_fires = {}  # schedules sharing a crontab share a trigger, its fire times are only worked out once
+    fires = []
+    for pipeline in db.all_pipelines_scheduling():
+        if pipeline[4] is None or pipeline[7]:  # no schedule, or paused
+            continue
+        try:
+            if pipeline[5]:
+                trigger = cron_trigger(pipeline[5], pipeline[4])
+                if trigger not in cron_fires:
+                    cron_fires[trigger] = fire_times(trigger, start, end)
+                schedule_fires = cron_fires[trigger]
+            elif pipeline[6]:
+                at = convert_to_datetime(pipeline[6], timezone.utc, 'at')
+                schedule_fires = [at] if start <= at < end else []
+            else:
+                continue
+        except ValueError:  # the daemon doesn't schedule it either
+            continue
+        duration = durations.get(pipeline[0], plan.DEFAULT_DURATION)
+        fires.extend((x, pipeline[4], duration) for x in schedule_fires)
+
+    result = plan.simulate(fires, slots)
+
+    table = PrettyTable()
+    table.set_style(SINGLE_BORDER)
+    table.field_names = ['horizon', 'slots', 'runs', 'skipped (still running)', 'peak concurrent', 'peak at',
+                         'slots needed', 'runs queued', 'mean wait (s)', 'max wait (s)']
+    table.add_row([f"{horizon / 3600:g}h", slots, result['runs'], result['skipped'], result['peak'],
+                   result['peak_at'].isoformat(timespec='seconds') if result['peak_at'] else '', result['demand'],
+                   result['queued'], round(result['mean_delay'], 1), round(result['max_delay'], 1)])
+
+    worst = PrettyTable()
+    worst.set_style(SINGLE_BORDER)
+    worst.field_names = ['worst minutes', 'runs fired', 'max wait (s)']
+    for minute, fired, delay in result['worst_minutes']:
+        worst.add_row([minute.isoformat(timespec='minutes'), fired, round(delay, 1)])
+
+    return f"{table}\n{worst}"
+
+
+# run history newest first, a line at a time. since is a span back from now (e.g. 24h, see util.duration) or a date/time,
+#   before a run id to carry on from. a page is only read once the lines before it are printed, so the first lines show
+#   right away and memory stays flat however many runs there are. limit 0 lists them all
+def runs(pipeline_name: str = '', status: str = '', since: str = '', before: int = None,
+         limit: int = 50) -> Iterator[str]:
+    try:
+        gt_cfg = util.conf()
+    except (exception.ConfigFileParseError, exception.ConfigFileNotFoundError) as e:
+        raise e
+
+    try:
+        db = Pipeline(db_path=Path(gt_cfg.sqlite_dir, gt_cfg.sqlite_app_name))
+    except exception.dbError:
+        raise
+
+    pipeline_id = _pipeline_id(pipeline_name) if pipeline_name else None
+    after = None
+    if before is not None:
+        run = db.pipeline_run(before)
+        if not run:
+            raise exception.dbError(f"No run with id {before}")
+        after = (run[6], before)
+    since = _since(since)
+
+    yield _run_line(('run ID', 'pipeline name', 'schedule ID', 'status', 'start time (ISO 8601)', 'end time (ISO 8601)'))
+    listed = 0
+    while not limit or listed < limit:
+        page_size = min(RUNS_PAGE, limit - listed) if limit else RUNS_PAGE
+        page = db.pipeline_runs(pipeline_id, status, since, after, page_size)
+        for run in page:
+            yield _run_line(run)
+        listed += len(page)
+        if len(page) < page_size:
+            break
+        after = (page[-1][4], page[-1][0])
+
+
+# per pipeline, its ended runs, the share that finished and their mean and p50/p95/p99 durations (within
+#   sketch.RELATIVE_ACCURACY). from the stats the daemon keeps as runs end, run history isn't read
+def stats(pipeline_name: str = '') -> PrettyTable:
+    try:
+        gt_cfg = util.conf()
+    except (exception.ConfigFileParseError, exception.ConfigFileNotFoundError) as e:
+        raise e
+
+    try:
+        db = Pipeline(db_path=Path(gt_cfg.sqlite_dir, gt_cfg.sqlite_app_name))
+    except exception.dbError:
+        raise
+
+    table = PrettyTable()
+    table.set_style(SINGLE_BORDER)
+    table.field_names = ['pipeline name', 'runs', 'succeeded (%)', 'mean (s)', 'p50 (s)', 'p95 (s)', 'p99 (s)']
+    pipeline_id = _pipeline_id(pipeline_name) if pipeline_name else None
+    for name, runs, succeeded, total_duration, sketch in db.pipeline_stats(pipeline_id):
+        durations = DurationSketch.loads(sketch)
+        table.add_row([name, runs, round(succeeded / runs * 100, 1), round(total_duration / runs / 1000000, 1)]
+                      + [round(durations.quantile(x), 1) for x in (0.5, 0.95, 0.99)])
+    return table
+
+
+# runs picked like gt runs picks them, oldest first, into a csv, parquet or arrow file. they're read and written
+#   EXPORT_CHUNK at a time. returns lines summing up what was exported
+def export_runs(path: str, fmt: str, pipeline_name: str = '', status: str = '', since: str = '') -> List[str]:
+    try:
+        gt_cfg = util.conf()
+    except (exception.ConfigFileParseError, exception.ConfigFileNotFoundError) as e:
+        raise e
+
+    try:
+        db = Pipeline(db_path=Path(gt_cfg.sqlite_dir, gt_cfg.sqlite_app_name))
+    except exception.dbError:
+        raise
+
+    pipeline_id = _pipeline_id(pipeline_name) if pipeline_name else None
+    chunks = db.export_pipeline_runs(pipeline_id, status, _since(since), EXPORT_CHUNK)
+    summary = export.export_runs(chunks, Path(path), fmt)
+
+    lines = [f"{summary['runs']} runs exported to {path}"]
+    lines += [f"  {status:<12} {count}" for status, count in sorted(summary['statuses'].items())]
+    if summary['mean_duration'] is not None:
+        lines.append(f"  duration (s) mean {summary['mean_duration']:.1f}, min {summary['min_duration']:.1f}, "
+                     f"max {summary['max_duration']:.1f}")
+    return lines
+
+
 def pipeline_schedule(pipeline_name: str, socket_file: Path) -> None:
     try:
         gt_cfg = util.conf()
@@ -80,6 +241,26 @@ def pipeline_schedule(pipeline_name: str, socket_file: Path) -> None:
         raise
 
 
+def pipeline_keep_days(pipeline_name: str, keep_days: int, socket_file: Path) -> None:
+
+    msg = util.craft_rpc_msg('set_pipeline_keep_days', [_pipeline_id(pipeline_name), keep_days])
+
+    try:
+        util.send_rpc_msg_to_daemon(msg, socket_file)
+    except exception.rpcError:
+        raise
+
+
+def pipeline_keep_runs(pipeline_name: str, keep_runs: int, socket_file: Path) -> None:
+
+    msg = util.craft_rpc_msg('set_pipeline_keep_runs', [_pipeline_id(pipeline_name), keep_runs])
+
+    try:
+        util.send_rpc_msg_to_daemon(msg, socket_file)
+    except exception.rpcError:
+        raise
+
+
 def gluetube_dev(msg: str, socket_file: Path) -> None:
     msg_bytes = str.encode(msg)
     msg = struct.pack('>I', len(msg_bytes)) + msg_bytes
@@ -103,6 +284,22 @@ def daemon_bg(debug: bool) -> None:
         raise
 
 
+# runs in the foreground until SIGTERM or ctrl-c, then waits for the runs it claimed to end
+def worker(slots: int) -> None:
+    try:
+        gt_cfg = util.conf()
+    except (exception.ConfigFileParseError, exception.ConfigFileNotFoundError) as e:
+        raise e
+
+    a_worker = Worker(gt_cfg, slots)
+    signal.signal(signal.SIGTERM, lambda signum, frame: a_worker.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: a_worker.stop())
+    try:
+        a_worker.run()
+    except sqlite3.Error as e:
+        raise exception.dbError(f"Worker failed. {e}") from e
+
+
 def daemon_stop(debug: bool) -> None:
     with open('/tmp/gluetube.pid', 'r', encoding="utf-8") as f:
         pid = f.readline()
@@ -137,6 +334,125 @@ def schedule_now(schedule_id: int, socket_file: Path) -> None:
         raise
 
 
+def schedule_timeout(schedule_id: int, timeout: int, socket_file: Path) -> None:
+    msg = util.craft_rpc_msg('set_schedule_timeout', [schedule_id, timeout])
+
+    try:
+        util.send_rpc_msg_to_daemon(msg, socket_file)
+    except exception.rpcError:
+        raise
+
+
+def schedule_catchup(schedule_id: int, catchup: str, socket_file: Path) -> None:
+    msg = util.craft_rpc_msg('set_schedule_catchup', [schedule_id, catchup])
+
+    try:
+        util.send_rpc_msg_to_daemon(msg, socket_file)
+    except exception.rpcError:
+        raise
+
+
+def schedule_rate_limit(schedule_id: int, rate_limit: str, socket_file: Path) -> None:
+    msg = util.craft_rpc_msg('set_schedule_rate_limit', [schedule_id, rate_limit])
+
+    try:
+        util.send_rpc_msg_to_daemon(msg, socket_file)
+    except exception.rpcError:
+        raise
+
+
+# per rate-limit pool, how often runs waited for a token and for how long. schedules with a rate of their own are
+#   a pool each
+def schedule_rate_limits() -> PrettyTable:
+    try:
+        gt_cfg = util.conf()
+    except (exception.ConfigFileParseError, exception.ConfigFileNotFoundError) as e:
+        raise e
+
+    try:
+        db = Pipeline(db_path=Path(gt_cfg.sqlite_dir, gt_cfg.sqlite_app_name))
+    except exception.dbError:
+        raise
+
+    pools = {}
+    for schedule_id, rate_limit, runs, waiting, waited, wait_total, wait_max in db.rate_limited_schedules():
+        try:
+            pool, (pool_runs, seconds) = util.rate_limit_pool(rate_limit, schedule_id, gt_cfg.rate_limits)
+        except ValueError:  # the pool was taken out of the config, its runs no longer wait
+            pool, pool_runs, seconds = rate_limit, 0, 0
+        stats = pools.setdefault(pool, [f"{pool_runs}/{seconds}s" if pool_runs else 'unknown', 0, 0, 0, 0, 0.0, 0.0])
+        stats[1] += 1
+        stats[2] += runs
+        stats[3] += waiting
+        stats[4] += waited
+        stats[5] += wait_total
+        stats[6] = max(stats[6], wait_max)
+
+    table = PrettyTable()
+    table.set_style(SINGLE_BORDER)
+    table.field_names = ['pool', 'rate', 'schedules', 'runs', 'waiting now', 'runs waited', 'mean wait (s)',
+                         'max wait (s)']
+    for pool, (rate, schedules, runs, waiting, waited, wait_total, wait_max) in sorted(pools.items()):
+        table.add_row([pool, rate, schedules, runs, waiting, waited, round(wait_total / waited, 1) if waited else 0.0,
+                       round(wait_max, 1)])
+    return table
+
+
+# runs started per minute of the hour, over the next day of cron schedules. shows how well H spreads them out
+def schedule_load_preview(hours: int = 24) -> PrettyTable:
+    try:
+        gt_cfg = util.conf()
+    except (exception.ConfigFileParseError, exception.ConfigFileNotFoundError) as e:
+        raise e
+
+    try:
+        db = Pipeline(db_path=Path(gt_cfg.sqlite_dir, gt_cfg.sqlite_app_name))
+    except exception.dbError:
+        raise
+
+    # schedules sharing a crontab share a trigger, its fire times are only worked out once
+    triggers = Counter()
+    for pipeline in db.all_pipelines_scheduling():
+        if pipeline[5] and not pipeline[7]:
+            try:
+                triggers[cron_trigger(pipeline[5], pipeline[4])] += 1
+            except ValueError:  # the daemon doesn't schedule it either
+                continue
+
+    start = datetime.now(timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+    per_minute = Counter()
+    for trigger, schedules in triggers.items():
+        for fire_time in fire_times(trigger, start, start + timedelta(hours=hours)):
+            per_minute[fire_time.minute] += schedules
+
+    table = PrettyTable()
+    table.set_style(SINGLE_BORDER)
+    table.field_names = ['minute', f"runs (next {hours}h)", '']
+    table.align[''] = 'l'
+    peak = max(per_minute.values(), default=0)
+    for minute in range(60):
+        table.add_row([f":{minute:02d}", per_minute[minute], '#' * round(40 * per_minute[minute] / peak) if peak else ''])
+    return table
+
+
+def schedule_after(schedule_id: int, upstream_schedule_id: int, on_status: str, socket_file: Path) -> None:
+    msg = util.craft_rpc_msg('set_schedule_dependency', [schedule_id, upstream_schedule_id, on_status])
+
+    try:
+        util.send_rpc_msg_to_daemon(msg, socket_file)
+    except exception.rpcError:
+        raise
+
+
+def schedule_remove_after(schedule_id: int, upstream_schedule_id: int, socket_file: Path) -> None:
+    msg = util.craft_rpc_msg('delete_schedule_dependency', [schedule_id, upstream_schedule_id])
+
+    try:
+        util.send_rpc_msg_to_daemon(msg, socket_file)
+    except exception.rpcError:
+        raise
+
+
 def schedule_delete(schedule_id: int, socket_file: Path) -> None:
     msg = util.craft_rpc_msg('delete_schedule', [schedule_id])
 
@@ -225,3 +541,34 @@ def db_rekey(socket_file: Path) -> None:
         util.send_rpc_msg_to_daemon(msg, socket_file)
     except exception.rpcError:
         raise
+
+
+# helper functions
+
+
+def _run_line(run: tuple) -> str:
+
+    run_id, name, schedule_id, status = ['' if x is None else x for x in run[:4]]
+    start_time, end_time = [x if isinstance(x, str) else util.iso_time(x) for x in run[4:]]
+    return f"{run_id:>8}  {name:<30}  {schedule_id:>11}  {status:<12}  {start_time:<32}  {end_time}"
+
+
+# microseconds since the epoch of a span ago e.g. 24h, or of a date/time. None for no since
+def _since(since: str) -> Union[int, None]:
+
+    if not since:
+        return None
+    try:
+        return util.epoch_us(datetime.now(timezone.utc) - timedelta(seconds=util.duration(since)))
+    except ValueError:
+        return util.epoch_us(convert_to_datetime(since, timezone.utc, 'since'))
+
+
+def _pipeline_id(pipeline_name: str) -> int:
+
+    gt_cfg = util.conf()
+    db = Pipeline(db_path=Path(gt_cfg.sqlite_dir, gt_cfg.sqlite_app_name))
+    pipeline_id = db.pipeline_id_from_name(pipeline_name)
+    if pipeline_id is None:
+        raise exception.dbError(f"No pipeline named {pipeline_name}")
+    return pipeline_id
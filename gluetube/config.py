@@ -6,6 +6,7 @@ import exception
 
 # python imports
 import configparser
+import re
 from pathlib import Path
 
 
@@ -43,6 +44,36 @@ class Gluetube:
         except KeyError as e:
             raise exception.ConfigFileParseError(f"Failed to lookup key, {e}, in config file") from e
 
+        # keys added after the first release fall back to a default, so older config files keep working
+        self.run_timeout = self.config['gluetube'].get('RUN_TIMEOUT', '0')
+        self.provision_workers = self.config['gluetube'].get('PROVISION_WORKERS', '2')
+        self.catchup_workers = self.config['gluetube'].get('CATCHUP_WORKERS', '4')
+        # local: the daemon runs what it schedules. queue: it queues them for gt worker processes
+        self.execution = self.config['gluetube'].get('EXECUTION', 'local')
+        # seconds a worker's claim on a run lasts without a heartbeat, before another worker may take the run over
+        self.worker_lease = self.config['gluetube'].get('WORKER_LEASE', '60')
+        # milliseconds a database connection waits on another one's write lock, before failing with 'database is locked'
+        self.sqlite_busy_timeout = self.config['gluetube'].get('SQLITE_BUSY_TIMEOUT', '5000')
+        # gitignore style patterns, separated by commas or whitespace (a multi-line value works too)
+        self.pipeline_include = re.split(r'[,\s]+', self.config['gluetube'].get('PIPELINE_INCLUDE', '*.py').strip())
+        self.pipeline_exclude = re.split(r'[,\s]+', self.config['gluetube'].get('PIPELINE_EXCLUDE', '').strip())
+        self.artifact_dir = self.config['gluetube'].get('ARTIFACT_DIR',
+                                                        Path(Path(self.sqlite_dir).parent, 'artifacts').as_posix())
+        # golden venvs that pipeline venvs are cloned from, empty builds every venv from scratch
+        self.venv_cache_dir = self.config['gluetube'].get('VENV_CACHE_DIR',
+                                                          Path(Path(self.sqlite_dir).parent, 'venvs').as_posix())
+
+        # run history: days and runs each pipeline keeps (0 keeps everything), where the runs past that go, a database
+        #   file per month (empty deletes them), and seconds between housekeeping passes
+        self.run_keep_days = self.config['gluetube'].get('RUN_KEEP_DAYS', '0')
+        self.run_keep_runs = self.config['gluetube'].get('RUN_KEEP_RUNS', '0')
+        self.run_archive_dir = self.config['gluetube'].get('RUN_ARCHIVE_DIR',
+                                                           Path(Path(self.sqlite_dir).parent, 'archive').as_posix())
+        self.housekeeping_interval = self.config['gluetube'].get('HOUSEKEEPING_INTERVAL', '3600')
+
+        # named rate-limit pools, NAME = RUNS/SPAN (see util.rate). schedules sharing a downstream system share one
+        self.rate_limits = dict(self.config['rate_limits']) if self.config.has_section('rate_limits') else {}
+
     def write(self) -> None:
 
         with open(self.cfg_path.resolve().as_posix(), 'w') as configfile:
@@ -4,44 +4,110 @@
 # local imports
 import exception
 import util
+from sketch import DurationSketch
 
 # python imports
 import sqlite3
+import threading
+import os
+import re
 from pathlib import Path
-from typing import Union, List, Tuple
+from typing import Callable, Iterator, Union, List, Tuple
+from datetime import datetime, timedelta, timezone
+from contextlib import contextmanager
 import base64
 
+# pragma busy_timeout of every connection, in milliseconds. see set_busy_timeout
+_busy_timeout = 5000
+
+# the ISO 8601 times runs had before they were epoch microseconds, see _epoch_us_from_iso
+_ISO_TIME = re.compile(r'(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?(Z|[+-]\d{2}:?\d{2})?$')
+
+# per thread, the connections of pooled databases, (database file, read only): (connection, file identity,
+#   transaction state)
+_pool = threading.local()
+
+
+# the transaction a connection is in, shared by every database on that connection. a pooled connection has one
+#   database per caller on the thread, nesting their transactions into one unit of work
+class _TransactionState:
+
+    def __init__(self) -> None:
+
+        self.depth = 0  # of nested transactions
+        self.after_commit = []  # of the outermost transaction, see Database.after_commit
+
 
 class Database:
     _conn = None
 
-    def __init__(self, db_path: Path = Path('.'), read_only: bool = True, in_memory: bool = False) -> None:
+    # a pooled database reuses the connection this thread opened to the same file before, see _pooled_connection
+    def __init__(self, db_path: Path = Path('.'), read_only: bool = True, in_memory: bool = False,
+                 pooled: bool = False) -> None:
 
+        self._pooled = pooled and not in_memory
+        self._tx = _TransactionState()
         if in_memory:
             self._conn = sqlite3.connect("file::memory:")
             self._conn.execute('pragma journal_mode=wal;')
             self._conn.execute('pragma foreign_keys=ON;')
+        elif self._pooled:
+            self._conn, self._tx = _pooled_connection(db_path, read_only)
         else:
-            if read_only:
-                self._conn = sqlite3.connect(f"{db_path.absolute().as_uri()}?mode=ro", uri=True)
-            else:
-                self._conn = sqlite3.connect(db_path.absolute().as_posix())
-                self._conn.execute('pragma journal_mode=wal;')
-                self._conn.execute('pragma foreign_keys=ON;')
+            self._conn = _connect(db_path, read_only)
 
+    # a pooled connection stays open for the next database on this thread
     def close(self) -> None:
 
-        self._conn.close()
+        if not self._pooled:
+            self._conn.close()
+
+    # a unit of work. the writes made inside it are committed together when it ends, or rolled back if it raises.
+    #   transactions nest, only the outermost one commits
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+
+        self._tx.depth += 1
+        try:
+            yield
+        except BaseException:
+            self._tx.depth -= 1
+            if not self._tx.depth:
+                self._conn.rollback()
+                self._tx.after_commit = []
+            raise
+        self._tx.depth -= 1
+        if not self._tx.depth:
+            self._conn.commit()
+            after_commit, self._tx.after_commit = self._tx.after_commit, []
+            for func in after_commit:
+                func()
+
+    # func is called once the writes made so far are committed, right away outside of a transaction. for work outside
+    #   of the database (e.g. removing files) that must not happen if the transaction is rolled back
+    def after_commit(self, func: Callable[[], None]) -> None:
+
+        if self._tx.depth:
+            self._tx.after_commit.append(func)
+        else:
+            func()
+
+    # every write method ends with this, outside of a transaction each write is committed on its own
+    def _commit(self) -> None:
+
+        if not self._tx.depth:
+            self._conn.commit()
 
 
 class Store(Database):
     sys_password = None
 
-    def __init__(self, sys_password: base64.urlsafe_b64encode, db_path: Path = Path('.'), read_only: bool = True, in_memory: bool = False) -> None:
+    def __init__(self, sys_password: base64.urlsafe_b64encode, db_path: Path = Path('.'), read_only: bool = True, in_memory: bool = False,
+                 pooled: bool = False) -> None:
 
         self.sys_password = sys_password
 
-        super().__init__(db_path, read_only, in_memory)
+        super().__init__(db_path, read_only, in_memory, pooled)
 
     def create_table(self, table: str) -> None:
 
@@ -51,7 +117,7 @@ class Store(Database):
                 value TEXT NOT NULL CHECK (value != ''),
                 salt TEXT NOT NULL CHECK (salt != '')
             )""")
-        self._conn.commit()
+        self._commit()
 
     def all_key_values(self, table: str) -> list:
 
@@ -89,7 +155,17 @@ class Store(Database):
             encrypted_data, salt = util.encrypt(value, self.sys_password)
             params = (key, encrypted_data, salt)
             self._conn.cursor().execute(query, params)
-            self._conn.commit()
+            self._commit()
+        except sqlite3.IntegrityError as e:
+            raise exception.dbError(f"Failed database insert. {e}") from e
+
+    def insert_key_values(self, table: str, key_values: List[Tuple[str, str]]) -> None:
+
+        try:
+            query = f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?)"
+            params = [(key, *util.encrypt(value, self.sys_password)) for key, value in key_values]
+            self._conn.cursor().executemany(query, params)
+            self._commit()
         except sqlite3.IntegrityError as e:
             raise exception.dbError(f"Failed database insert. {e}") from e
 
@@ -98,22 +174,31 @@ class Store(Database):
         query = f"DELETE FROM {table} WHERE key = ?"
         params = (key,)
         self._conn.cursor().execute(query, params)
-        self._conn.commit()
+        self._commit()
 
 
 class Pipeline(Database):
 
     def create_schema(self) -> None:
 
+        # run history is moved out and deleted all the time (see housekeeping), incremental vacuum gives the freed
+        #   pages back to the filesystem. a database of an older gluetube is vacuumed once, to take the setting
+        if self._conn.execute('pragma auto_vacuum').fetchone()[0] != 2:
+            self._conn.execute('pragma auto_vacuum=INCREMENTAL')
+            self._conn.execute('VACUUM')
+
         self._conn.cursor().execute("""
             CREATE TABLE IF NOT EXISTS pipeline(
                 id INTEGER PRIMARY KEY NOT NULL,
                 name TEXT UNIQUE NOT NULL CHECK (name != ''),
                 py_name TEXT NOT NULL CHECK (py_name != ''),
                 dir_name TEXT NOT NULL CHECK (dir_name != ''),
-                py_timestamp REAL NOT NULL CHECK (py_timestamp != '')
+                py_timestamp REAL NOT NULL CHECK (py_timestamp != ''),
+                env_status TEXT,
+                keep_days INTEGER,
+                keep_runs INTEGER
             )""")
-        self._conn.commit()
+        self._commit()
 
         self._conn.cursor().execute("""
             CREATE TABLE IF NOT EXISTS pipeline_schedule(
@@ -126,6 +211,9 @@ class Pipeline(Database):
                 retry_num INTEGER,
                 max_retries INTEGER,
                 latest_run INTEGER,
+                timeout INTEGER,
+                catchup TEXT,
+                rate_limit TEXT,
                 CHECK(
                     ((cron IS NULL OR cron = '') AND (at IS NULL OR at = ''))
                     OR
@@ -138,10 +226,224 @@ class Pipeline(Database):
                     REFERENCES pipeline(id)
                     ON DELETE CASCADE
             )""")
-        self._conn.commit()
+        self._commit()
+
+        # columns added to tables after the first release, for databases created by an older gluetube
+        self._add_column('pipeline', 'env_status', 'TEXT')
+
+        # a py file is one pipeline. a database from before this index may hold the same one twice, only the first
+        #   of them is kept
+        if not self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'py_name_dir_name_index'").fetchone():
+            with self.transaction():
+                self._conn.execute(
+                    "DELETE FROM pipeline WHERE id NOT IN (SELECT MIN(id) FROM pipeline GROUP BY py_name, dir_name)")
+                self._conn.execute("CREATE UNIQUE INDEX py_name_dir_name_index ON pipeline (py_name, dir_name)")
+        self._add_column('pipeline', 'keep_days', 'INTEGER')
+        self._add_column('pipeline', 'keep_runs', 'INTEGER')
+        self._add_column('pipeline_schedule', 'timeout', 'INTEGER')
+        self._add_column('pipeline_schedule', 'catchup', 'TEXT')
+        self._add_column('pipeline_schedule', 'rate_limit', 'TEXT')
+
+        self._create_pipeline_run('pipeline_run')
+        self._commit()
+
+        # seconds a run waited for a rate-limit token, before its start_time
+        self._add_column('pipeline_run', 'rate_limit_wait', 'REAL')
+
+        # run times were ISO 8601 text before they were epoch microseconds
+        if self._column_type('main', 'pipeline_run', 'start_time') == 'TEXT':
+            self._migrate_run_times('main', 'pipeline_run', self._create_pipeline_run)
+
+        # run history is read newest first, by pipeline or by status (see pipeline_runs). the rowid is the last column
+        #   of every index, so (start_time, id) order comes straight off them
+        self._conn.cursor().execute("""
+            CREATE INDEX IF NOT EXISTS pipeline_id_start_time_index ON pipeline_run (pipeline_id, start_time)
+            """)
+        self._commit()
 
         self._conn.cursor().execute("""
-            CREATE TABLE IF NOT EXISTS pipeline_run(
+            CREATE INDEX IF NOT EXISTS status_start_time_index ON pipeline_run (status, start_time)
+            """)
+        self._commit()
+
+        self._conn.cursor().execute("""
+            CREATE INDEX IF NOT EXISTS start_time_index ON pipeline_run (start_time)
+            """)
+        self._commit()
+
+        # pipeline_id is the prefix of pipeline_id_start_time_index, and nothing looks runs up by stage
+        self._conn.cursor().execute("DROP INDEX IF EXISTS pipeline_id_index")
+        self._conn.cursor().execute("DROP INDEX IF EXISTS stage_index")
+        self._commit()
+
+        # a schedule fires once every upstream schedule has finished with the given status since it last fired
+        #   satisfied_run is the upstream run that satisfied the dependency, NULL while still waiting
+        self._conn.cursor().execute("""
+            CREATE TABLE IF NOT EXISTS pipeline_schedule_dependency(
+                id INTEGER PRIMARY KEY NOT NULL,
+                schedule_id INTEGER NOT NULL,
+                upstream_schedule_id INTEGER NOT NULL,
+                on_status TEXT NOT NULL CHECK (on_status != ''),
+                satisfied_run INTEGER,
+                UNIQUE(schedule_id, upstream_schedule_id),
+                CHECK(schedule_id != upstream_schedule_id),
+                CONSTRAINT fk_pipelinescheduledependency_pipeline_schedule
+                    FOREIGN KEY(schedule_id)
+                    REFERENCES pipeline_schedule(id)
+                    ON DELETE CASCADE,
+                CONSTRAINT fk_pipelinescheduledependency_upstream_pipeline_schedule
+                    FOREIGN KEY(upstream_schedule_id)
+                    REFERENCES pipeline_schedule(id)
+                    ON DELETE CASCADE
+            )""")
+        self._commit()
+
+        self._conn.cursor().execute("""
+            CREATE INDEX IF NOT EXISTS upstream_schedule_id_index ON pipeline_schedule_dependency (upstream_schedule_id)
+            """)
+        self._commit()
+
+        # artifact files live on disk, these rows tie them to the run that published them
+        self._conn.cursor().execute("""
+            CREATE TABLE IF NOT EXISTS pipeline_artifact(
+                id INTEGER PRIMARY KEY NOT NULL,
+                run_id INTEGER NOT NULL,
+                name TEXT NOT NULL CHECK (name != ''),
+                size INTEGER NOT NULL,
+                UNIQUE(run_id, name),
+                CONSTRAINT fk_pipelineartifact_pipeline_run
+                    FOREIGN KEY(run_id)
+                    REFERENCES pipeline_run(id)
+                    ON DELETE CASCADE
+            )""")
+        self._commit()
+
+        # fires waiting for a worker (gt worker), or claimed by one. a claim is a lease the worker keeps renewing,
+        #   one that ran out belongs to a dead worker and can be claimed again. times are epoch seconds
+        self._conn.cursor().execute("""
+            CREATE TABLE IF NOT EXISTS run_queue(
+                id INTEGER PRIMARY KEY NOT NULL,
+                schedule_id INTEGER UNIQUE NOT NULL,
+                queued_at REAL NOT NULL,
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                CONSTRAINT fk_runqueue_pipeline_schedule
+                    FOREIGN KEY(schedule_id)
+                    REFERENCES pipeline_schedule(id)
+                    ON DELETE CASCADE
+            )""")
+        self._commit()
+
+        # one token bucket per rate-limit pool, see take_rate_limit_token. updated is epoch seconds
+        self._conn.cursor().execute("""
+            CREATE TABLE IF NOT EXISTS rate_limit_bucket(
+                pool TEXT PRIMARY KEY NOT NULL,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            )""")
+        self._commit()
+
+        # derived from pipeline_run, one from before run times were epoch microseconds is simply made again
+        if self._column_type('main', 'schedule_state', 'start_time') == 'TEXT':
+            self._conn.cursor().execute("DROP TABLE schedule_state")
+        new_state = not self._conn.cursor().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schedule_state'").fetchone()
+
+        # the latest run of each schedule, what the summary shows, so it's read without going through run history.
+        #   triggers keep it current whoever writes the runs (the daemon, or a worker). next_fire_time is the
+        #   scheduler's, it's kept by the daemon (update_schedule_state_next_fire_times)
+        self._conn.cursor().execute("""
+            CREATE TABLE IF NOT EXISTS schedule_state(
+                schedule_id INTEGER PRIMARY KEY NOT NULL,
+                run_id INTEGER,
+                status TEXT,
+                stage_msg TEXT,
+                start_time INTEGER,
+                end_time INTEGER,
+                consecutive_failures INTEGER NOT NULL DEFAULT 0,
+                next_fire_time TEXT,
+                CONSTRAINT fk_schedulestate_pipeline_schedule
+                    FOREIGN KEY(schedule_id)
+                    REFERENCES pipeline_schedule(id)
+                    ON DELETE CASCADE
+            )""")
+        self._conn.cursor().execute("""
+            CREATE TRIGGER IF NOT EXISTS schedule_state_schedule_insert AFTER INSERT ON pipeline_schedule
+            BEGIN
+                INSERT OR IGNORE INTO schedule_state (schedule_id) VALUES (NEW.id);
+            END""")
+        self._conn.cursor().execute("""
+            CREATE TRIGGER IF NOT EXISTS schedule_state_run_insert AFTER INSERT ON pipeline_run
+            BEGIN
+                UPDATE schedule_state
+                SET run_id = NEW.id, status = NEW.status, stage_msg = NEW.stage_msg, start_time = NEW.start_time,
+                    end_time = NEW.end_time
+                WHERE schedule_id = NEW.schedule_id;
+            END""")
+        # a run that ends crashed or timed out adds to the failures in a row, any other ending starts them over
+        self._conn.cursor().execute("""
+            CREATE TRIGGER IF NOT EXISTS schedule_state_run_update
+            AFTER UPDATE OF status, stage_msg, start_time, end_time ON pipeline_run
+            BEGIN
+                UPDATE schedule_state
+                SET status = NEW.status, stage_msg = NEW.stage_msg, start_time = NEW.start_time, end_time = NEW.end_time,
+                    consecutive_failures = CASE
+                        WHEN OLD.end_time IS NOT NULL OR NEW.end_time IS NULL THEN consecutive_failures
+                        WHEN NEW.status IN ('crashed', 'timed_out') THEN consecutive_failures + 1
+                        ELSE 0
+                    END
+                WHERE schedule_id = NEW.schedule_id AND run_id = NEW.id;
+            END""")
+        # schedules from before the table, with their newest run. only once, it reads the whole run history
+        if new_state:
+            self._conn.cursor().execute("""
+                INSERT OR IGNORE INTO schedule_state (schedule_id, run_id, status, stage_msg, start_time, end_time)
+                SELECT pipeline_schedule.id, pipeline_run.id, pipeline_run.status, pipeline_run.stage_msg,
+                    pipeline_run.start_time, pipeline_run.end_time
+                FROM pipeline_schedule
+                LEFT JOIN (SELECT schedule_id, MAX(id) AS id FROM pipeline_run GROUP BY schedule_id) AS newest
+                ON pipeline_schedule.id = newest.schedule_id
+                LEFT JOIN pipeline_run
+                ON newest.id = pipeline_run.id
+                """)
+        self._commit()
+
+        new_stats = not self._conn.cursor().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'pipeline_stats'").fetchone()
+
+        # per pipeline, what its ended runs add up to, kept as each run ends (see add_pipeline_stats) so stats never
+        #   go through run history. total_duration is in microseconds, sketch the durations (see sketch.DurationSketch)
+        self._conn.cursor().execute("""
+            CREATE TABLE IF NOT EXISTS pipeline_stats(
+                pipeline_id INTEGER PRIMARY KEY NOT NULL,
+                runs INTEGER NOT NULL DEFAULT 0,
+                succeeded INTEGER NOT NULL DEFAULT 0,
+                total_duration INTEGER NOT NULL DEFAULT 0,
+                sketch TEXT NOT NULL,
+                CONSTRAINT fk_pipelinestats_pipeline
+                    FOREIGN KEY(pipeline_id)
+                    REFERENCES pipeline(id)
+                    ON DELETE CASCADE
+            )""")
+        # pipelines from before the table, from the runs they have. only once, it reads the whole run history
+        if new_stats:
+            stats = {}
+            for pipeline_id, status, duration in self._conn.cursor().execute(
+                    "SELECT pipeline_id, status, duration FROM pipeline_run WHERE end_time IS NOT NULL"):
+                stats.setdefault(pipeline_id, [0, 0, 0, DurationSketch()])
+                _add_run(stats[pipeline_id], status, duration)
+            self._conn.cursor().executemany(
+                "INSERT INTO pipeline_stats (pipeline_id, runs, succeeded, total_duration, sketch) VALUES (?, ?, ?, ?, ?)",
+                [(x, runs, succeeded, total, sketch.dumps()) for x, (runs, succeeded, total, sketch) in stats.items()])
+        self._commit()
+
+    # start_time and end_time are microseconds since the epoch (see util.epoch_us), end_time is NULL until the run ends.
+    #   as integers, ranges and durations are plain arithmetic on what the indexes hold
+    def _create_pipeline_run(self, table: str) -> None:
+
+        self._conn.cursor().execute(f"""
+            CREATE TABLE IF NOT EXISTS {table}(
                 id INTEGER PRIMARY KEY NOT NULL,
                 pipeline_id INTEGER NOT NULL,
                 schedule_id INTEGER NOT NULL,
@@ -149,8 +451,10 @@ class Pipeline(Database):
                 stage INTEGER,
                 stage_msg TEXT,
                 exit_msg TEXT,
-                start_time TEXT NOT NULL CHECK (start_time != ''),
-                end_time TEXT,
+                start_time INTEGER NOT NULL CHECK (typeof(start_time) = 'integer'),
+                end_time INTEGER CHECK (end_time IS NULL OR typeof(end_time) = 'integer'),
+                rate_limit_wait REAL,
+                duration INTEGER GENERATED ALWAYS AS (end_time - start_time) VIRTUAL,
                 CONSTRAINT fk_piplinerun_pipeline
                     FOREIGN KEY(pipeline_id)
                     REFERENCES pipeline(id)
@@ -160,33 +464,55 @@ class Pipeline(Database):
                     REFERENCES pipeline_schedule(id)
                     ON DELETE CASCADE
             )""")
-        self._conn.commit()
 
-        # pre-optimization, i know i know
-        self._conn.cursor().execute("""
-            CREATE INDEX IF NOT EXISTS pipeline_id_index ON pipeline_run (pipeline_id)
-            """)
-        self._conn.commit()
+    def _column_type(self, schema: str, table: str, column: str) -> Union[str, None]:
 
-        self._conn.cursor().execute("""
-            CREATE INDEX IF NOT EXISTS stage_index ON pipeline_run (stage)
-            """)
-        self._conn.commit()
+        for column_info in self._conn.cursor().execute(f"PRAGMA {schema}.table_info({table})").fetchall():
+            if column_info[1] == column:
+                return column_info[2]
+        return None
 
-        self._conn.cursor().execute("""
-            CREATE INDEX IF NOT EXISTS start_time_index ON pipeline_run (start_time)
-            """)
-        self._conn.commit()
+    # copies a table of runs into a new one, made by create(name), with the ISO 8601 start and end times as epoch
+    #   microseconds, then puts the copy in its place. all of it or nothing. a time that doesn't parse starts at the
+    #   epoch, or hasn't ended. the indexes and triggers of the table go with it, create_schema makes them again
+    def _migrate_run_times(self, schema: str, table: str, create: Callable[[str], None]) -> None:
+
+        columns = [x[1] for x in self._conn.cursor().execute(f"PRAGMA {schema}.table_info({table})").fetchall()]
+        selected = [f"epoch_us({x}, {0 if x == 'start_time' else 'NULL'})" if x in ('start_time', 'end_time') else x
+                    for x in columns]
+
+        self._conn.create_function('epoch_us', 2, _epoch_us_from_iso)
+        self._conn.execute('pragma foreign_keys=OFF')  # dropping the old table must not cascade, a no-op in a transaction
+        try:
+            with self.transaction():
+                self._conn.cursor().execute(f"DROP TABLE IF EXISTS {schema}.{table}_epoch")
+                create(f"{schema}.{table}_epoch")
+                self._conn.cursor().execute(f"""
+                    INSERT INTO {schema}.{table}_epoch ({', '.join(columns)})
+                    SELECT {', '.join(selected)} FROM {schema}.{table}
+                    """)
+                self._conn.cursor().execute(f"DROP TABLE {schema}.{table}")
+                self._conn.cursor().execute(f"ALTER TABLE {schema}.{table}_epoch RENAME TO {table}")
+        finally:
+            self._conn.execute('pragma foreign_keys=ON')
+
+    def _add_column(self, table: str, column: str, definition: str) -> None:
+
+        # CREATE TABLE IF NOT EXISTS leaves an existing table alone, so new columns are added explicitly
+        columns = [x[1] for x in self._conn.cursor().execute(f"PRAGMA table_info({table})").fetchall()]
+        if column not in columns:
+            self._conn.cursor().execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            self._commit()
 
     # pipeline writes
 
     def insert_pipeline(self, name: str, py_name: str, dir_name: str, py_timestamp: str) -> int:
 
         try:
-            query = "INSERT INTO pipeline VALUES (NULL, ?, ?, ?, ?)"
+            query = "INSERT INTO pipeline (name, py_name, dir_name, py_timestamp) VALUES (?, ?, ?, ?)"
             params = (name, py_name, dir_name, py_timestamp)
             rowid = self._conn.cursor().execute(query, params).lastrowid
-            self._conn.commit()
+            self._commit()
             return rowid
         except sqlite3.IntegrityError as e:
             raise exception.dbError(f"Failed database insert. {e}") from e
@@ -196,21 +522,51 @@ class Pipeline(Database):
         query = "DELETE FROM pipeline WHERE id = ?"
         params = (pipeline_id,)
         self._conn.cursor().execute(query, params)
-        self._conn.commit()
+        self._commit()
 
     def update_pipeline_name(self, pipeline_id: int, name: str) -> None:
 
         query = "UPDATE pipeline SET name = ? WHERE id = ?"
         params = (name, pipeline_id)
         self._conn.cursor().execute(query, params)
-        self._conn.commit()
+        self._commit()
 
     def update_pipeline_py_timestamp(self, pipeline_id: int, timestamp: str) -> None:
 
         query = "UPDATE pipeline SET py_timestamp = ? WHERE id = ?"
         params = (timestamp, pipeline_id)
         self._conn.cursor().execute(query, params)
-        self._conn.commit()
+        self._commit()
+
+    # pipelines share the environment of their directory
+    def update_pipeline_env_status(self, dir_name: str, status: str) -> None:
+
+        query = "UPDATE pipeline SET env_status = ? WHERE dir_name = ?"
+        params = (status, dir_name)
+        self._conn.cursor().execute(query, params)
+        self._commit()
+
+    def update_pipeline_env_statuses(self, dir_names: List[str], status: str) -> None:
+
+        query = "UPDATE pipeline SET env_status = ? WHERE dir_name = ?"
+        params = [(status, x) for x in dir_names]
+        self._conn.cursor().executemany(query, params)
+        self._commit()
+
+    # days and runs of history a pipeline keeps, 0 falls back to the global RUN_KEEP_DAYS and RUN_KEEP_RUNS
+    def update_pipeline_keep_days(self, pipeline_id: int, keep_days: int) -> None:
+
+        query = "UPDATE pipeline SET keep_days = ? WHERE id = ?"
+        params = (keep_days, pipeline_id)
+        self._conn.cursor().execute(query, params)
+        self._commit()
+
+    def update_pipeline_keep_runs(self, pipeline_id: int, keep_runs: int) -> None:
+
+        query = "UPDATE pipeline SET keep_runs = ? WHERE id = ?"
+        params = (keep_runs, pipeline_id)
+        self._conn.cursor().execute(query, params)
+        self._commit()
 
     # pipeline_schedule writes
 
@@ -219,16 +575,21 @@ class Pipeline(Database):
         query = "DELETE FROM pipeline_schedule WHERE id = ?"
         params = (schedule_id,)
         self._conn.cursor().execute(query, params)
-        self._conn.commit()
+        self._commit()
 
     def insert_pipeline_schedule(self, pipeline_id: int, cron: str = '', at: str = '', paused: int = 0,
-                                 retry_on_crash: int = 0, retry_num: int = 0, max_retries: int = 0) -> int:
+                                 retry_on_crash: int = 0, retry_num: int = 0, max_retries: int = 0,
+                                 timeout: int = 0) -> int:
 
         try:
-            query = "INSERT INTO pipeline_schedule VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, NULL)"
-            params = (pipeline_id, cron, at, paused, retry_on_crash, retry_num, max_retries)
+            query = """
+                INSERT INTO pipeline_schedule
+                    (pipeline_id, cron, at, paused, retry_on_crash, retry_num, max_retries, timeout)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """
+            params = (pipeline_id, cron, at, paused, retry_on_crash, retry_num, max_retries, timeout)
             rowid = self._conn.cursor().execute(query, params).lastrowid
-            self._conn.commit()
+            self._commit()
             return rowid
         except sqlite3.IntegrityError as e:
             raise exception.dbError(f"Failed database insert. {e}") from e
@@ -239,7 +600,7 @@ class Pipeline(Database):
             query = "UPDATE pipeline_schedule SET cron = ? WHERE id = ?"
             params = (cron, schedule_id)
             self._conn.cursor().execute(query, params)
-            self._conn.commit()
+            self._commit()
         except sqlite3.IntegrityError as e:
             raise exception.dbError(f"Failed database insert. {e}") from e
 
@@ -249,7 +610,7 @@ class Pipeline(Database):
             query = "UPDATE pipeline_schedule SET at = ? WHERE id = ?"
             params = (at, schedule_id)
             self._conn.cursor().execute(query, params)
-            self._conn.commit()
+            self._commit()
         except sqlite3.IntegrityError as e:
             raise exception.dbError(f"Failed database insert. {e}") from e
 
@@ -258,45 +619,118 @@ class Pipeline(Database):
         query = "UPDATE pipeline_schedule SET paused = ? WHERE id = ?"
         params = (paused, schedule_id)
         self._conn.cursor().execute(query, params)
-        self._conn.commit()
+        self._commit()
 
     def update_pipeline_schedule_retry_on_crash(self, schedule_id: int, retry_on_crash: int) -> None:
 
         query = "UPDATE pipeline_schedule SET retry_on_crash = ? WHERE id = ?"
         params = (retry_on_crash, schedule_id)
         self._conn.cursor().execute(query, params)
-        self._conn.commit()
+        self._commit()
 
     def update_pipeline_schedule_retry_num(self, schedule_id: int, retry_num: int) -> None:
 
         query = "UPDATE pipeline_schedule SET retry_num = ? WHERE id = ?"
         params = (retry_num, schedule_id)
         self._conn.cursor().execute(query, params)
-        self._conn.commit()
+        self._commit()
 
     def update_pipeline_schedule_max_retries(self, schedule_id: int, max_retries: int) -> None:
 
         query = "UPDATE pipeline_schedule SET max_retries = ? WHERE id = ?"
         params = (max_retries, schedule_id)
         self._conn.cursor().execute(query, params)
-        self._conn.commit()
+        self._commit()
+
+    def update_pipeline_schedule_timeout(self, schedule_id: int, timeout: int) -> None:
+
+        query = "UPDATE pipeline_schedule SET timeout = ? WHERE id = ?"
+        params = (timeout, schedule_id)
+        self._conn.cursor().execute(query, params)
+        self._commit()
+
+    def update_pipeline_schedule_catchup(self, schedule_id: int, catchup: str) -> None:
+
+        query = "UPDATE pipeline_schedule SET catchup = ? WHERE id = ?"
+        params = (catchup, schedule_id)
+        self._conn.cursor().execute(query, params)
+        self._commit()
+
+    def update_pipeline_schedule_rate_limit(self, schedule_id: int, rate_limit: str) -> None:
+
+        query = "UPDATE pipeline_schedule SET rate_limit = ? WHERE id = ?"
+        params = (rate_limit, schedule_id)
+        self._conn.cursor().execute(query, params)
+        self._commit()
 
     def update_pipeline_schedule_latest_run(self, schedule_id: int, run_id: int) -> None:
 
         query = "UPDATE pipeline_schedule SET latest_run = ? WHERE id = ?"
         params = (run_id, schedule_id)
         self._conn.cursor().execute(query, params)
-        self._conn.commit()
+        self._commit()
+
+    # schedule_state writes, the rest is kept by triggers
+
+    # (next_fire_time, schedule_id), an ISO 8601 time or None for a schedule without a job
+    def update_schedule_state_next_fire_times(self, next_fire_times: List[Tuple[Union[str, None], int]]) -> None:
+
+        query = "UPDATE schedule_state SET next_fire_time = ? WHERE schedule_id = ?"
+        self._conn.cursor().executemany(query, next_fire_times)
+        self._commit()
+
+    # pipeline_schedule_dependency writes
+
+    def insert_pipeline_schedule_dependency(self, schedule_id: int, upstream_schedule_id: int,
+                                            on_status: str = 'finished') -> int:
+
+        try:
+            query = """
+                INSERT OR REPLACE INTO pipeline_schedule_dependency (schedule_id, upstream_schedule_id, on_status)
+                VALUES (?, ?, ?)
+            """
+            params = (schedule_id, upstream_schedule_id, on_status)
+            rowid = self._conn.cursor().execute(query, params).lastrowid
+            self._commit()
+            return rowid
+        except sqlite3.IntegrityError as e:
+            raise exception.dbError(f"Failed database insert. {e}") from e
+
+    def delete_pipeline_schedule_dependency(self, schedule_id: int, upstream_schedule_id: int) -> None:
+
+        query = "DELETE FROM pipeline_schedule_dependency WHERE schedule_id = ? AND upstream_schedule_id = ?"
+        params = (schedule_id, upstream_schedule_id)
+        self._conn.cursor().execute(query, params)
+        self._commit()
+
+    def update_pipeline_schedule_dependency_satisfied_run(self, dependency_id: int, run_id: int) -> None:
+
+        query = "UPDATE pipeline_schedule_dependency SET satisfied_run = ? WHERE id = ?"
+        params = (run_id, dependency_id)
+        self._conn.cursor().execute(query, params)
+        self._commit()
+
+    def reset_pipeline_schedule_dependencies(self, schedule_id: int) -> None:
+
+        query = "UPDATE pipeline_schedule_dependency SET satisfied_run = NULL WHERE schedule_id = ?"
+        params = (schedule_id,)
+        self._conn.cursor().execute(query, params)
+        self._commit()
 
     # pipeline_run writes
 
-    def insert_pipeline_run(self, pipeline_id: int, schedule_id: int, status: str = '', start_time: str = '') -> int:
+    # a rate_limited run has the seconds it's going to wait for its token as rate_limit_wait, until it starts
+    def insert_pipeline_run(self, pipeline_id: int, schedule_id: int, status: str = '', start_time: int = None,
+                            rate_limit_wait: float = None) -> int:
 
         try:
-            query = "INSERT INTO pipeline_run VALUES (NULL, ?, ?, ?, NULL, NULL, NULL, ?, NULL)"
-            params = (pipeline_id, schedule_id, status, start_time)
+            query = """
+                INSERT INTO pipeline_run (pipeline_id, schedule_id, status, start_time, rate_limit_wait)
+                VALUES (?, ?, ?, ?, ?)
+            """
+            params = (pipeline_id, schedule_id, status, start_time, rate_limit_wait)
             rowid = self._conn.cursor().execute(query, params).lastrowid
-            self._conn.commit()
+            self._commit()
             return rowid
         except sqlite3.IntegrityError as e:
             raise exception.dbError(f"Failed database insert. {e}") from e
@@ -306,65 +740,271 @@ class Pipeline(Database):
         query = "UPDATE pipeline_run SET status = ? WHERE id = ?"
         params = (status, pipeline_run_id)
         self._conn.cursor().execute(query, params)
-        self._conn.commit()
+        self._commit()
 
     def update_pipeline_run_stage(self, pipeline_run_id: int, stage: int) -> None:
 
         query = "UPDATE pipeline_run SET stage = ? WHERE id = ?"
         params = (stage, pipeline_run_id)
         self._conn.cursor().execute(query, params)
-        self._conn.commit()
+        self._commit()
 
     def update_pipeline_run_stage_msg(self, pipeline_run_id: int, msg: str) -> None:
 
         query = "UPDATE pipeline_run SET stage_msg = ? WHERE id = ?"
         params = (msg, pipeline_run_id)
         self._conn.cursor().execute(query, params)
-        self._conn.commit()
+        self._commit()
 
     def update_pipeline_run_exit_msg(self, pipeline_run_id: int, msg: str) -> None:
 
         query = "UPDATE pipeline_run SET exit_msg = ? WHERE id = ?"
         params = (msg, pipeline_run_id)
         self._conn.cursor().execute(query, params)
-        self._conn.commit()
+        self._commit()
 
-    def update_pipeline_run_end_time(self, pipeline_run_id: int, end_time: str) -> None:
+    def update_pipeline_run_end_time(self, pipeline_run_id: int, end_time: int) -> None:
 
         query = "UPDATE pipeline_run SET end_time = ? WHERE id = ?"
         params = (end_time, pipeline_run_id)
         self._conn.cursor().execute(query, params)
-        self._conn.commit()
+        self._commit()
+
+    # pipeline_artifact writes
+
+    def insert_pipeline_artifact(self, run_id: int, name: str, size: int) -> int:
+
+        try:
+            query = "INSERT OR REPLACE INTO pipeline_artifact (run_id, name, size) VALUES (?, ?, ?)"
+            params = (run_id, name, size)
+            rowid = self._conn.cursor().execute(query, params).lastrowid
+            self._commit()
+            return rowid
+        except sqlite3.IntegrityError as e:
+            raise exception.dbError(f"Failed database insert. {e}") from e
+
+    # run_queue writes
+
+    # a schedule already queued, or still running on a worker, isn't queued again. same as a local run still going
+    def enqueue_run(self, schedule_id: int, queued_at: float) -> bool:
+
+        query = "INSERT OR IGNORE INTO run_queue (schedule_id, queued_at) VALUES (?, ?)"
+        params = (schedule_id, queued_at)
+        rowcount = self._conn.cursor().execute(query, params).rowcount
+        self._commit()
+        return rowcount == 1
+
+    # the oldest fire nobody holds a lease on. the update only wins if no other worker claimed it in between
+    def claim_run(self, worker: str, now: float, lease_expires: float) -> Union[Tuple[int, int, int], None]:
+
+        while True:
+            row = self._conn.cursor().execute("""
+                SELECT id, schedule_id, attempts FROM run_queue
+                WHERE lease_expires IS NULL OR lease_expires < ?
+                ORDER BY id LIMIT 1
+            """, (now,)).fetchone()
+            if not row:
+                return None
+
+            query = """
+                UPDATE run_queue SET worker = ?, lease_expires = ?, attempts = attempts + 1
+                WHERE id = ? AND (lease_expires IS NULL OR lease_expires < ?)
+            """
+            params = (worker, lease_expires, row[0], now)
+            rowcount = self._conn.cursor().execute(query, params).rowcount
+            self._commit()
+            if rowcount == 1:
+                return row[0], row[1], row[2] + 1
+
+    def renew_run_leases(self, worker: str, queue_ids: List[int], lease_expires: float) -> None:
+
+        with self.transaction():
+            self._conn.cursor().executemany(
+                "UPDATE run_queue SET lease_expires = ? WHERE id = ? AND worker = ?",
+                [(lease_expires, x, worker) for x in queue_ids]
+            )
+
+    def delete_queued_run(self, queue_id: int, worker: str) -> None:
+
+        query = "DELETE FROM run_queue WHERE id = ? AND worker = ?"
+        params = (queue_id, worker)
+        self._conn.cursor().execute(query, params)
+        self._commit()
+
+    # rate_limit_bucket writes
+
+    # a pool refills at runs / seconds tokens a second, up to runs. a taker always gets a token, if need be one that's
+    #   only there in the future: the bucket goes below zero and the seconds until its token is there are returned.
+    #   takers get their turn in the order they came, across the daemon and every worker
+    def take_rate_limit_token(self, pool: str, runs: int, seconds: int, now: float) -> float:
+
+        # the write lock is taken before the read, two takers never see the same tokens
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self._conn.cursor().execute(
+                "SELECT tokens, updated FROM rate_limit_bucket WHERE pool = ?", (pool,)
+            ).fetchone()
+            if row:
+                now = max(now, row[1])  # another host's clock is ahead
+                tokens = min(runs, row[0] + (now - row[1]) * runs / seconds) - 1
+            else:
+                tokens = runs - 1
+            self._conn.cursor().execute(
+                "INSERT OR REPLACE INTO rate_limit_bucket (pool, tokens, updated) VALUES (?, ?, ?)", (pool, tokens, now)
+            )
+            self._conn.commit()
+        except sqlite3.Error:
+            self._conn.rollback()
+            raise
+        return max(0.0, -tokens * seconds / runs)
 
     # compound writes
 
+    # a rate limited run got its token, it starts now
+    def update_pipeline_run_started(self, pipeline_run_id: int, start_time: int, rate_limit_wait: float) -> None:
+
+        query = "UPDATE pipeline_run SET status = 'running', start_time = ?, rate_limit_wait = ? WHERE id = ?"
+        params = (start_time, rate_limit_wait, pipeline_run_id)
+        self._conn.cursor().execute(query, params)
+        self._commit()
+
     def update_pipeline_run_stage_and_stage_msg(self, pipeline_run_id: int, stage: int, msg: str) -> None:
 
         query = "UPDATE pipeline_run SET stage = ?, stage_msg = ? WHERE id = ?"
         params = (stage, msg, pipeline_run_id)
         self._conn.cursor().execute(query, params)
-        self._conn.commit()
+        self._commit()
 
     def update_pipeline_run_status_exit_msg_end_time(self, pipeline_run_id: int, status: str, msg: str,
-                                                     end_time: str) -> None:
+                                                     end_time: int) -> None:
 
         query = "UPDATE pipeline_run SET status = ?, exit_msg = ?, end_time = ? WHERE id = ?"
         params = (status, msg, end_time, pipeline_run_id)
         self._conn.cursor().execute(query, params)
-        self._conn.commit()
+        self._commit()
+
+    # adds an ended run to the stats of its pipeline. once per run, it's for the caller to know the run just ended
+    def add_pipeline_stats(self, pipeline_run_id: int) -> None:
+
+        with self.transaction():
+            run = self._conn.cursor().execute(
+                "SELECT pipeline_id, status, duration FROM pipeline_run WHERE id = ? AND end_time IS NOT NULL",
+                (pipeline_run_id,)).fetchone()
+            if not run:
+                return
+            stats = self._conn.cursor().execute(
+                "SELECT runs, succeeded, total_duration, sketch FROM pipeline_stats WHERE pipeline_id = ?",
+                (run[0],)).fetchone()
+            stats = list(stats[:3]) + [DurationSketch.loads(stats[3])] if stats else [0, 0, 0, DurationSketch()]
+            _add_run(stats, run[1], run[2])
+
+            query = """
+                INSERT OR REPLACE INTO pipeline_stats (pipeline_id, runs, succeeded, total_duration, sketch)
+                VALUES (?, ?, ?, ?, ?)
+            """
+            params = (run[0], stats[0], stats[1], stats[2], stats[3].dumps())
+            self._conn.cursor().execute(query, params)
+
+    def delete_pipeline_runs(self, run_ids: List[int]) -> None:
+
+        query = "DELETE FROM pipeline_run WHERE id = ?"
+        params = [(x,) for x in run_ids]
+        self._conn.cursor().executemany(query, params)
+        self._commit()
+
+    # moves runs, and their artifact rows, into a partition of run history, a database file of its own (see
+    #   housekeeping). a commit is atomic per database file, not across the two, so the runs are copied and committed
+    #   before they're deleted. a crash in between leaves them in both, moving them again replaces the copy.
+    #   ATTACH can't be part of a transaction, so neither can this
+    def move_pipeline_runs(self, run_ids: List[int], partition: Path) -> None:
+
+        marks = ', '.join('?' * len(run_ids))
+        self._conn.execute("ATTACH DATABASE ? AS archive", (partition.absolute().as_posix(),))
+        try:
+            _create_partition_schema(self._conn, 'archive')
+            if self._column_type('archive', 'pipeline_run', 'start_time') == 'TEXT':  # a partition from before
+                self._migrate_run_times('archive', 'pipeline_run', lambda x: _create_partition_runs(self._conn, x))
+            with self.transaction():
+                self._conn.execute(f"""
+                    INSERT OR REPLACE INTO archive.pipeline_run
+                    SELECT pipeline_run.id, pipeline_id, pipeline.name, schedule_id, status, stage, stage_msg, exit_msg,
+                        start_time, end_time, rate_limit_wait
+                    FROM main.pipeline_run
+                    INNER JOIN main.pipeline ON pipeline_run.pipeline_id = pipeline.id
+                    WHERE pipeline_run.id IN ({marks})
+                """, run_ids)
+                self._conn.execute(f"""
+                    INSERT OR REPLACE INTO archive.pipeline_artifact
+                    SELECT id, run_id, name, size FROM main.pipeline_artifact WHERE run_id IN ({marks})
+                """, run_ids)
+            with self.transaction():
+                self._conn.execute(f"DELETE FROM main.pipeline_run WHERE id IN ({marks})", run_ids)
+        finally:
+            self._conn.execute("DETACH DATABASE archive")
+
+    # gives up to this many free pages back to the filesystem, returns how many are still free
+    def incremental_vacuum(self, pages: int) -> int:
+
+        # a page is freed per step of the statement, executescript steps it to the end where execute stops after one
+        self._conn.executescript(f"pragma incremental_vacuum({int(pages)});")
+        return self._conn.execute('pragma freelist_count').fetchone()[0]
+
+    # the whole auto-discovery diff in one transaction. returns (pipeline_id, schedule_id) of each added pipeline
+    def reconcile_pipelines(self, added: List[Tuple[str, str, str, float]], removed: List[int],
+                            modified: List[Tuple[int, float]]) -> List[Tuple[int, int]]:
+
+        ids = []
+        try:
+            with self.transaction():
+                cursor = self._conn.cursor()
+                cursor.executemany("DELETE FROM pipeline WHERE id = ?", [(x,) for x in removed])
+                cursor.executemany("UPDATE pipeline SET py_timestamp = ? WHERE id = ?",
+                                   [(py_timestamp, pipeline_id) for pipeline_id, py_timestamp in modified])
+                for name, py_name, dir_name, py_timestamp in added:
+                    pipeline_id = cursor.execute(
+                        "INSERT INTO pipeline (name, py_name, dir_name, py_timestamp) VALUES (?, ?, ?, ?)",
+                        (name, py_name, dir_name, py_timestamp)
+                    ).lastrowid
+                    schedule_id = cursor.execute("""
+                        INSERT INTO pipeline_schedule
+                            (pipeline_id, cron, at, paused, retry_on_crash, retry_num, max_retries, timeout)
+                        VALUES (?, '', '', 0, 0, 0, 0, 0)
+                    """, (pipeline_id,)).lastrowid
+                    ids.append((pipeline_id, schedule_id))
+        except sqlite3.IntegrityError as e:
+            raise exception.dbError(f"Failed database reconcile. {e}") from e
+
+        return ids
 
     # cli commands
 
-    def summary_pipelines(self) -> List[Tuple[str, str, int, str, str, int, str, str, str]]:
+    # (pipeline name, runs, succeeded, total duration, sketch) by pipeline name, of one pipeline or all of them
+    def pipeline_stats(self, pipeline_id: int = None) -> List[Tuple[str, int, int, int, str]]:
+
+        query = """
+            SELECT pipeline.name, pipeline_stats.runs, pipeline_stats.succeeded, pipeline_stats.total_duration,
+                   pipeline_stats.sketch
+            FROM pipeline_stats
+            INNER JOIN pipeline
+            ON pipeline_stats.pipeline_id = pipeline.id
+            WHERE ? IS NULL OR pipeline.id = ?
+            ORDER BY pipeline.name
+        """
+        params = (pipeline_id, pipeline_id)
+        results = self._conn.cursor().execute(query, params)
+        return results.fetchall()
+
+    def summary_pipelines(self) -> List[Tuple[str, str, str, int, str, str, int, str, str, int, int, str]]:
 
         results = self._conn.cursor().execute("""
-            SELECT pipeline.name, pipeline.py_name, pipeline_schedule.id, pipeline_schedule.cron, pipeline_schedule.at,
-                   pipeline_schedule.paused, pipeline_run.status, pipeline_run.stage_msg, pipeline_run.end_time
+            SELECT pipeline.name, pipeline.py_name, pipeline.env_status, pipeline_schedule.id, pipeline_schedule.cron,
+                   pipeline_schedule.at, pipeline_schedule.paused, schedule_state.status, schedule_state.stage_msg,
+                   schedule_state.end_time, schedule_state.consecutive_failures, schedule_state.next_fire_time
             FROM pipeline
             LEFT JOIN pipeline_schedule
             ON pipeline.id = pipeline_schedule.pipeline_id
-            LEFT JOIN pipeline_run
-            ON pipeline_schedule.latest_run = pipeline_run.id
+            LEFT JOIN schedule_state
+            ON pipeline_schedule.id = schedule_state.schedule_id
         """)
         return results.fetchall()
 
@@ -502,6 +1142,131 @@ class Pipeline(Database):
         else:
             return data
 
+    def pipeline_schedule_timeout(self, schedule_id: int) -> Union[int, None]:
+
+        query = "SELECT timeout FROM pipeline_schedule WHERE id = ?"
+        params = (schedule_id,)
+        results = self._conn.cursor().execute(query, params)
+        data = results.fetchone()
+        if data:
+            return data[0]
+        else:
+            return data
+
+    # cron schedules that catch up on fires missed while the daemon was down, with the start time of their latest run.
+    #   a schedule that never ran has nothing to catch up on
+    def catchup_schedules(self) -> List[Tuple[int, str, str, int]]:
+
+        results = self._conn.cursor().execute("""
+            SELECT pipeline_schedule.id, pipeline_schedule.cron, pipeline_schedule.catchup,
+                   MAX(pipeline_run.start_time)
+            FROM pipeline_schedule
+            INNER JOIN pipeline_run
+            ON pipeline_schedule.id = pipeline_run.schedule_id
+            WHERE pipeline_schedule.catchup IN ('latest', 'all')
+                AND pipeline_schedule.cron != ''
+                AND (pipeline_schedule.paused IS NULL OR pipeline_schedule.paused = 0)
+            GROUP BY pipeline_schedule.id;
+        """)
+        return results.fetchall()
+
+    # the run of a schedule waiting for its rate limit token, (pipeline_run_id, start_time, rate_limit_wait)
+    def rate_limited_run(self, pipeline_id: int, schedule_id: int) -> Union[Tuple[int, int, float], None]:
+
+        query = """
+            SELECT id, start_time, rate_limit_wait FROM pipeline_run
+            WHERE pipeline_id = ? AND schedule_id = ? AND status = 'rate_limited'
+            ORDER BY start_time DESC LIMIT 1
+        """
+        params = (pipeline_id, schedule_id)
+        results = self._conn.cursor().execute(query, params)
+        return results.fetchone()
+
+    def pipeline_schedule_rate_limit(self, schedule_id: int) -> Union[str, None]:
+
+        query = "SELECT rate_limit FROM pipeline_schedule WHERE id = ?"
+        params = (schedule_id,)
+        results = self._conn.cursor().execute(query, params)
+        data = results.fetchone()
+        if data:
+            return data[0]
+        else:
+            return data
+
+    # schedules with a rate limit: (schedule_id, rate_limit, runs, runs waiting for a token now, runs that waited,
+    #   seconds waited in total, longest wait)
+    def rate_limited_schedules(self) -> List[Tuple[int, str, int, int, int, float, float]]:
+
+        results = self._conn.cursor().execute("""
+            SELECT pipeline_schedule.id, pipeline_schedule.rate_limit, COUNT(pipeline_run.id),
+                   COUNT(CASE WHEN pipeline_run.status = 'rate_limited' THEN 1 END),
+                   COUNT(CASE WHEN pipeline_run.rate_limit_wait > 0 THEN 1 END),
+                   TOTAL(pipeline_run.rate_limit_wait), IFNULL(MAX(pipeline_run.rate_limit_wait), 0)
+            FROM pipeline_schedule
+            LEFT JOIN pipeline_run
+            ON pipeline_schedule.id = pipeline_run.schedule_id
+            WHERE pipeline_schedule.rate_limit IS NOT NULL AND pipeline_schedule.rate_limit != ''
+            GROUP BY pipeline_schedule.id;
+        """)
+        return results.fetchall()
+
+    def run_queued(self, schedule_id: int) -> bool:
+
+        query = "SELECT 1 FROM run_queue WHERE schedule_id = ?"
+        params = (schedule_id,)
+        return self._conn.cursor().execute(query, params).fetchone() is not None
+
+    # (run_id, status, stage_msg, start_time, end_time, consecutive_failures, next_fire_time)
+    def schedule_state(self, schedule_id: int) -> Union[Tuple[int, str, str, int, int, int, str], None]:
+
+        query = """
+            SELECT run_id, status, stage_msg, start_time, end_time, consecutive_failures, next_fire_time
+            FROM schedule_state
+            WHERE schedule_id = ?
+        """
+        params = (schedule_id,)
+        results = self._conn.cursor().execute(query, params)
+        return results.fetchone()
+
+    def pipeline_schedule_paused(self, schedule_id: int) -> Union[int, None]:
+
+        query = "SELECT paused FROM pipeline_schedule WHERE id = ?"
+        params = (schedule_id,)
+        results = self._conn.cursor().execute(query, params)
+        data = results.fetchone()
+        if data:
+            return data[0]
+        else:
+            return data
+
+    def pipeline_schedule_dependencies(self, schedule_id: int) -> List[Tuple[int, int, str, int]]:
+
+        query = """
+            SELECT id, upstream_schedule_id, on_status, satisfied_run
+            FROM pipeline_schedule_dependency
+            WHERE schedule_id = ?
+        """
+        params = (schedule_id,)
+        results = self._conn.cursor().execute(query, params)
+        return results.fetchall()
+
+    def pipeline_schedule_dependents(self, upstream_schedule_id: int) -> List[Tuple[int, int, str]]:
+
+        query = """
+            SELECT id, schedule_id, on_status
+            FROM pipeline_schedule_dependency
+            WHERE upstream_schedule_id = ?
+        """
+        params = (upstream_schedule_id,)
+        results = self._conn.cursor().execute(query, params)
+        return results.fetchall()
+
+    def all_pipeline_schedule_dependencies(self) -> List[Tuple[int, int]]:
+
+        query = "SELECT schedule_id, upstream_schedule_id FROM pipeline_schedule_dependency"
+        results = self._conn.cursor().execute(query)
+        return results.fetchall()
+
     def pipeline_schedules_id(self, pipeline_id: int) -> List[int]:
 
         query = "SELECT id FROM pipeline_schedule WHERE pipeline_id = ?"
@@ -510,7 +1275,22 @@ class Pipeline(Database):
 
         return [x[0] for x in results.fetchall()]
 
-    def pipeline_run_id_by_pipeline_id_and_start_time(self, pipeline_id: int, start_time: str) -> Union[int, None]:
+    # ids of the runs of a pipeline, or of one of its schedules (through the pipeline_id index, schedule_id has none)
+    def pipeline_run_ids(self, pipeline_id: int = None, schedule_id: int = None) -> List[int]:
+
+        if schedule_id is not None:
+            query = """
+                SELECT id FROM pipeline_run
+                WHERE pipeline_id = (SELECT pipeline_id FROM pipeline_schedule WHERE id = ?) AND schedule_id = ?
+            """
+            params = (schedule_id, schedule_id)
+        else:
+            query, params = "SELECT id FROM pipeline_run WHERE pipeline_id = ?", (pipeline_id,)
+        results = self._conn.cursor().execute(query, params)
+
+        return [x[0] for x in results.fetchall()]
+
+    def pipeline_run_id_by_pipeline_id_and_start_time(self, pipeline_id: int, start_time: int) -> Union[int, None]:
 
         query = "SELECT id FROM pipeline_run WHERE pipeline_id = ? AND start_time = ?"
         params = (pipeline_id, start_time)
@@ -521,7 +1301,104 @@ class Pipeline(Database):
         else:
             return data
 
-    def pipeline_run(self, run_id: int) -> Union[Tuple[int, int, str, int, str, str, str, str], None]:
+    # seconds each of the newest ended runs of every pipeline took, at most window per pipeline, as
+    #   (pipeline_id, duration) newest first
+    def recent_run_durations(self, window: int) -> List[Tuple[int, float]]:
+
+        query = """
+            SELECT pipeline_id, duration / 1000000.0 FROM (
+                SELECT pipeline_id, end_time - start_time AS duration,
+                    ROW_NUMBER() OVER (PARTITION BY pipeline_id ORDER BY start_time DESC) AS newer
+                FROM pipeline_run
+                WHERE end_time IS NOT NULL
+            )
+            WHERE newer <= ?
+            ORDER BY pipeline_id, newer;
+        """
+        params = (window,)
+        results = self._conn.cursor().execute(query, params)
+        return results.fetchall()
+
+    # ended runs past the days or runs their pipeline keeps, oldest first as (id, start_time). a pipeline's own
+    #   keep_days and keep_runs win over the global ones, 0 keeps everything. a schedule's latest run always stays
+    def expired_pipeline_runs(self, keep_days: int, keep_runs: int, now: int, limit: int) -> List[Tuple[int, int]]:
+
+        query = """
+            SELECT id, start_time FROM (
+                SELECT pipeline_run.id, pipeline_run.start_time,
+                    ROW_NUMBER() OVER (PARTITION BY pipeline_run.pipeline_id ORDER BY pipeline_run.id DESC) AS newer,
+                    COALESCE(NULLIF(pipeline.keep_days, 0), ?) AS keep_days,
+                    COALESCE(NULLIF(pipeline.keep_runs, 0), ?) AS keep_runs
+                FROM pipeline_run
+                INNER JOIN pipeline ON pipeline_run.pipeline_id = pipeline.id
+                WHERE pipeline_run.end_time IS NOT NULL
+            )
+            WHERE ((keep_runs > 0 AND newer > keep_runs)
+                   OR (keep_days > 0 AND start_time < ? - keep_days * 86400000000))
+                AND id NOT IN (SELECT latest_run FROM pipeline_schedule WHERE latest_run IS NOT NULL)
+            ORDER BY id
+            LIMIT ?;
+        """
+        params = (keep_days, keep_runs, now, limit)
+        results = self._conn.cursor().execute(query, params)
+        return results.fetchall()
+
+    # a page of runs, newest first as (id, pipeline name, schedule_id, status, start_time, end_time). keyset
+    #   pagination: the next page starts after the (start_time, id) the last one ended on, so a page deep into millions
+    #   of runs costs what the first one does
+    def pipeline_runs(self, pipeline_id: int = None, status: str = '', since: int = None, after: Tuple[int, int] = None,
+                      limit: int = 100) -> List[Tuple[int, str, int, str, int, int]]:
+
+        conditions, params = _run_conditions(pipeline_id, status, since)
+        if after:
+            conditions.append("pipeline_run.start_time <= ? AND (pipeline_run.start_time < ? OR pipeline_run.id < ?)")
+            params.extend([after[0], after[0], after[1]])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        query = f"""
+            SELECT pipeline_run.id, pipeline.name, pipeline_run.schedule_id, pipeline_run.status,
+                pipeline_run.start_time, pipeline_run.end_time
+            FROM pipeline_run
+            INNER JOIN pipeline ON pipeline_run.pipeline_id = pipeline.id
+            {where}
+            ORDER BY pipeline_run.start_time DESC, pipeline_run.id DESC
+            LIMIT ?;
+        """
+        params.append(limit)
+        results = self._conn.cursor().execute(query, params)
+        return results.fetchall()
+
+    # runs oldest first, with the name of their pipeline and the cron of their schedule, in chunks of chunk_size.
+    #   one query for the lot, the rows are fetched a chunk at a time as they're asked for, so the whole history is
+    #   never in memory. a statement reads one snapshot until it's done, runs written meanwhile aren't in it. the
+    #   columns are export.COLUMNS
+    def export_pipeline_runs(self, pipeline_id: int = None, status: str = '', since: int = None,
+                             chunk_size: int = 10000) -> Iterator[List[tuple]]:
+
+        conditions, params = _run_conditions(pipeline_id, status, since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        query = f"""
+            SELECT pipeline_run.id, pipeline.name, pipeline_run.schedule_id, pipeline_schedule.cron,
+                pipeline_run.status, pipeline_run.stage, pipeline_run.stage_msg, pipeline_run.exit_msg,
+                pipeline_run.start_time, pipeline_run.end_time, pipeline_run.duration, pipeline_run.rate_limit_wait
+            FROM pipeline_run
+            INNER JOIN pipeline ON pipeline_run.pipeline_id = pipeline.id
+            LEFT JOIN pipeline_schedule ON pipeline_run.schedule_id = pipeline_schedule.id
+            {where}
+            ORDER BY pipeline_run.start_time, pipeline_run.id;
+        """
+        cursor = self._conn.cursor().execute(query, params)
+        try:
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            cursor.close()
+
+    def pipeline_run(self, run_id: int) -> Union[Tuple[int, int, str, int, str, str, int, int], None]:
 
         query = """
             SELECT pipeline_id, schedule_id, status, stage, stage_msg, exit_msg, start_time, end_time
@@ -535,3 +1412,170 @@ class Pipeline(Database):
             return data[0]
         else:
             return None
+
+    def pipeline_artifacts(self, run_id: int) -> List[Tuple[str, int]]:
+
+        query = "SELECT name, size FROM pipeline_artifact WHERE run_id = ?"
+        params = (run_id,)
+        results = self._conn.cursor().execute(query, params)
+        return results.fetchall()
+
+
+# helper functions
+
+
+# WHERE conditions, and their params, picking runs by pipeline, end status and start time
+def _run_conditions(pipeline_id: Union[int, None], status: str, since: Union[int, None]) -> Tuple[List[str], list]:
+
+    conditions, params = [], []
+    if pipeline_id is not None:
+        conditions.append("pipeline_run.pipeline_id = ?")
+        params.append(pipeline_id)
+    if status:
+        conditions.append("pipeline_run.status = ?")
+        params.append(status)
+    if since is not None:
+        conditions.append("pipeline_run.start_time >= ?")
+        params.append(since)
+    return conditions, params
+
+
+# adds an ended run to [runs, succeeded, total_duration, sketch]. a run that finished succeeded, crashed or timed_out
+#   didn't. duration is in microseconds
+def _add_run(stats: list, status: str, duration: int) -> None:
+
+    stats[0] += 1
+    stats[1] += status == 'finished'
+    stats[2] += duration
+    stats[3].add(duration / 1000000)
+
+
+# how long a connection waits on another one's write lock before giving up with 'database is locked'
+def set_busy_timeout(milliseconds: int) -> None:
+
+    global _busy_timeout
+    _busy_timeout = milliseconds
+
+
+# closes the pooled connections of this thread. a thread that ends without it leaves its connections to the garbage
+#   collector, which closes them as well
+def close_pooled() -> None:
+
+    connections = getattr(_pool, 'connections', {})
+    for conn, _, _ in connections.values():
+        conn.close()
+    connections.clear()
+
+
+# a partition of run history, the runs of one month moved out of gluetube.db (see Pipeline.move_pipeline_runs). it
+#   stands on its own: no foreign keys, and the name of the pipeline is kept with each run
+def _create_partition_schema(conn: sqlite3.Connection, schema: str) -> None:
+
+    _create_partition_runs(conn, f"{schema}.pipeline_run")
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {schema}.pipeline_artifact(
+            id INTEGER PRIMARY KEY NOT NULL,
+            run_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            size INTEGER NOT NULL
+        )""")
+
+
+def _create_partition_runs(conn: sqlite3.Connection, table: str) -> None:
+
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table}(
+            id INTEGER PRIMARY KEY NOT NULL,
+            pipeline_id INTEGER NOT NULL,
+            pipeline_name TEXT,
+            schedule_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            stage INTEGER,
+            stage_msg TEXT,
+            exit_msg TEXT,
+            start_time INTEGER NOT NULL,
+            end_time INTEGER,
+            rate_limit_wait REAL
+        )""")
+
+
+# an ISO 8601 time as microseconds since the epoch, the default if it doesn't parse. without an offset it's UTC
+def _epoch_us_from_iso(text: Union[str, int, None], default: Union[int, None]) -> Union[int, None]:
+
+    if isinstance(text, int):
+        return text
+    match = _ISO_TIME.match((text or '').strip())
+    if not match:
+        return default
+    year, month, day, hour, minute, second = [int(x) for x in match.groups()[:6]]
+    microsecond = int((match.group(7) or '0').ljust(6, '0'))
+    tz = timezone.utc
+    if match.group(8) and match.group(8) != 'Z':
+        sign = -1 if match.group(8)[0] == '-' else 1
+        offset = match.group(8)[1:].replace(':', '')
+        tz = timezone(sign * timedelta(hours=int(offset[:2]), minutes=int(offset[2:])))
+    try:
+        return util.epoch_us(datetime(year, month, day, hour, minute, second, microsecond, tzinfo=tz))
+    except ValueError:  # e.g. a 13th month
+        return default
+
+
+def _connect(db_path: Path, read_only: bool) -> sqlite3.Connection:
+
+    if read_only:
+        conn = sqlite3.connect(f"{db_path.absolute().as_uri()}?mode=ro", uri=True)
+    else:
+        conn = sqlite3.connect(db_path.absolute().as_posix())
+        conn.execute('pragma journal_mode=wal;')
+        conn.execute('pragma foreign_keys=ON;')
+    conn.execute(f"pragma busy_timeout={int(_busy_timeout)};")
+    return conn
+
+
+# the connection this thread opened to the file before, if it passes a health check, otherwise a new one. it's the
+#   open and the schema parse on every run and every scan that's saved, and no connection is left behind unclosed
+def _pooled_connection(db_path: Path, read_only: bool) -> Tuple[sqlite3.Connection, _TransactionState]:
+
+    if not hasattr(_pool, 'connections'):
+        _pool.connections = {}
+    key = (db_path.absolute().as_posix(), read_only)
+
+    if key in _pool.connections:
+        conn, file_id, tx = _pool.connections.pop(key)
+        if _healthy(conn, db_path, file_id, tx):
+            _pool.connections[key] = (conn, file_id, tx)
+            return conn, tx
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    conn, tx = _connect(db_path, read_only), _TransactionState()
+    _pool.connections[key] = (conn, _file_id(db_path), tx)
+    return conn, tx
+
+
+def _healthy(conn: sqlite3.Connection, db_path: Path, file_id: Union[Tuple[int, int], None],
+             tx: _TransactionState) -> bool:
+
+    # the file was replaced or removed (e.g. a fresh db --init), the connection still has the old one open
+    if _file_id(db_path) != file_id:
+        return False
+    try:
+        # left open by a caller that failed half way, the next one starts clean. one inside a transaction() of
+        #   another database on this connection is that database's unit of work, it's left alone
+        if conn.in_transaction and not tx.depth:
+            conn.rollback()
+        conn.execute('SELECT 1').fetchone()
+    except sqlite3.Error:  # closed by hand, or broken
+        return False
+    return True
+
+
+def _file_id(db_path: Path) -> Union[Tuple[int, int], None]:
+
+    try:
+        stat = os.stat(db_path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino
@@ -0,0 +1,133 @@
+# Craig Tomkow
+# 2023-02-01
+
+# local imports
+import util
+
+# python imports
+import csv
+import os
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Iterator, List
+
+FORMATS = ('csv', 'parquet', 'arrow')
+
+# (name, arrow type) of each exported column, in the order Pipeline.export_pipeline_runs reads them. times are
+#   timestamps and duration a duration, both in microseconds. csv has the times in ISO 8601 and duration_us as is
+COLUMNS = [
+    ('run_id', 'int64'), ('pipeline_name', 'string'), ('schedule_id', 'int64'), ('schedule_cron', 'string'),
+    ('status', 'string'), ('stage', 'int64'), ('stage_msg', 'string'), ('exit_msg', 'string'),
+    ('start_time', 'timestamp'), ('end_time', 'timestamp'), ('duration_us', 'duration'), ('rate_limit_wait', 'float64')
+]
+
+
+# writes chunks of runs, as they come, to a file of the format. it's written next to path and moved into place once
+#   complete, a failed export leaves no half file behind. returns what the runs add up to (see _Summary)
+def export_runs(chunks: Iterator[List[tuple]], path: Path, fmt: str) -> dict:
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt}, one of {', '.join(FORMATS)}")
+    writer = _csv_writer if fmt == 'csv' else _arrow_writer(fmt)
+
+    summary = _Summary()
+    tmp = Path(f"{path}.tmp")
+    try:
+        writer(tmp, _summarized(chunks, summary))
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return summary.result()
+
+
+# helper functions
+
+
+def _column(name: str) -> int:
+
+    return [x[0] for x in COLUMNS].index(name)
+
+
+def _summarized(chunks: Iterator[List[tuple]], summary: '_Summary') -> Iterator[List[tuple]]:
+
+    for chunk in chunks:
+        summary.add(chunk)
+        yield chunk
+
+
+def _csv_writer(path: Path, chunks: Iterator[List[tuple]]) -> None:
+
+    times = [i for i, (_, kind) in enumerate(COLUMNS) if kind == 'timestamp']
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([x[0] for x in COLUMNS])
+        for chunk in chunks:
+            writer.writerows(
+                [util.iso_time(x) if i in times else x for i, x in enumerate(row)] for row in chunk)
+
+
+# parquet and arrow (IPC file) go through pyarrow, a record batch per chunk. pyarrow is only needed for these two
+def _arrow_writer(fmt: str) -> Callable[[Path, Iterator[List[tuple]]], None]:
+
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError(f"Exporting {fmt} needs pyarrow, pip install pyarrow. csv doesn't") from e
+
+    types = {'int64': pyarrow.int64(), 'string': pyarrow.string(), 'float64': pyarrow.float64(),
+             'timestamp': pyarrow.timestamp('us', tz='UTC'), 'duration': pyarrow.duration('us')}
+    schema = pyarrow.schema([(name, types[kind]) for name, kind in COLUMNS])
+
+    def write(path: Path, chunks: Iterator[List[tuple]]) -> None:
+
+        if fmt == 'parquet':
+            writer = pyarrow.parquet.ParquetWriter(path.as_posix(), schema)
+        else:
+            writer = pyarrow.ipc.new_file(path.as_posix(), schema)
+        try:
+            for chunk in chunks:
+                columns = list(zip(*chunk))
+                writer.write_batch(pyarrow.record_batch(
+                    [pyarrow.array(x, type=field.type) for x, field in zip(columns, schema)], schema=schema))
+        finally:
+            writer.close()
+
+    return write
+
+
+# runs, runs per status, and mean, min and max duration in seconds of those that ended, added up a chunk at a time
+class _Summary:
+
+    def __init__(self) -> None:
+
+        self.runs = 0
+        self.statuses = Counter()
+        self.ended = 0
+        self.total_duration = 0
+        self.min_duration = None
+        self.max_duration = None
+
+    def add(self, chunk: List[tuple]) -> None:
+
+        status, duration = _column('status'), _column('duration_us')
+        self.runs += len(chunk)
+        self.statuses.update(x[status] for x in chunk)
+        durations = [x[duration] for x in chunk if x[duration] is not None]
+        if durations:
+            self.ended += len(durations)
+            self.total_duration += sum(durations)
+            self.min_duration = min(durations if self.min_duration is None else durations + [self.min_duration])
+            self.max_duration = max(durations if self.max_duration is None else durations + [self.max_duration])
+
+    def result(self) -> dict:
+
+        return {
+            'runs': self.runs,
+            'statuses': dict(self.statuses),
+            'mean_duration': self.total_duration / self.ended / 1000000 if self.ended else None,
+            'min_duration': self.min_duration / 1000000 if self.ended else None,
+            'max_duration': self.max_duration / 1000000 if self.ended else None,
+        }
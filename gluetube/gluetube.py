@@ -15,6 +15,7 @@ import os
 from pathlib import Path
 from getpass import getpass
 from config import Gluetube
+from gluetubed import SCHEDULER_THREADS
 
 
 # 3rd party imports
@@ -74,6 +75,39 @@ class Gluetube:
                 else:
                     logging.error(f"List pipelines failed. {e}")
                 raise SystemExit(1)
+        elif 'sub_cmd_plan' in args:  # gluetube plan sub-command level
+            try:
+                print(command.capacity_plan(args.horizon, args.slots))
+            except exception.dbError as e:
+                if args.debug:
+                    logging.exception(f"Capacity plan failed. {e}")
+                else:
+                    logging.error(f"Capacity plan failed. {e}")
+                raise SystemExit(1)
+        elif 'sub_cmd_runs' in args:  # gluetube runs sub-command level
+            try:
+                if args.export:
+                    lines = command.export_runs(args.export, args.format, args.pipeline, args.status, args.since)
+                    if args.summary:
+                        print('\n'.join(lines))
+                else:
+                    for line in command.runs(args.pipeline, args.status, args.since, args.before, args.limit):
+                        print(line)
+            except (exception.dbError, ValueError, ImportError, OSError) as e:
+                if args.debug:
+                    logging.exception(f"List runs failed. {e}")
+                else:
+                    logging.error(f"List runs failed. {e}")
+                raise SystemExit(1)
+        elif 'sub_cmd_stats' in args:  # gluetube stats sub-command level
+            try:
+                print(command.stats(args.pipeline))
+            except exception.dbError as e:
+                if args.debug:
+                    logging.exception(f"Run stats failed. {e}")
+                else:
+                    logging.error(f"Run stats failed. {e}")
+                raise SystemExit(1)
         elif 'sub_cmd_daemon' in args:  # gluetube daemon sub-command level
             try:
                 if args.foreground:
@@ -88,10 +122,35 @@ class Gluetube:
                 else:
                     logging.critical(f"Daemon failure. {e}")
                 raise SystemExit(1)
+        elif 'sub_cmd_worker' in args:  # gluetube worker sub-command level
+            try:
+                command.worker(args.slots)
+            except exception.dbError as e:
+                if args.debug:
+                    logging.exception(f"Database connection failed. Was it initialized first? {e}")
+                else:
+                    logging.error(f"Database connection failed. Was it initialized first? {e}")
+                raise SystemExit(1)
+            except exception.rpcError as e:
+                if args.debug:
+                    logging.exception(f"Is the daemon running? {e}")
+                else:
+                    logging.error(f"Is the daemon running? {e}")
+                raise SystemExit(1)
+            except (exception.ConfigFileParseError, exception.ConfigFileNotFoundError) as e:
+                if args.debug:
+                    logging.exception(f"Config file failed. {e}")
+                else:
+                    logging.error(f"Config file failed. {e}")
+                raise SystemExit(1)
         elif 'sub_cmd_pipeline' in args:  # gluetube pipeline sub-command level
             try:
                 if args.schedule:
                     command.pipeline_schedule(args.NAME[0], Path(gt_cfg.socket_file))
+                elif args.keep_days is not None:
+                    command.pipeline_keep_days(args.NAME[0], args.keep_days, Path(gt_cfg.socket_file))
+                elif args.keep_runs is not None:
+                    command.pipeline_keep_runs(args.NAME[0], args.keep_runs, Path(gt_cfg.socket_file))
             except (exception.dbError, exception.RunnerError) as e:
                 if args.debug:
                     logging.exception(f"Pipeline run failure. {e}")
@@ -99,15 +158,38 @@ class Gluetube:
                     logging.critical(f"Pipeline run failure. {e}")
                 raise SystemExit(1)
         elif 'sub_cmd_schedule' in args:  # gluetube schedule sub-command level
+            if args.ID is None and not args.load_preview and not args.rate_limits:
+                logging.error("A schedule ID is required.")
+                raise SystemExit(1)
             try:
-                if args.cron:
-                    command.schedule_cron(args.ID[0], args.cron, Path(gt_cfg.socket_file))
+                if args.load_preview:
+                    print(command.schedule_load_preview())
+                elif args.rate_limits:
+                    print(command.schedule_rate_limits())
+                elif args.cron:
+                    command.schedule_cron(args.ID, args.cron, Path(gt_cfg.socket_file))
                 elif args.at:
-                    command.schedule_at(args.ID[0], args.at, Path(gt_cfg.socket_file))
+                    command.schedule_at(args.ID, args.at, Path(gt_cfg.socket_file))
                 elif args.now:
-                    command.schedule_now(args.ID[0], Path(gt_cfg.socket_file))
+                    command.schedule_now(args.ID, Path(gt_cfg.socket_file))
+                elif args.timeout is not None:
+                    command.schedule_timeout(args.ID, args.timeout, Path(gt_cfg.socket_file))
+                elif args.catchup:
+                    command.schedule_catchup(args.ID, args.catchup, Path(gt_cfg.socket_file))
+                elif args.rate_limit is not None:
+                    command.schedule_rate_limit(args.ID, args.rate_limit, Path(gt_cfg.socket_file))
+                elif args.after:
+                    command.schedule_after(args.ID, args.after, args.on_status, Path(gt_cfg.socket_file))
+                elif args.remove_after:
+                    command.schedule_remove_after(args.ID, args.remove_after, Path(gt_cfg.socket_file))
                 elif args.delete:
-                    command.schedule_delete(args.ID[0], Path(gt_cfg.socket_file))
+                    command.schedule_delete(args.ID, Path(gt_cfg.socket_file))
+            except exception.dbError as e:
+                if args.debug:
+                    logging.exception(f"Database connection failed. Was it initialized first? {e}")
+                else:
+                    logging.error(f"Database connection failed. Was it initialized first? {e}")
+                raise SystemExit(1)
             except exception.rpcError as e:
                 if args.debug:
                     logging.exception(f"Is the daemon running? {e}")
@@ -160,6 +242,37 @@ class Gluetube:
         summary = sub_parser.add_parser('summary', description='show summary of pipelines, schedules, and runs')
         summary.add_argument('sub_cmd_summary', metavar='', default=True, nargs='?')  # a hidden tag to identify sub cmd
 
+        plan = sub_parser.add_parser('plan', description='simulate the schedules against the scheduler, using the p95 '
+                                                         'run time of each pipeline')
+        plan.add_argument('sub_cmd_plan', metavar='', default=True, nargs='?')  # a hidden tag to identify sub cmd
+        plan.add_argument('--horizon', action='store', type=util.duration, default='24h', metavar='SPAN',
+                          help="how far ahead to simulate e.g. 90m, 24h, 7d (default: 24h)")
+        plan.add_argument('--slots', action='store', type=util.positive_int, default=SCHEDULER_THREADS,
+                          help=f"runs that can go at once (default: {SCHEDULER_THREADS}, the scheduler threads)")
+
+        runs = sub_parser.add_parser('runs', description='show run history, newest first')
+        runs.add_argument('sub_cmd_runs', metavar='', default=True, nargs='?')  # a hidden tag to identify sub cmd
+        runs.add_argument('--pipeline', action='store', default='', metavar='NAME', help='runs of this pipeline only')
+        runs.add_argument('--status', action='store', default='', metavar='STATUS',
+                          help="runs that ended up in this status only e.g. finished, crashed, timed_out, running")
+        runs.add_argument('--since', action='store', default='', metavar='SINCE',
+                          help="runs started since a span ago e.g. 24h, or since a date/time (ISO 8601)")
+        runs.add_argument('--before', action='store', type=int, metavar='RUN_ID',
+                          help="runs older than this one, to page on from the last run listed")
+        runs.add_argument('--limit', action='store', type=util.non_negative_int, default=50, metavar='N',
+                          help="runs to list, 0 for all of them (default: 50)")
+        runs.add_argument('--export', action='store', metavar='FILE',
+                          help="write every run picked, oldest first, to a file instead of listing them")
+        runs.add_argument('--format', action='store', default='csv', choices=['csv', 'parquet', 'arrow'],
+                          help="file format of --export, parquet and arrow need pyarrow installed (default: csv)")
+        runs.add_argument('--summary', action='store_true',
+                          help="after --export, show runs per status and the mean, min and max duration")
+
+        stats = sub_parser.add_parser('stats', description='show how many runs each pipeline had, how many succeeded '
+                                                           'and how long they take')
+        stats.add_argument('sub_cmd_stats', metavar='', default=True, nargs='?')  # a hidden tag to identify sub cmd
+        stats.add_argument('--pipeline', action='store', default='', metavar='NAME', help='this pipeline only')
+
         daemon = sub_parser.add_parser('daemon', description='start gluetube as a daemon process')
         daemon.add_argument('sub_cmd_daemon', metavar='', default=True, nargs='?')  # a hidden tag to identify sub cmd
         daemon.add_argument('-s', '--stop', action='store_true',
@@ -168,24 +281,56 @@ class Gluetube:
         daemon_group.add_argument('-f', '--foreground', action='store_true', help='run daemon in the foreground')
         daemon_group.add_argument('-b', '--background', action='store_true', help='run daemon in the background')
 
+        worker = sub_parser.add_parser('worker', description='run what the daemon queues, with EXECUTION = queue. '
+                                                             'start as many as needed, on hosts sharing the database')
+        worker.add_argument('sub_cmd_worker', metavar='', default=True, nargs='?')  # a hidden tag to identify sub cmd
+        worker.add_argument('--slots', action='store', type=util.positive_int, default=os.cpu_count(),
+                            help="runs this worker takes on at once (default: number of cpus)")
+
         pipeline = sub_parser.add_parser('pipeline', description='perform actions and updates to pipelines')
         pipeline.add_argument('sub_cmd_pipeline', metavar='', default=True,
                               nargs='?')  # a hidden tag to identify sub cmd
         pipeline.add_argument('NAME', action='store', type=str, nargs=1, help='name of pipeline to act on')
         pipeline_group = pipeline.add_mutually_exclusive_group()
         pipeline_group.add_argument('--schedule', action='store_true', help='create a new blank pipeline schedule')
+        pipeline_group.add_argument('--keep-days', action='store', type=int, metavar='DAYS',
+                                    help="days of run history to keep, older runs go to RUN_ARCHIVE_DIR. 0 falls back "
+                                         "to the global RUN_KEEP_DAYS")
+        pipeline_group.add_argument('--keep-runs', action='store', type=int, metavar='RUNS',
+                                    help="newest runs to keep, older runs go to RUN_ARCHIVE_DIR. 0 falls back to the "
+                                         "global RUN_KEEP_RUNS")
 
         schedule = sub_parser.add_parser('schedule', description='perform actions and updates to existing schedules')
-        schedule.add_argument('sub_cmd_schedule', metavar='', default=True,
-                              nargs='?')  # a hidden tag to identify sub cmd
-        schedule.add_argument('ID', action='store', type=int, nargs=1, help='id of schedule to modify')
+        schedule.set_defaults(sub_cmd_schedule=True)  # identifies the sub cmd, a hidden positional would eat the ID
+        schedule.add_argument('ID', action='store', type=int, nargs='?', help='id of schedule to modify')
         schedule_group = schedule.add_mutually_exclusive_group()
-        schedule_group.add_argument('--cron', action='store', metavar='CRON', help="set cron schedule e.g. '* * * * *'")
+        schedule_group.add_argument('--cron', action='store', metavar='CRON',
+                                    help="set cron schedule e.g. '* * * * *'. H spreads a field by schedule id, "
+                                         "e.g. 'H/15 * * * *' or 'H H(0-5) * * *'")
         schedule_group.add_argument('--at', action='store', metavar='AT',
                                     help="run on a date/time (ISO 8601) e.g. '2022-10-01 00:00:00'")
         schedule_group.add_argument('--now', action='store_true',
                                     help="set the schedule to run immediately, erases existing schedule")
+        schedule_group.add_argument('--timeout', action='store', type=int, metavar='SECONDS',
+                                    help="kill a run after this many seconds, 0 falls back to the global RUN_TIMEOUT")
+        schedule_group.add_argument('--catchup', action='store', choices=['none', 'latest', 'all'],
+                                    help="on daemon start, cron runs missed while it was down are skipped (none), "
+                                         "run once (latest) or each run once (all)")
+        schedule_group.add_argument('--rate-limit', action='store', metavar='POOL',
+                                    help="start runs only as fast as a pool from [rate_limits] in gluetube.cfg allows, "
+                                         "or a rate of its own e.g. '10/1m'. '' removes it")
+        schedule_group.add_argument('--after', action='store', type=int, metavar='UPSTREAM_ID',
+                                    help="also run when the upstream schedule finishes, see --on-status")
+        schedule_group.add_argument('--remove-after', action='store', type=int, metavar='UPSTREAM_ID',
+                                    help="stop depending on the upstream schedule")
         schedule_group.add_argument('--delete', action='store_true', help="delete the schedule")
+        schedule_group.add_argument('--load-preview', action='store_true',
+                                    help="runs per minute of the hour over the next 24h, for all cron schedules (no ID)")
+        schedule_group.add_argument('--rate-limits', action='store_true',
+                                    help="runs that waited for a rate-limit token, per pool (no ID)")
+        schedule.add_argument('--on-status', action='store', default='finished',
+                              choices=['finished', 'crashed', 'timed_out', 'any'],
+                              help="upstream run status that satisfies --after (default: finished)")
 
         store = sub_parser.add_parser('store', description='add and remove key value pairs')
         store.add_argument('sub_cmd_store', metavar='', default=True, nargs='?')  # a hidden tag to identify sub cmd
@@ -4,11 +4,15 @@
 # local imports
 import logging
 import sqlite3
-from db import Pipeline, Store
-from runner import Runner
+from db import Pipeline, Store, set_busy_timeout
+from runner import invalidate_cache, run_schedule
+from supervisor import Supervisor
+from scheduler import Scheduler, cron_trigger, missed_fire_times, MISFIRE_GRACE_TIME
+from provision import Provisioner
+import housekeeping
 import util
 import exception
-from autodiscovery import PipelineScanner
+from autodiscovery import PipelineScanner, PipelineWatcher, generate_unique_pipeline_name
 from config import Gluetube
 
 # python imports
@@ -18,19 +22,36 @@ import struct
 import json
 from json.decoder import JSONDecodeError
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 import sys
-from typing import Union
+from typing import List, Union
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import time
 import base64
+import shutil
 
 # 3rd party imports
 import daemon
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.date import DateTrigger
-from apscheduler.jobstores.base import JobLookupError
-from apscheduler.schedulers.base import ConflictingIdError
+from apscheduler.triggers.base import BaseTrigger
+
+# threads the scheduler starts runs on
+SCHEDULER_THREADS = 101
+
+# upstream run statuses a schedule dependency can wait on
+DEPENDENCY_STATUSES = ('finished', 'crashed', 'timed_out', 'any')
+
+# what a cron schedule does about fires missed while the daemon was down: nothing, run once, or run once per missed fire
+CATCHUP_POLICIES = ('none', 'latest', 'all')
+
+# a schedule with the 'all' policy replays at most this many missed fires
+MAX_CATCHUP_RUNS = 100
+
+# seconds between looks at whether a dependent that was running when its upstreams finished has ended, see
+#   _defer_trigger
+DEFERRED_TRIGGER_INTERVAL = 1
 
 
 # manages all state and serializes changes through RPC calls
@@ -81,10 +102,12 @@ class GluetubeDaemon:
             gt_cfg = util.conf()
         except (exception.ConfigFileParseError, exception.ConfigFileNotFoundError) as e:
             raise exception.DaemonError(f"Failed to start daemon. {e}") from e
+        set_busy_timeout(int(gt_cfg.sqlite_busy_timeout))
 
         try:
             db_p = Pipeline(db_path=Path(gt_cfg.sqlite_dir, gt_cfg.sqlite_app_name), read_only=False)
-        except exception.dbError as e:
+            db_p.create_schema()  # idempotent, brings a database from an older gluetube up to date
+        except (exception.dbError, sqlite3.Error) as e:
             raise exception.DaemonError(f"Failed to start daemon. {e}") from e
 
         try:
@@ -92,28 +115,37 @@ class GluetubeDaemon:
         except exception.dbError as e:
             raise exception.DaemonError(f"Failed to start daemon. {e}") from e
 
-        # setup daemon dependencies: write pid file, create apscheduler, create unix socket
+        # setup daemon dependencies: write pid file, start process supervisor, create scheduler and environment
+        #   provisioner, create unix socket
         self._write_pid(Path(gt_cfg.pid_file))
-        scheduler = self._setup_scheduler(101)
+        supervisor = Supervisor()
+        supervisor.start()
+        scheduler = self._setup_scheduler(SCHEDULER_THREADS, gt_cfg, supervisor)
+        provisioner = Provisioner(gt_cfg)
         sock = self._setup_listener_unix_socket(Path(gt_cfg.socket_file))
 
-        # now populate scheduler and start it
-        self._schedule_pipelines(scheduler, db_p, gt_cfg)
+        # artifacts of runs deleted while the daemon was down
+        self._prune_artifacts(db_p, gt_cfg)
+
+        # now populate scheduler and start it, then make up for the fires missed while the daemon was down
+        schedule_ids = self._schedule_pipelines(scheduler, db_p)
+        self._record_next_fires(scheduler, db_p, schedule_ids)
         self._schedule_auto_discovery(scheduler, gt_cfg)
+        self._schedule_housekeeping(scheduler, gt_cfg)
         if not scheduler.running:
             scheduler.start()
-        if not debug:
-            logging.getLogger('apscheduler').setLevel('WARNING')
+        self._catch_up(scheduler, db_p, gt_cfg, supervisor)
 
-        self._main(scheduler, db_p, db_s, sock, debug, gt_cfg)
+        self._main(scheduler, db_p, db_s, sock, debug, gt_cfg, supervisor, provisioner)
 
     # ###################################### DAEMON LOOP #######################################
 
-    def _main(self, scheduler: BackgroundScheduler, db_p: Pipeline, db_s: Store, sock: socket.socket, debug: bool,
-              gt_cfg: Gluetube) -> None:
+    def _main(self, scheduler: Scheduler, db_p: Pipeline, db_s: Store, sock: socket.socket, debug: bool,
+              gt_cfg: Gluetube, supervisor: Supervisor, provisioner: Provisioner) -> None:
 
         # keyword arguments for all RPC method calls
-        kwargs = {'scheduler': scheduler, 'db_p': db_p, 'db_s': db_s, 'gt_cfg': gt_cfg}
+        kwargs = {'scheduler': scheduler, 'db_p': db_p, 'db_s': db_s, 'gt_cfg': gt_cfg, 'supervisor': supervisor,
+                  'provisioner': provisioner}
 
         # main daemon loop, protect at all costs
         while True:
@@ -153,7 +185,7 @@ class GluetubeDaemon:
                     continue
             # call rpc method
             try:
-                getattr(self, func)(*args, **kwargs)
+                self._call_rpc(func, args, kwargs)
             except Exception as e:  # catch all exceptions, we don't want the daemon to crash
                 if debug:
                     logging.exception(f"RPC call failed. {e}")
@@ -181,20 +213,62 @@ class GluetubeDaemon:
         sock.listen()
         return sock
 
+    # the runner of a schedule is only created when it fires
     @staticmethod
-    def _setup_scheduler(max_threads: int) -> BackgroundScheduler:
+    def _setup_scheduler(max_threads: int, gt_cfg: Gluetube = None, supervisor: Supervisor = None) -> Scheduler:
 
         try:
-            scheduler = BackgroundScheduler(
-                {
-                    'apscheduler.executors.default':
-                        {'class': 'apscheduler.executors.pool:ThreadPoolExecutor', 'max_workers': f'{max_threads}'}
-                }
-            )
+            scheduler = Scheduler(max_threads, partial(GluetubeDaemon._run_schedule, gt_cfg=gt_cfg, supervisor=supervisor))
         except ValueError as e:
             raise exception.DaemonError(f"Failed to start daemon. Invalid max processes. {e}") from e
         return scheduler
 
+    # called by the scheduler on its own thread. with execution = queue the fire goes on the run queue, for whichever
+    #   worker (gt worker) claims it first, the daemon only schedules
+    @staticmethod
+    def _run_schedule(schedule_id: int, gt_cfg: Gluetube = None, supervisor: Supervisor = None) -> None:
+
+        if gt_cfg.execution != 'queue':
+            run_schedule(schedule_id, gt_cfg, supervisor)
+            return
+
+        db = Pipeline(db_path=Path(gt_cfg.sqlite_dir, gt_cfg.sqlite_app_name), read_only=False, pooled=True)
+        if not db.enqueue_run(schedule_id, time.time()):
+            logging.warning(f"Schedule {schedule_id}, previous run still queued or running on a worker. Skipping.")
+
+    # locally the supervisor knows, with workers a run stays on the queue until it ended
+    @staticmethod
+    def _still_running(schedule_id: int, gt_cfg: Gluetube, supervisor: Supervisor = None) -> bool:
+
+        if gt_cfg.execution != 'queue':
+            return bool(supervisor and supervisor.running(schedule_id))
+
+        db = Pipeline(db_path=Path(gt_cfg.sqlite_dir, gt_cfg.sqlite_app_name), pooled=True)
+        return db.run_queued(schedule_id)
+
+    # a run of the schedule is waiting for its rate limit token (see Runner.run). one whose token is long due lost the
+    #   job that was to start it, a daemon restart, the schedule's next fire starts it. a database that can't be looked
+    #   at doesn't hold anything up
+    @staticmethod
+    def _rate_limited(schedule_id: int, gt_cfg: Gluetube) -> bool:
+
+        try:
+            db = Pipeline(db_path=Path(gt_cfg.sqlite_dir, gt_cfg.sqlite_app_name), pooled=True)
+            pipeline = db.pipeline_from_schedule_id(schedule_id)
+            waiting = pipeline and db.rate_limited_run(pipeline[0], schedule_id)
+        except sqlite3.Error as e:
+            logging.error(f"Schedule {schedule_id}, failed to look for a rate limited run. {e}")
+            return False
+        if not waiting:
+            return False
+        return time.time() < waiting[1] / 1000000 + (waiting[2] or 0.0) + MISFIRE_GRACE_TIME
+
+    # an RPC is one unit of work, its writes are committed together once it returned, or rolled back if it raised
+    def _call_rpc(self, func: str, args: list, kwargs: dict) -> None:
+
+        with kwargs['db_p'].transaction(), kwargs['db_s'].transaction():
+            getattr(self, func)(*args, **kwargs)
+
     # Helper function to recv number of bytes or return None if EOF is hit
     @staticmethod
     def _recv_all(sock: socket.socket, num_bytes: int) -> Union[bytearray, None]:
@@ -207,52 +281,126 @@ class GluetubeDaemon:
             data.extend(packet)
         return data
 
+    # only schedules that will fire get a job, paused and unscheduled ones are left out. returns the ids of every
+    #   schedule, the caller records their next fire times
     @staticmethod
-    def _schedule_pipelines(scheduler: BackgroundScheduler, db: Pipeline, gt_cfg: Gluetube) -> None:
+    def _schedule_pipelines(scheduler: Scheduler, db: Pipeline) -> List[int]:
 
         pipelines = db.all_pipelines_scheduling()
         for pipeline in pipelines:
 
-            # if pipeline job is scheduled
-            if scheduler.get_job(str(pipeline[4])):
-                continue
-
-            try:
-                runner = Runner(pipeline[0], pipeline[1], pipeline[2], pipeline[3], pipeline[4], gt_cfg)
-            except exception.RunnerError as e:
-                logging.error(f"{e}. Not scheduling pipeline, {pipeline[1]}, runner creation failed.")
+            if pipeline[7]:  # if paused
                 continue
 
             if pipeline[5]:  # if cron
                 try:
-                    scheduler.add_job(runner.run, CronTrigger.from_crontab(pipeline[5]), id=str(pipeline[4]))
+                    scheduler.add(pipeline[4], cron_trigger(pipeline[5], pipeline[4]))
                 except ValueError as e:  # crontab validation failed
                     logging.error(f"Pipeline, {pipeline[1]}, not scheduled!. crontab incorrect: {pipeline[5]}. {e}")
             elif pipeline[6]:  # if run_date
                 try:
-                    scheduler.add_job(runner.run, DateTrigger(pipeline[6]), id=str(pipeline[4]))
+                    scheduler.add(pipeline[4], DateTrigger(pipeline[6]))
                 except ValueError as e:  # run_date validation failed
                     logging.error(f"Pipeline, {pipeline[1]}, no scheduled!. run_date incorrect: {pipeline[6]}. {e}")
-            else:  # if no schedule, set dummy schedule
-                scheduler.add_job(runner.run, DateTrigger(datetime(2999, 1, 1)), id=str(pipeline[4]))
 
-            if pipeline[7]:  # if paused
-                scheduler.get_job(str(pipeline[4])).pause()
+        return [x[4] for x in pipelines if x[4] is not None]
+
+    # the missed fire times of a schedule are worked out from its cron and the start time of its latest run
+    @staticmethod
+    def _catch_up(scheduler: Scheduler, db: Pipeline, gt_cfg: Gluetube, supervisor: Supervisor = None) -> None:
+
+        now = datetime.now(timezone.utc)
+        replays = []
+        for schedule_id, cron, catchup, latest_start_time in db.catchup_schedules():
+            try:
+                since = util.from_epoch_us(latest_start_time)
+                missed = missed_fire_times(cron_trigger(cron, schedule_id), since, now, MAX_CATCHUP_RUNS)
+            except ValueError as e:
+                logging.error(f"Schedule {schedule_id} can't catch up on missed runs. {e}")
+                continue
+            if not missed:
+                continue
+
+            if catchup == 'latest':
+                logging.info(f"Schedule {schedule_id} missed {len(missed)} run(s), running it once.")
+                scheduler.run_now(schedule_id)
+            else:
+                if len(missed) > MAX_CATCHUP_RUNS:
+                    logging.warning(f"Schedule {schedule_id} missed more than {MAX_CATCHUP_RUNS} runs, "
+                                    f"only catching up on {MAX_CATCHUP_RUNS}.")
+                    missed = missed[:MAX_CATCHUP_RUNS]
+                logging.info(f"Schedule {schedule_id} missed {len(missed)} run(s), catching up on all of them.")
+                replays.append((schedule_id, len(missed)))
+
+        if not replays:
+            return
+
+        # one schedule's runs go one after the other, up to catchup_workers schedules catch up at once
+        executor = ThreadPoolExecutor(max_workers=int(gt_cfg.catchup_workers), thread_name_prefix='catchup')
+        for schedule_id, runs in replays:
+            executor.submit(GluetubeDaemon._replay, schedule_id, runs, gt_cfg, supervisor)
+        executor.shutdown(wait=False)
 
     @staticmethod
-    def _schedule_auto_discovery(scheduler: BackgroundScheduler, gt_cfg: Gluetube) -> None:
+    def _replay(schedule_id: int, runs: int, gt_cfg: Gluetube, supervisor: Supervisor = None) -> None:
+
+        for _ in range(runs):
+            # the previous run (a replayed one, or a regular fire) has to finish first, otherwise this one is skipped.
+            #   one waiting for its rate limit token is still to come
+            while GluetubeDaemon._still_running(schedule_id, gt_cfg, supervisor) \
+                    or GluetubeDaemon._rate_limited(schedule_id, gt_cfg):
+                time.sleep(1)
+            try:
+                GluetubeDaemon._run_schedule(schedule_id, gt_cfg, supervisor)
+            except Exception as e:  # catch all exceptions, one failed run must not end the catch up
+                logging.error(f"Schedule {schedule_id} failed to catch up on a missed run. {e}")
+
+    @staticmethod
+    def _schedule_auto_discovery(scheduler: Scheduler, gt_cfg: Gluetube) -> Union[PipelineWatcher, None]:
 
         interval = IntervalTrigger(seconds=int(gt_cfg.pipeline_scan_interval))
 
         try:
             pipeline_scanner = PipelineScanner(Path(gt_cfg.pipeline_dir), Path(gt_cfg.socket_file),
-                                               db_dir=Path(gt_cfg.sqlite_dir), db_name=gt_cfg.sqlite_app_name)
+                                               db_dir=Path(gt_cfg.sqlite_dir), db_name=gt_cfg.sqlite_app_name,
+                                               include=gt_cfg.pipeline_include, exclude=gt_cfg.pipeline_exclude)
         except exception.AutodiscoveryError as e:
             raise exception.DaemonError(f"Failed to initialize pipeline scanner. {e}") from e
 
-        # if pipeline scanner job isn't scheduled at all
-        if not scheduler.get_job('pipeline_scanner'):
-            scheduler.add_job(pipeline_scanner.scan, interval, id='pipeline_scanner')
+        # if pipeline scanner job isn't scheduled at all. first scan right away, then only when directories changed
+        if 'pipeline_scanner' not in scheduler:
+            scheduler.add('pipeline_scanner', interval, func=pipeline_scanner.scan_if_changed,
+                          next_fire_time=datetime.now(timezone.utc))
+
+        # react to changes within milliseconds where inotify is available, polling stays on as the safety net
+        if not PipelineWatcher.available():
+            logging.info("inotify not available, discovering pipelines by polling.")
+            return None
+        watcher = PipelineWatcher(pipeline_scanner)
+        watcher.start()
+        return watcher
+
+    @staticmethod
+    def _schedule_housekeeping(scheduler: Scheduler, gt_cfg: Gluetube) -> None:
+
+        if 'housekeeping' not in scheduler:
+            scheduler.add('housekeeping', IntervalTrigger(seconds=int(gt_cfg.housekeeping_interval)),
+                          func=partial(GluetubeDaemon._housekeep, gt_cfg))
+
+    # called by the scheduler on its own thread, with a connection of its own. it writes in short batches, RPCs and
+    #   runs carry on in between
+    @staticmethod
+    def _housekeep(gt_cfg: Gluetube) -> None:
+
+        try:
+            expired = housekeeping.housekeep(gt_cfg)
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logging.error(f"Housekeeping failed. {e}")
+            return
+
+        if expired:
+            GluetubeDaemon._prune_artifacts(
+                Pipeline(db_path=Path(gt_cfg.sqlite_dir, gt_cfg.sqlite_app_name), pooled=True), gt_cfg)
 
     # #################################################################################
     # RPC methods that are called from daemon loop when msg received from unix socket #
@@ -262,150 +410,275 @@ class GluetubeDaemon:
 
     # auto-discovery calls this whenever a new pipeline.py AND pipeline_directory unique tuple is found
     def set_pipeline(self, name: str, py_name: str, dir_name: str, py_timestamp: str,
-                     **kwargs: Union[BackgroundScheduler, Pipeline, Store, Gluetube]) -> None:
+                     **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor, Provisioner]) -> None:
 
+        # the pipeline and its schedule are added together, or not at all. an unscheduled schedule has no job, until it
+        #   gets a cron or at
         try:
-            pipeline_id = kwargs['db_p'].insert_pipeline(name, py_name, dir_name, py_timestamp)
-            logging.info(f"Pipeline, {name}, added to database.")
+            with kwargs['db_p'].transaction():
+                pipeline_id = kwargs['db_p'].insert_pipeline(name, py_name, dir_name, py_timestamp)
+                kwargs['db_p'].insert_pipeline_schedule(pipeline_id)
         except sqlite3.Error as e:
             raise exception.DaemonError(f"Failed to update database. {e}") from e
-
-        try:
-            pipeline_schedule_id = kwargs['db_p'].insert_pipeline_schedule(pipeline_id)
-            logging.info(f"Pipeline schedule for, {name}, added to database.")
-        except sqlite3.Error as e:
-            raise exception.DaemonError(f"Failed to update database. {e}") from e
-
-        try:
-            # job runs if no trigger is specified. So, I set a dummy date trigger for now to avoid job run
-            self._schedule_add_job(pipeline_schedule_id, DateTrigger(datetime(2999, 1, 1)), kwargs['scheduler'],
-                                   kwargs['db_p'], kwargs['gt_cfg'])
-        except (ConflictingIdError, exception.RunnerError) as e:
-            # rollback database insert
-            kwargs['db_p'].delete_pipeline(pipeline_id)
-            raise exception.DaemonError(f"Failed to add pipeline schedule. {e}") from e
+        logging.info(f"Pipeline, {name}, and its schedule added to database.")
 
     # auto-discovery calls this whenever a pipeline.py AND pipeline_directory unique tuple disappears
     @staticmethod
     def delete_pipeline(pipeline_id: int,
-                        **kwargs: Union[BackgroundScheduler, Pipeline, Store, Gluetube]) -> None:
+                        **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor, Provisioner]) -> None:
 
         schedules_id = kwargs['db_p'].pipeline_schedules_id(pipeline_id)
 
         # remove all schedules for the pipeline
         for an_id in schedules_id:
-            try:
-                kwargs['scheduler'].remove_job(str(an_id))
-            except JobLookupError as e:
-                raise exception.DaemonError(f"Failed to delete pipeline schedule. {e}") from e
+            kwargs['scheduler'].remove(an_id)
 
         try:
+            run_ids = kwargs['db_p'].pipeline_run_ids(pipeline_id=pipeline_id)
             kwargs['db_p'].delete_pipeline(pipeline_id)
             logging.info(f"Deleted pipeline id {pipeline_id} from the database.")
         except sqlite3.Error as e:
             raise exception.DaemonError(f"Failed to delete pipeline from database. {e}") from e
 
+        GluetubeDaemon._prune_run_artifacts(kwargs['db_p'], kwargs['gt_cfg'], run_ids)
+
+    # auto-discovery calls this with every pipeline added, removed ([py_name, dir_name, py_timestamp], pipeline_id)
+    #   and modified ([pipeline_id, py_timestamp]) since the last scan. applied to the database in one transaction.
+    #   provision lists the pipeline directories whose environment needs a (re)build
+    def reconcile_pipelines(self, added: List[List], removed: List[int], modified: List[List], provision: List[str] = None,
+                            **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor, Provisioner]) -> None:
+
+        # name new pipelines against the names we already have, in memory
+        pipelines = {x[0]: x for x in kwargs['db_p'].all_pipelines()}
+        names = {x[1] for x in pipelines.values()}
+
+        # the scanner sends its diff without waiting for it to be applied, a second scan before then (the watcher and
+        #   the poll) sends the same pipelines again. those already in the database aren't added twice
+        existing = {(x[2], x[3]) for x in pipelines.values()}
+        new_pipelines = []
+        for py_name, dir_name, py_timestamp in added:
+            if (py_name, dir_name) in existing:
+                continue
+            existing.add((py_name, dir_name))
+            name = generate_unique_pipeline_name(names)
+            names.add(name)
+            new_pipelines.append((name, py_name, dir_name, py_timestamp))
+
+        removed_set = set(removed)
+        removed_schedules_id = [x[4] for x in kwargs['db_p'].all_pipelines_scheduling()
+                                if x[0] in removed_set and x[4] is not None]
+
+        try:
+            removed_run_ids = [x for pipeline_id in removed for x in kwargs['db_p'].pipeline_run_ids(pipeline_id=pipeline_id)]
+            new_ids = kwargs['db_p'].reconcile_pipelines(new_pipelines, removed, [tuple(x) for x in modified])
+        except (sqlite3.Error, exception.dbError) as e:
+            raise exception.DaemonError(f"Failed to reconcile pipelines. {e}") from e
+
+        for an_id in removed_schedules_id:
+            kwargs['scheduler'].remove(an_id)
+        self._prune_run_artifacts(kwargs['db_p'], kwargs['gt_cfg'], removed_run_ids)
+
+        for pipeline_id, _ in modified:
+            if pipeline_id in pipelines:
+                invalidate_cache(pipelines[pipeline_id][3], pipelines[pipeline_id][2])
+
+        # build environments in the background, long before the first scheduled run needs them
+        env_dirs = set(provision or []) | {x[2] for x in new_pipelines}
+        env_dirs |= {pipelines[x[0]][3] for x in modified if x[0] in pipelines}
+        kwargs['db_p'].update_pipeline_env_statuses(sorted(env_dirs), 'pending')
+        for dir_name in sorted(env_dirs):
+            kwargs['provisioner'].submit(dir_name)
+
+        logging.info(f"Pipelines reconciled. {len(new_ids)} added, {len(removed)} removed, {len(modified)} modified.")
+
     def set_schedule(self, pipeline_id: int,
-                     **kwargs: Union[BackgroundScheduler, Pipeline, Store, Gluetube]) -> None:
+                     **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor, Provisioner]) -> None:
 
+        # an unscheduled schedule has no job, until it gets a cron or at
         try:
-            schedule_id = kwargs['db_p'].insert_pipeline_schedule(pipeline_id)
+            kwargs['db_p'].insert_pipeline_schedule(pipeline_id)
         except sqlite3.Error as e:
             raise exception.DaemonError(f"Failed to update database. {e}") from e
 
-        try:
-            self._schedule_add_job(schedule_id, DateTrigger(datetime(2999, 1, 1)), kwargs['scheduler'], kwargs['db_p'],
-                                   kwargs['gt_cfg'])
-        except exception.RunnerError as e:
-            raise exception.DaemonError(f"Failed to modify pipeline schedule. {e}") from e
-
     def set_schedule_cron(self, schedule_id: int, cron: str,
-                          **kwargs: Union[BackgroundScheduler, Pipeline, Store, Gluetube]) -> None:
+                          **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor, Provisioner]) -> None:
 
-        if kwargs['scheduler'].get_job(str(schedule_id)):
-            try:
-                kwargs['scheduler'].reschedule_job(str(schedule_id), trigger=CronTrigger.from_crontab(cron))
-            except JobLookupError as e:
-                raise exception.DaemonError(f"Failed to modify pipeline schedule. {e}") from e
-        else:
-            try:
-                self._schedule_add_job(schedule_id, CronTrigger.from_crontab(cron), kwargs['scheduler'], kwargs['db_p'],
-                                       kwargs['gt_cfg'])
-            except exception.RunnerError as e:
-                raise exception.DaemonError(f"Failed to modify pipeline schedule. {e}") from e
+        try:
+            trigger = cron_trigger(cron, schedule_id)
+        except ValueError as e:
+            raise exception.DaemonError(f"Failed to modify pipeline schedule. {e}") from e
 
-        # remove at if exists, then set cron in db
+        # remove at if exists, then set cron in db. a paused schedule keeps its new cron in the database, it gets a job
+        #   once it's resumed
         try:
-            if kwargs['db_p'].pipeline_schedule_at(schedule_id):
-                kwargs['db_p'].update_pipeline_schedule_at(schedule_id, '')
-            kwargs['db_p'].update_pipeline_schedule_cron(schedule_id, cron)
+            with kwargs['db_p'].transaction():
+                if kwargs['db_p'].pipeline_schedule_at(schedule_id):
+                    kwargs['db_p'].update_pipeline_schedule_at(schedule_id, '')
+                kwargs['db_p'].update_pipeline_schedule_cron(schedule_id, cron)
+                self._reschedule(schedule_id, trigger, **kwargs)
         except sqlite3.Error as e:
             raise exception.DaemonError(f"Failed to update database. {e}") from e
 
     def set_schedule_at(self, schedule_id: int, at: str,
-                        **kwargs: Union[BackgroundScheduler, Pipeline, Store, Gluetube]) -> None:
+                        **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor, Provisioner]) -> None:
 
-        # need to check if the job exists or not. Once a run-once job has been run, it's auto-removed from scheduler
-        if kwargs['scheduler'].get_job(str(schedule_id)):
-            try:
-                kwargs['scheduler'].reschedule_job(str(schedule_id), trigger=DateTrigger(at))
-            except JobLookupError as e:
-                raise exception.DaemonError(f"Failed to modify pipeline schedule. {e}") from e
-        else:
-            try:
-                self._schedule_add_job(schedule_id, DateTrigger(at), kwargs['scheduler'], kwargs['db_p'],
-                                       kwargs['gt_cfg'])
-            except exception.RunnerError as e:
-                raise exception.DaemonError(f"Failed to modify pipeline schedule. {e}") from e
+        try:
+            trigger = DateTrigger(at)
+        except ValueError as e:
+            raise exception.DaemonError(f"Failed to modify pipeline schedule. {e}") from e
 
-        # remove cron if exists, then set at in db
+        # remove cron if exists, then set at in db. a run-once job is removed from the scheduler once it has run, adding
+        #   replaces any job left
         try:
-            if kwargs['db_p'].pipeline_schedule_cron(schedule_id):
-                kwargs['db_p'].update_pipeline_schedule_cron(schedule_id, '')
-            kwargs['db_p'].update_pipeline_schedule_at(schedule_id, at)
+            with kwargs['db_p'].transaction():
+                if kwargs['db_p'].pipeline_schedule_cron(schedule_id):
+                    kwargs['db_p'].update_pipeline_schedule_cron(schedule_id, '')
+                kwargs['db_p'].update_pipeline_schedule_at(schedule_id, at)
+                self._reschedule(schedule_id, trigger, **kwargs)
         except sqlite3.Error as e:
             raise exception.DaemonError(f"Failed to update database. {e}") from e
 
     def set_schedule_now(self, schedule_id: int,
-                         **kwargs: Union[BackgroundScheduler, Pipeline, Store, Gluetube]) -> None:
+                         **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor, Provisioner]) -> None:
 
-        if kwargs['scheduler'].get_job(str(schedule_id)):
-            try:
-                kwargs['scheduler'].reschedule_job(str(schedule_id))
-            except JobLookupError as e:
-                raise exception.DaemonError(f"Failed to modify pipeline schedule. {e}") from e
-        else:
-            try:
-                self._schedule_add_job(schedule_id, None, kwargs['scheduler'], kwargs['db_p'], kwargs['gt_cfg'])
-            except exception.RunnerError as e:
-                raise exception.DaemonError(f"Failed to modify pipeline schedule. {e}") from e
+        # runs once, right away. the cron or at it had is dropped
+        kwargs['scheduler'].remove(schedule_id)
+        kwargs['scheduler'].run_now(schedule_id)
 
         # remove cron and at if exists
         try:
-            if kwargs['db_p'].pipeline_schedule_cron(schedule_id):
-                kwargs['db_p'].update_pipeline_schedule_cron(schedule_id, '')
-            if kwargs['db_p'].pipeline_schedule_at(schedule_id):
-                kwargs['db_p'].update_pipeline_schedule_at(schedule_id, '')
+            with kwargs['db_p'].transaction():
+                if kwargs['db_p'].pipeline_schedule_cron(schedule_id):
+                    kwargs['db_p'].update_pipeline_schedule_cron(schedule_id, '')
+                if kwargs['db_p'].pipeline_schedule_at(schedule_id):
+                    kwargs['db_p'].update_pipeline_schedule_at(schedule_id, '')
+                self._record_next_fires(kwargs['scheduler'], kwargs['db_p'], [schedule_id])
+        except sqlite3.Error as e:
+            raise exception.DaemonError(f"Failed to update database. {e}") from e
+
+    @staticmethod
+    def set_schedule_timeout(schedule_id: int, timeout: int,
+                             **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor, Provisioner]) -> None:
+
+        try:
+            kwargs['db_p'].update_pipeline_schedule_timeout(schedule_id, timeout)
+        except sqlite3.Error as e:
+            raise exception.DaemonError(f"Failed to update database. {e}") from e
+
+    @staticmethod
+    def set_schedule_catchup(schedule_id: int, catchup: str,
+                             **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor, Provisioner]) -> None:
+
+        if catchup not in CATCHUP_POLICIES:
+            raise exception.DaemonError(f"Failed to set schedule catch up. Unknown policy, {catchup}.")
+
+        try:
+            kwargs['db_p'].update_pipeline_schedule_catchup(schedule_id, catchup)
+        except sqlite3.Error as e:
+            raise exception.DaemonError(f"Failed to update database. {e}") from e
+
+    # the name of a pool in the [rate_limits] config section, a RUNS/SPAN of the schedule's own, or empty for none
+    @staticmethod
+    def set_schedule_rate_limit(schedule_id: int, rate_limit: str,
+                                **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor,
+                                                Provisioner]) -> None:
+
+        if rate_limit:
+            try:
+                util.rate_limit_pool(rate_limit, schedule_id, kwargs['gt_cfg'].rate_limits)
+            except ValueError as e:
+                raise exception.DaemonError(
+                    f"Failed to set schedule rate limit. Not a pool or a rate, {rate_limit}.") from e
+
+        try:
+            kwargs['db_p'].update_pipeline_schedule_rate_limit(schedule_id, rate_limit)
+        except sqlite3.Error as e:
+            raise exception.DaemonError(f"Failed to update database. {e}") from e
+
+    @staticmethod
+    def set_schedule_dependency(schedule_id: int, upstream_schedule_id: int, on_status: str = 'finished',
+                                **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor,
+                                                Provisioner]) -> None:
+
+        if on_status not in DEPENDENCY_STATUSES:
+            raise exception.DaemonError(f"Failed to add schedule dependency. Unknown status, {on_status}.")
+
+        # walk the upstream schedule's own upstreams, if we get back to this schedule the new edge closes a cycle
+        upstreams = {}
+        for a_schedule_id, an_upstream_id in kwargs['db_p'].all_pipeline_schedule_dependencies():
+            upstreams.setdefault(a_schedule_id, []).append(an_upstream_id)
+        to_visit = [upstream_schedule_id]
+        visited = set()
+        while to_visit:
+            current = to_visit.pop()
+            if current == schedule_id:
+                raise exception.DaemonError(f"Failed to add schedule dependency. Schedule {schedule_id} would "
+                                            f"depend on itself through schedule {upstream_schedule_id}.")
+            if current in visited:
+                continue
+            visited.add(current)
+            to_visit.extend(upstreams.get(current, []))
+
+        try:
+            kwargs['db_p'].insert_pipeline_schedule_dependency(schedule_id, upstream_schedule_id, on_status)
+        except (sqlite3.Error, exception.dbError) as e:
+            raise exception.DaemonError(f"Failed to update database. {e}") from e
+
+    @staticmethod
+    def delete_schedule_dependency(schedule_id: int, upstream_schedule_id: int,
+                                   **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor,
+                                                   Provisioner]) -> None:
+
+        try:
+            kwargs['db_p'].delete_pipeline_schedule_dependency(schedule_id, upstream_schedule_id)
         except sqlite3.Error as e:
             raise exception.DaemonError(f"Failed to update database. {e}") from e
 
     @staticmethod
     def delete_schedule(schedule_id: int,
-                        **kwargs: Union[BackgroundScheduler, Pipeline, Store, Gluetube]) -> None:
+                        **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor, Provisioner]) -> None:
 
-        if kwargs['scheduler'].get_job(str(schedule_id)):
-            kwargs['scheduler'].remove_job(str(schedule_id))
+        kwargs['scheduler'].remove(schedule_id)
 
         try:
+            run_ids = kwargs['db_p'].pipeline_run_ids(schedule_id=schedule_id)
             kwargs['db_p'].delete_pipeline_schedule(schedule_id)
         except sqlite3.Error as e:
             raise exception.DaemonError(f"Failed to update database. {e}") from e
 
+        GluetubeDaemon._prune_run_artifacts(kwargs['db_p'], kwargs['gt_cfg'], run_ids)
+
     # ##### database writes
 
+    # history a pipeline keeps, see housekeeping. 0 falls back to the global RUN_KEEP_DAYS and RUN_KEEP_RUNS
+    @staticmethod
+    def set_pipeline_keep_days(pipeline_id: int, keep_days: int,
+                               **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor, Provisioner]) -> None:
+
+        if keep_days < 0:
+            raise exception.DaemonError(f"Failed to set pipeline retention. Days can't be negative, {keep_days}.")
+
+        try:
+            kwargs['db_p'].update_pipeline_keep_days(pipeline_id, keep_days)
+        except sqlite3.Error as e:
+            raise exception.DaemonError(f"Failed to update database. {e}") from e
+
+    @staticmethod
+    def set_pipeline_keep_runs(pipeline_id: int, keep_runs: int,
+                               **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor, Provisioner]) -> None:
+
+        if keep_runs < 0:
+            raise exception.DaemonError(f"Failed to set pipeline retention. Runs can't be negative, {keep_runs}.")
+
+        try:
+            kwargs['db_p'].update_pipeline_keep_runs(pipeline_id, keep_runs)
+        except sqlite3.Error as e:
+            raise exception.DaemonError(f"Failed to update database. {e}") from e
+
     @staticmethod
     def set_schedule_latest_run(schedule_id: int, pipeline_run_id: int,
-                                **kwargs: Union[BackgroundScheduler, Pipeline, Store, Gluetube]) -> None:
+                                **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor,
+                                                Provisioner]) -> None:
 
         try:
             kwargs['db_p'].update_pipeline_schedule_latest_run(schedule_id, pipeline_run_id)
@@ -413,18 +686,42 @@ class GluetubeDaemon:
             raise exception.DaemonError(f"Failed to update database. {e}") from e
 
     @staticmethod
-    def set_pipeline_run(pipeline_id: int, schedule_id: int, status: str, start_time: str,
-                         **kwargs: Union[BackgroundScheduler, Pipeline, Store, Gluetube]) -> None:
+    def set_pipeline_run(pipeline_id: int, schedule_id: int, status: str, start_time: int, rate_limit_wait: float = None,
+                         **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor, Provisioner]) -> None:
 
+        # the scheduler has moved on to the schedule's next fire by the time its run starts
         try:
-            kwargs['db_p'].insert_pipeline_run(pipeline_id, schedule_id, status, start_time)
+            with kwargs['db_p'].transaction():
+                kwargs['db_p'].insert_pipeline_run(pipeline_id, schedule_id, status, start_time, rate_limit_wait)
+                GluetubeDaemon._record_next_fires(kwargs['scheduler'], kwargs['db_p'], [schedule_id])
+        except sqlite3.Error as e:
+            raise exception.DaemonError(f"Failed to update database. {e}") from e
+
+        # a run waiting for its rate limit token isn't waited on by any thread. the schedule fires again once the token
+        #   is there, and that fire starts the run (see Runner.run)
+        if status == 'rate_limited' and rate_limit_wait:
+            run_date = datetime.fromtimestamp(start_time / 1000000 + rate_limit_wait, timezone.utc)
+            kwargs['db_p'].after_commit(partial(
+                kwargs['scheduler'].add, ('rate_limited', schedule_id), DateTrigger(run_date=run_date),
+                func=partial(GluetubeDaemon._run_schedule, schedule_id, kwargs['gt_cfg'], kwargs['supervisor'])
+            ))
+
+    # a rate limited run got its token, runner.py calls this as it starts the pipeline
+    @staticmethod
+    def set_pipeline_run_started(pipeline_run_id: int, start_time: int, rate_limit_wait: float,
+                                 **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor,
+                                                 Provisioner]) -> None:
+
+        try:
+            kwargs['db_p'].update_pipeline_run_started(pipeline_run_id, start_time, rate_limit_wait)
         except sqlite3.Error as e:
             raise exception.DaemonError(f"Failed to update database. {e}") from e
 
     # pipeline.py calls this to update the status it's in
     @staticmethod
     def set_pipeline_run_status(pipeline_run_id: int, status: str,
-                                **kwargs: Union[BackgroundScheduler, Pipeline, Store, Gluetube]) -> None:
+                                **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor,
+                                                Provisioner]) -> None:
 
         try:
             kwargs['db_p'].update_pipeline_run_status(pipeline_run_id, status)
@@ -434,7 +731,8 @@ class GluetubeDaemon:
     # pipeline.py calls this to update the stage it's in
     @staticmethod
     def set_pipeline_run_stage_and_stage_msg(pipeline_run_id: int, stage: int, msg: str,
-                                             **kwargs: Union[BackgroundScheduler, Pipeline, Store, Gluetube]) -> None:
+                                             **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor,
+                                                             Provisioner]) -> None:
 
         try:
             kwargs['db_p'].update_pipeline_run_stage_and_stage_msg(pipeline_run_id, stage, msg)
@@ -442,18 +740,57 @@ class GluetubeDaemon:
             raise exception.DaemonError(f"Failed to update database. {e}") from e
 
     # runner.py calls this to update the pipeline run when it's done
+    def set_pipeline_run_finished(self, pipeline_run_id: int, status: str, msg: str, end_time: int,
+                                  **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor,
+                                                  Provisioner]) -> None:
+
+        # the run ends and the dependencies it satisfies are marked together, and its pipeline's stats take it in
+        with kwargs['db_p'].transaction():
+            try:
+                run = kwargs['db_p'].pipeline_run(pipeline_run_id)
+                kwargs['db_p'].update_pipeline_run_status_exit_msg_end_time(pipeline_run_id, status, msg, end_time)
+                if run and run[7] is None:  # a run that already ended is in its stats
+                    kwargs['db_p'].add_pipeline_stats(pipeline_run_id)
+            except sqlite3.Error as e:
+                raise exception.DaemonError(f"Failed to update database. {e}") from e
+
+            try:
+                self._schedule_dependents(pipeline_run_id, status, kwargs['scheduler'], kwargs['db_p'], kwargs['gt_cfg'],
+                                          kwargs['supervisor'])
+            except sqlite3.Error as e:
+                raise exception.DaemonError(f"Failed to trigger dependent schedules. {e}") from e
+
+            # a fire skipped while the run was going moved the next fire time on as well
+            if run:
+                try:
+                    self._record_next_fires(kwargs['scheduler'], kwargs['db_p'], [run[1]])
+                except sqlite3.Error as e:
+                    raise exception.DaemonError(f"Failed to update database. {e}") from e
+
+    # pipeline.py calls this once an artifact file is in place
     @staticmethod
-    def set_pipeline_run_finished(pipeline_run_id: int, status: str, msg: str, end_time: str,
-                                  **kwargs: Union[BackgroundScheduler, Pipeline, Store, Gluetube]) -> None:
+    def set_pipeline_artifact(pipeline_run_id: int, name: str, size: int,
+                              **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor, Provisioner]) -> None:
 
         try:
-            kwargs['db_p'].update_pipeline_run_status_exit_msg_end_time(pipeline_run_id, status, msg, end_time)
+            kwargs['db_p'].insert_pipeline_artifact(pipeline_run_id, name, size)
+        except (sqlite3.Error, exception.dbError) as e:
+            raise exception.DaemonError(f"Failed to update database. {e}") from e
+
+    # the provisioner reports the environment of a pipeline directory as provisioning, ready or failed
+    @staticmethod
+    def set_pipeline_env_status(dir_name: str, status: str,
+                                **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor,
+                                                Provisioner]) -> None:
+
+        try:
+            kwargs['db_p'].update_pipeline_env_status(dir_name, status)
         except sqlite3.Error as e:
             raise exception.DaemonError(f"Failed to update database. {e}") from e
 
     @staticmethod
     def set_key_value(key: str, value: str, table: str = 'common',
-                      **kwargs: Union[BackgroundScheduler, Pipeline, Store, Gluetube]) -> None:
+                      **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor, Provisioner]) -> None:
 
         try:
             kwargs['db_s'].insert_key_value(table, key, value)
@@ -462,7 +799,7 @@ class GluetubeDaemon:
 
     @staticmethod
     def delete_key(key: str, table: str = 'common',
-                   **kwargs: Union[BackgroundScheduler, Pipeline, Store, Gluetube]) -> None:
+                   **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor, Provisioner]) -> None:
 
         try:
             kwargs['db_s'].delete_key(table, key)
@@ -472,7 +809,8 @@ class GluetubeDaemon:
     # ##### administrative stuff
 
     @staticmethod
-    def rekey_db(new_password: str, **kwargs: Union[BackgroundScheduler, Pipeline, Store, Gluetube]) -> None:
+    def rekey_db(new_password: str, **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor,
+                                                    Provisioner]) -> None:
 
         key_value_salt = kwargs['db_s'].all_key_values('common')
 
@@ -486,27 +824,127 @@ class GluetubeDaemon:
         kwargs['db_s'].sys_password = new_password
 
         # update values
-        for key, data in key_data.items():
-            kwargs['db_s'].insert_key_value('common', key, data)
+        kwargs['db_s'].insert_key_values('common', list(key_data.items()))
 
         kwargs['gt_cfg'].config.set('gluetube', 'SQLITE_PASSWORD', new_password.decode())
         kwargs['gt_cfg'].write()
 
     # ##### rpc helper methods
 
+    # the schedule's job gets its new trigger once the change is committed, a rolled back change leaves the job as
+    #   the database has it. a paused schedule has no job
+    @staticmethod
+    def _reschedule(schedule_id: int, trigger: BaseTrigger,
+                    **kwargs: Union[Scheduler, Pipeline, Store, Gluetube, Supervisor, Provisioner]) -> None:
+
+        next_fire = None
+        if not kwargs['db_p'].pipeline_schedule_paused(schedule_id):
+            now = datetime.now(timezone.utc)
+            next_fire = trigger.get_next_fire_time(None, now)
+            if next_fire and next_fire.timestamp() < now.timestamp() - MISFIRE_GRACE_TIME:  # never fires, see add
+                next_fire = None
+            kwargs['db_p'].after_commit(partial(kwargs['scheduler'].add, schedule_id, trigger, next_fire_time=next_fire))
+        kwargs['db_p'].update_schedule_state_next_fire_times([(next_fire.isoformat() if next_fire else None, schedule_id)])
+
+    # an artifact lives as long as the pipeline_run row of the run that published it
     @staticmethod
-    def _schedule_add_job(schedule_id: int, trigger: Union[CronTrigger, DateTrigger, None],
-                          scheduler: BackgroundScheduler = None, db_p: Pipeline = None,
-                          gt_cfg: Gluetube = None) -> None:
+    def _prune_artifacts(db_p: Pipeline, gt_cfg: Gluetube) -> None:
 
-        pipeline = db_p.pipeline_from_schedule_id(schedule_id)
+        artifact_dir = Path(gt_cfg.artifact_dir)
+        if not artifact_dir.is_dir():
+            return
 
-        try:
-            runner = Runner(pipeline[0], pipeline[1], pipeline[2], pipeline[3], schedule_id, gt_cfg)
-        except exception.RunnerError(f"Not scheduling pipeline {pipeline[1]}, runner creation failed."):
-            raise
+        for entry in artifact_dir.iterdir():
+            if entry.name.isdigit() and not db_p.pipeline_run(int(entry.name)):
+                shutil.rmtree(entry, ignore_errors=True)
+        GluetubeDaemon._unlink_dangling_latest(artifact_dir)
 
-        try:
-            scheduler.add_job(runner.run, trigger=trigger, id=str(schedule_id))
-        except ConflictingIdError:
-            raise
+    # the artifacts of runs an rpc deletes, removed once the delete is committed. a rolled back delete keeps them
+    @staticmethod
+    def _prune_run_artifacts(db_p: Pipeline, gt_cfg: Gluetube, run_ids: List[int]) -> None:
+
+        if not run_ids:
+            return
+        artifact_dir = Path(gt_cfg.artifact_dir)
+
+        def prune() -> None:
+
+            for run_id in run_ids:
+                shutil.rmtree(Path(artifact_dir, str(run_id)), ignore_errors=True)
+            GluetubeDaemon._unlink_dangling_latest(artifact_dir)
+
+        db_p.after_commit(prune)
+
+    @staticmethod
+    def _unlink_dangling_latest(artifact_dir: Path) -> None:
+
+        latest_dir = Path(artifact_dir, 'latest')
+        if latest_dir.is_dir():
+            for link in latest_dir.iterdir():
+                if link.is_symlink() and not link.exists():
+                    link.unlink()
+
+    # copies the scheduler's next fire time of each schedule into schedule_state, where the summary reads it
+    @staticmethod
+    def _record_next_fires(scheduler: Scheduler, db_p: Pipeline, schedule_ids: List[int]) -> None:
+
+        next_fire_times = [(scheduler.next_fire_time(x), x) for x in schedule_ids]
+        db_p.update_schedule_state_next_fire_times([(x.isoformat() if x else None, y) for x, y in next_fire_times])
+
+    # mark the dependencies a finished run satisfies, then fire every downstream schedule whose upstreams are all done
+    @staticmethod
+    def _schedule_dependents(pipeline_run_id: int, status: str, scheduler: Scheduler = None,
+                             db_p: Pipeline = None, gt_cfg: Gluetube = None, supervisor: Supervisor = None) -> None:
+
+        run = db_p.pipeline_run(pipeline_run_id)
+        if not run:
+            return
+        upstream_schedule_id = run[1]
+
+        for dependency_id, schedule_id, on_status in db_p.pipeline_schedule_dependents(upstream_schedule_id):
+            if on_status not in ('any', status):
+                continue
+            db_p.update_pipeline_schedule_dependency_satisfied_run(dependency_id, pipeline_run_id)
+
+            # fan-in, wait until every upstream schedule is satisfied
+            if any(dependency[3] is None for dependency in db_p.pipeline_schedule_dependencies(schedule_id)):
+                continue
+            db_p.reset_pipeline_schedule_dependencies(schedule_id)
+
+            if db_p.pipeline_schedule_paused(schedule_id):
+                logging.info(f"Schedule {schedule_id} is paused, not triggered by schedule {upstream_schedule_id}.")
+                continue
+
+            # a dependent still running would skip the fire, the trigger waits for it to end instead
+            if gt_cfg and GluetubeDaemon._still_running(schedule_id, gt_cfg, supervisor):
+                GluetubeDaemon._defer_trigger(schedule_id, scheduler, gt_cfg, supervisor)
+                logging.info(f"Schedule {schedule_id} triggered by schedule {upstream_schedule_id}, once its run ended.")
+                continue
+
+            GluetubeDaemon._fire_dependent(schedule_id, scheduler, gt_cfg, supervisor)
+            logging.info(f"Schedule {schedule_id} triggered by schedule {upstream_schedule_id}.")
+
+    # a one off job firing the schedule now. the schedule's own job, its cron or an at still to come, is left alone
+    @staticmethod
+    def _fire_dependent(schedule_id: int, scheduler: Scheduler, gt_cfg: Gluetube, supervisor: Supervisor = None) -> None:
+
+        scheduler.add(('dependency', schedule_id), DateTrigger(run_date=datetime.now(timezone.utc)),
+                      func=partial(GluetubeDaemon._run_schedule, schedule_id, gt_cfg, supervisor))
+
+    # a job looking every DEFERRED_TRIGGER_INTERVAL seconds whether the schedule's run ended, then firing it once.
+    #   more triggers meanwhile are the one job, the same as fires of a running schedule are skipped. it's only in
+    #   memory, a daemon restart drops it
+    @staticmethod
+    def _defer_trigger(schedule_id: int, scheduler: Scheduler, gt_cfg: Gluetube, supervisor: Supervisor = None) -> None:
+
+        key = ('deferred_trigger', schedule_id)
+
+        def fire_once_ended() -> None:
+
+            if GluetubeDaemon._still_running(schedule_id, gt_cfg, supervisor):
+                return
+            if scheduler.remove(key):
+                GluetubeDaemon._fire_dependent(schedule_id, scheduler, gt_cfg, supervisor)
+
+        if key not in scheduler:
+            scheduler.add(key, IntervalTrigger(seconds=DEFERRED_TRIGGER_INTERVAL), func=fire_once_ended)
@@ -0,0 +1,115 @@
+# Craig Tomkow
+# 2023-01-30
+
+# local imports
+import config
+from db import Pipeline
+import util
+
+# python imports
+import gzip
+import logging
+import os
+import shutil
+import time
+from itertools import groupby
+from pathlib import Path
+from typing import List, Tuple
+
+# runs moved out, or deleted, per transaction. the write lock is held for one batch at a time
+BATCH = 500
+
+# pages handed back to the filesystem per incremental vacuum step, again to keep each write short
+VACUUM_PAGES = 1000
+
+# seconds a partition goes without a run moved into it before it's compressed. with RUN_KEEP_DAYS set, a month keeps
+#   getting runs for that many days after it ended
+COMPRESS_AFTER = 86400
+
+
+# keeps gluetube.db the size of the history pipelines keep. ended runs past it are moved into a database file per
+#   month in RUN_ARCHIVE_DIR (runs-YYYY-MM.db, gzipped once it's quiet), or deleted if there's no archive dir. the pages
+#   they freed are given back. returns how many runs left gluetube.db, their artifacts are for the caller to prune
+def housekeep(gt_cfg: config.Gluetube) -> int:
+
+    db = Pipeline(db_path=Path(gt_cfg.sqlite_dir, gt_cfg.sqlite_app_name), read_only=False)
+    try:
+        expired = expire_runs(db, int(gt_cfg.run_keep_days), int(gt_cfg.run_keep_runs), gt_cfg.run_archive_dir)
+        if gt_cfg.run_archive_dir:
+            compress_partitions(Path(gt_cfg.run_archive_dir))
+        while db.incremental_vacuum(VACUUM_PAGES):
+            pass
+    finally:
+        db.close()
+
+    if expired:
+        logging.info(f"Housekeeping. {expired} runs past their pipeline's retention left the database.")
+    return expired
+
+
+def expire_runs(db: Pipeline, keep_days: int, keep_runs: int, archive_dir: str) -> int:
+
+    now = util.epoch_us()
+    expired = 0
+    while True:
+        runs = db.expired_pipeline_runs(keep_days, keep_runs, now, BATCH)
+        if not runs:
+            return expired
+        if archive_dir:
+            for month, month_runs in groupby(sorted(runs, key=lambda x: _month(x[1])), key=lambda x: _month(x[1])):
+                db.move_pipeline_runs([x[0] for x in month_runs], open_partition(Path(archive_dir), month))
+        else:
+            db.delete_pipeline_runs([x[0] for x in runs])
+        expired += len(runs)
+
+
+# the partition of a month, ready for runs to be moved into. a compressed one is decompressed first
+def open_partition(archive_dir: Path, month: str) -> Path:
+
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    partition, compressed = _partition_paths(archive_dir, month)
+    if partition.exists():
+        if compressed.exists():  # left by a crash half way through compressing, the partition is whole
+            compressed.unlink()
+    elif compressed.exists():
+        tmp = Path(f"{partition}.tmp")
+        with gzip.open(compressed, 'rb') as src, open(tmp, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp, partition)
+        compressed.unlink()
+    return partition
+
+
+# gzips the partitions no run was moved into for COMPRESS_AFTER seconds. a compressed partition is a plain sqlite
+#   file again after gunzip
+def compress_partitions(archive_dir: Path) -> List[Path]:
+
+    if not archive_dir.is_dir():
+        return []
+
+    compressed = []
+    for partition in sorted(archive_dir.glob('runs-*.db')):
+        if time.time() - partition.stat().st_mtime < COMPRESS_AFTER:
+            continue
+        _, gz = _partition_paths(archive_dir, partition.name[len('runs-'):-len('.db')])
+        tmp = Path(f"{gz}.tmp")
+        with open(partition, 'rb') as src, gzip.open(tmp, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp, gz)
+        partition.unlink()
+        compressed.append(gz)
+    return compressed
+
+
+# helper functions
+
+
+# YYYY-MM of a start time, in UTC
+def _month(start_time: int) -> str:
+
+    return util.from_epoch_us(start_time).strftime('%Y-%m')
+
+
+def _partition_paths(archive_dir: Path, month: str) -> Tuple[Path, Path]:
+
+    return Path(archive_dir, f"runs-{month}.db"), Path(archive_dir, f"runs-{month}.db.gz")
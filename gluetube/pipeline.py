@@ -5,8 +5,12 @@
 import putil
 
 # python imports
-from typing import Any
+from typing import Any, Union
 import os
+import io
+import re
+import mmap
+import shutil
 from pathlib import Path
 
 cron = None
@@ -28,3 +32,72 @@ def stage(stage=0, msg=''):
 
         return wrapper
     return inner_stage
+
+
+def publish(name: str, data: Union[bytes, bytearray, memoryview, str, Path]) -> Path:
+    """Publish bytes, or an existing file, as an artifact of this run that other pipelines can open.
+
+    A file is hard linked instead of copied when it is on the same filesystem, so don't modify it afterwards.
+    The artifact is kept for as long as this run is kept in the run history.
+    """
+
+    _check_artifact_name(name)
+    run_id = int(os.environ['PIPELINE_RUN_ID'])
+    artifact_dir = Path(os.environ['ARTIFACT_DIR'])
+
+    run_dir = Path(artifact_dir, str(run_id))
+    run_dir.mkdir(parents=True, exist_ok=True)
+    path = Path(run_dir, name)
+    tmp_path = Path(run_dir, f".{name}.tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+    # write beside the final name, then rename, so readers never see a partial artifact
+    if isinstance(data, (str, Path)):
+        try:
+            os.link(data, tmp_path)
+        except OSError:  # different filesystem
+            shutil.copyfile(data, tmp_path)
+    else:
+        with io.open(tmp_path, 'wb') as f:
+            f.write(data)
+    os.replace(tmp_path, path)
+
+    # latest/<name> always points at the most recently published artifact of that name
+    latest_dir = Path(artifact_dir, 'latest')
+    latest_dir.mkdir(parents=True, exist_ok=True)
+    tmp_link = Path(latest_dir, f".{name}.{run_id}.tmp")
+    if tmp_link.is_symlink():
+        tmp_link.unlink()
+    os.symlink(os.path.relpath(path, latest_dir), tmp_link)
+    os.replace(tmp_link, Path(latest_dir, name))
+
+    putil.send_rpc_msg_to_daemon(
+        putil.craft_rpc_msg('set_pipeline_artifact', [run_id, name, path.stat().st_size]),
+        Path(os.environ['SOCKET_FILE'])
+    )
+    return path
+
+
+def open(name: str, run_id: int = None) -> mmap.mmap:
+    """Open an artifact as a read-only memory map, the latest one published unless a run id is given.
+
+    The map stays valid even if the run's artifacts are removed while it is open. Empty artifacts can't be mapped.
+    """
+
+    _check_artifact_name(name)
+    artifact_dir = Path(os.environ['ARTIFACT_DIR'])
+
+    if run_id is None:
+        path = Path(artifact_dir, 'latest', name)
+    else:
+        path = Path(artifact_dir, str(run_id), name)
+
+    with io.open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _check_artifact_name(name: str) -> None:
+
+    if not re.fullmatch(r"[A-Za-z0-9_-][A-Za-z0-9_.-]*", name):
+        raise ValueError(f"Invalid artifact name, {name}. Use letters, digits, '_', '-' and '.' only.")
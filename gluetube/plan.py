@@ -0,0 +1,90 @@
+# Craig Tomkow
+# 2023-01-25
+
+# python imports
+import heapq
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Hashable, List, Tuple, Union
+
+# a pipeline without run history is assumed to take this many seconds
+DEFAULT_DURATION = 60
+
+# only the newest runs of a pipeline say how long it takes today
+DURATION_WINDOW = 100
+
+
+# p95 run duration in seconds per pipeline, from (pipeline_id, duration) rows sorted newest first
+def p95_durations(runs: List[Tuple[int, float]]) -> Dict[int, float]:
+
+    durations = defaultdict(list)
+    for pipeline_id, duration in runs:
+        if len(durations[pipeline_id]) < DURATION_WINDOW:
+            durations[pipeline_id].append(duration)
+    return {pipeline_id: percentile(values, 95) for pipeline_id, values in durations.items()}
+
+
+# nearest-rank percentile
+def percentile(values: List[float], pct: float) -> float:
+
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+# replays fires, (fire_time, schedule_id, duration), against a pool of slots that starts runs in fire order. like the
+#   daemon, a schedule whose previous run is still going skips the fire
+def simulate(fires: List[Tuple[datetime, Hashable, float]], slots: int) -> Dict:
+
+    fires = sorted(fires, key=lambda x: x[0])
+    durations = []
+    free_at = [fires[0][0] if fires else None] * slots  # when each slot is free again, as a heap
+    running_until = {}
+    runs = []  # (fire_time, start_time, end_time)
+    skipped = 0
+
+    for fire_time, schedule_id, duration in fires:
+        if schedule_id in running_until and running_until[schedule_id] > fire_time:
+            skipped += 1
+            continue
+        start_time = max(fire_time, heapq.heappop(free_at))
+        end_time = start_time + timedelta(seconds=duration)
+        heapq.heappush(free_at, end_time)
+        running_until[schedule_id] = end_time
+        runs.append((fire_time, start_time, end_time))
+        durations.append(duration)
+
+    peak, peak_at = _peak([(x[1], x[2]) for x in runs])
+    # how many slots it takes for no run to wait
+    demand, _ = _peak([(x[0], x[0] + timedelta(seconds=y)) for x, y in zip(runs, durations)])
+
+    delays = [(x[1] - x[0]).total_seconds() for x in runs]
+    minutes = defaultdict(lambda: [0, 0.0])
+    for (fire_time, _, _), delay in zip(runs, delays):
+        minute = minutes[fire_time.replace(second=0, microsecond=0)]
+        minute[0] += 1
+        minute[1] = max(minute[1], delay)
+
+    return {
+        'runs': len(runs),
+        'skipped': skipped,
+        'peak': peak,
+        'peak_at': peak_at,
+        'demand': demand,
+        'queued': len([x for x in delays if x > 0]),
+        'mean_delay': sum(delays) / len(delays) if delays else 0.0,
+        'max_delay': max(delays, default=0.0),
+        # (minute, runs fired, longest wait), the longest waits first
+        'worst_minutes': sorted([(k, v[0], v[1]) for k, v in minutes.items()], key=lambda x: (-x[2], -x[1], x[0]))[:5],
+    }
+
+
+# most runs going at once, and when. runs ending at an instant are out before the ones starting at it
+def _peak(runs: List[Tuple[datetime, datetime]]) -> Tuple[int, Union[datetime, None]]:
+
+    peak, peak_at, concurrent = 0, None, 0
+    for at, change in sorted([(x[0], 1) for x in runs] + [(x[1], -1) for x in runs]):
+        concurrent += change
+        if concurrent > peak:
+            peak, peak_at = concurrent, at
+    return peak, peak_at
@@ -0,0 +1,296 @@
+# Craig Tomkow
+# 2023-01-18
+
+# local imports
+import util
+import config
+
+# python imports
+import logging
+import subprocess
+from subprocess import CalledProcessError
+import sys
+import os
+import compileall
+import fcntl
+import threading
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from venv import EnvBuilder
+from pathlib import Path
+from functools import partial
+from contextlib import contextmanager
+from typing import Callable, Iterator
+import shutil
+import tempfile
+
+# per lock file, held while an environment is checked or built. the threads of this process queue up on these,
+#   other processes (the daemon, gt worker) on the flock of the file itself, see _dir_lock
+_dir_locks = {}
+_dir_locks_lock = threading.Lock()
+
+# see set_max_builds
+_build_slots = threading.BoundedSemaphore(2)
+
+
+# builds the environment (venv, requirements, byte-code) of pipeline directories on a bounded pool of worker threads,
+#   so a scheduled run doesn't start minutes late waiting on venv creation and pip
+class Provisioner:
+
+    def __init__(self, gt_cfg: config.Gluetube) -> None:
+
+        self.base_dir = gt_cfg.pipeline_dir
+        self.socket_file = Path(gt_cfg.socket_file)
+        self.http_proxy = gt_cfg.http_proxy
+        self.https_proxy = gt_cfg.https_proxy
+        self.venv_cache_dir = gt_cfg.venv_cache_dir
+        set_max_builds(int(gt_cfg.provision_workers))
+        self._executor = ThreadPoolExecutor(max_workers=int(gt_cfg.provision_workers),
+                                            thread_name_prefix='provisioner')
+        self._queued = set()
+        self._lock = threading.Lock()
+
+    # a directory already waiting in the queue isn't queued twice
+    def submit(self, pipeline_dir_name: str) -> bool:
+
+        with self._lock:
+            if pipeline_dir_name in self._queued:
+                return False
+            self._queued.add(pipeline_dir_name)
+
+        self._executor.submit(self._provision, pipeline_dir_name)
+        return True
+
+    def stop(self) -> None:
+
+        self._executor.shutdown(wait=False)
+
+    def _provision(self, pipeline_dir_name: str) -> None:
+
+        # off the queue before the build starts, so a change made during the build queues another one
+        with self._lock:
+            self._queued.discard(pipeline_dir_name)
+
+        dir_abs_path = Path(Path(self.base_dir).resolve() / pipeline_dir_name).resolve().as_posix()
+        if not Path(dir_abs_path).is_dir():  # removed since it was queued
+            return
+        self._set_status(pipeline_dir_name, 'provisioning')
+
+        try:
+            provision_env(dir_abs_path, self.http_proxy, self.https_proxy, self.venv_cache_dir)
+        except (OSError, CalledProcessError) as e:
+            logging.error(f"Pipeline directory: {pipeline_dir_name}, failed to provision environment. {e}")
+            self._set_status(pipeline_dir_name, 'failed')
+            return
+
+        logging.info(f"Pipeline directory: {pipeline_dir_name}, environment ready.")
+        self._set_status(pipeline_dir_name, 'ready')
+
+    def _set_status(self, pipeline_dir_name: str, status: str) -> None:
+
+        try:
+            util.send_rpc_msg_to_daemon(util.craft_rpc_msg('set_pipeline_env_status', [pipeline_dir_name, status]),
+                                        self.socket_file)
+        except Exception as e:  # catch all exceptions, a status update must never fail a build
+            logging.warning(f"Pipeline directory: {pipeline_dir_name}, failed to report environment status. {e}")
+
+
+# helper functions
+
+
+# venv, requirements and byte-code of a pipeline directory, each step is skipped when already up to date.
+#   single-flight: whoever comes second (a run, the provisioner) waits on the build in progress, then finds it done
+def provision_env(dir: str, http_proxy: str = '', https_proxy: str = '', venv_cache_dir: str = '') -> None:
+
+    with _dir_lock(f"{dir}/.provision.lock"):
+        if not _venv_exists(f"{dir}/.venv"):
+            with _build_slots:
+                _create_venv(dir, venv_cache_dir)
+
+        # install pipeline requirements whenever requirements.txt changed since the last install into this venv
+        if _requirements_exists(f"{dir}/requirements.txt"):
+            fingerprint = _requirements_fingerprint(dir)
+            if fingerprint != _installed_requirements_fingerprint(dir):
+                with _build_slots:
+                    _install_pipeline_requirements(dir, http_proxy, https_proxy)
+                _write_installed_requirements_fingerprint(dir, fingerprint)
+
+        _compile_pipeline_dir(dir)
+
+
+# at most this many venv builds and pip installs at once, across the provisioner and runs that build their own
+def set_max_builds(max_builds: int) -> None:
+
+    global _build_slots
+    _build_slots = threading.BoundedSemaphore(max_builds)
+
+
+# exclusive across threads and processes. the check for an up to date environment is made after it's acquired, a
+#   build that finished while we waited isn't done again
+@contextmanager
+def _dir_lock(lock_file: str) -> Iterator[None]:
+
+    with _dir_locks_lock:
+        lock = _dir_locks.setdefault(lock_file, threading.Lock())
+
+    with lock, open(lock_file, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)  # released when the file is closed
+        yield
+
+
+# the modules a pipeline imports from its directory. the venv and __pycache__ are left alone
+def _compile_pipeline_dir(dir: str) -> None:
+    for root, dirs, files in os.walk(dir):
+        dirs[:] = [x for x in dirs if not x.startswith(('.', '__'))]
+        for file in files:
+            if file.endswith('.py'):
+                compileall.compile_file(os.path.join(root, file), quiet=1)
+
+
+def _requirements_fingerprint(dir: str) -> str:
+    return hashlib.sha256(Path(dir, 'requirements.txt').read_bytes()).hexdigest()
+
+
+# kept inside the venv, so a recreated venv always gets a fresh install
+def _installed_requirements_fingerprint(dir: str) -> str:
+    path = Path(dir, '.venv', 'gluetube_requirements.sha256')
+    if not path.is_file():
+        return ''
+    return path.read_text().strip()
+
+
+def _write_installed_requirements_fingerprint(dir: str, fingerprint: str) -> None:
+    Path(dir, '.venv', 'gluetube_requirements.sha256').write_text(fingerprint)
+
+
+def _venv_exists(path: str) -> bool:
+    path = Path(path)
+    return path.is_dir()
+
+
+def _requirements_exists(path: str) -> bool:
+    path = Path(path)
+    return path.is_file()
+
+
+# a clone of the golden venv when there is a venv cache dir, otherwise built from scratch with ensurepip
+def _create_venv(dir: str, venv_cache_dir: str = '') -> None:
+    if venv_cache_dir:
+        golden_abs_path = _golden_venv(venv_cache_dir)
+        _build_venv_atomically(f"{dir}/.venv", partial(_clone_venv, golden_abs_path))
+    else:
+        _build_venv_atomically(f"{dir}/.venv", _build_venv)
+
+
+# one venv per python version, built once with pip and the gluetube symlink, gluetube and pip byte-compiled.
+#   every pipeline venv is cloned from it
+def _golden_venv(venv_cache_dir: str) -> str:
+    py_version = f"{sys.version_info[0]}.{sys.version_info[1]}"
+    golden_abs_path = Path(venv_cache_dir, f"python{py_version}").resolve().as_posix()
+
+    Path(venv_cache_dir).mkdir(parents=True, exist_ok=True)
+    with _dir_lock(Path(venv_cache_dir, f".python{py_version}.provision.lock").as_posix()):
+        # the interpreter it was built from is gone (reinstalled elsewhere), its venvs can't run anymore
+        if _venv_exists(golden_abs_path) and not Path(golden_abs_path, 'bin', 'python').exists():
+            shutil.rmtree(golden_abs_path)
+        if not _venv_exists(golden_abs_path):
+            _build_venv_atomically(golden_abs_path, _build_golden_venv)
+
+    return golden_abs_path
+
+
+# built in a temporary directory and renamed into place, a run never sees a half built venv and a crashed build
+#   never leaves one behind. the caller holds the venv's _dir_lock
+def _build_venv_atomically(venv_abs_path: str, build: Callable[[str], None]) -> None:
+    parent_dir, name = os.path.split(venv_abs_path)
+    prefix = f"{name}.tmp" if name.startswith('.') else f".{name}.tmp"
+
+    # left over by a build that was killed. no other process builds this venv while we hold its lock, so none of
+    #   these is a build in progress
+    for tmp in Path(parent_dir).glob(f"{prefix}*"):
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    tmp_abs_path = tempfile.mkdtemp(prefix=prefix, dir=parent_dir)
+    try:
+        build(tmp_abs_path)
+        _relocate_venv(tmp_abs_path, tmp_abs_path, venv_abs_path)
+        os.rename(tmp_abs_path, venv_abs_path)
+    except BaseException:
+        shutil.rmtree(tmp_abs_path, ignore_errors=True)
+        raise
+
+
+def _build_venv(venv_abs_path: str) -> None:
+    venv = EnvBuilder(with_pip=True, symlinks=True, prompt='.venv')
+    venv.ensure_directories(venv_abs_path)
+    venv.create(venv_abs_path)
+    _symlink_gluetube_to_venv(venv_abs_path)
+
+
+def _build_golden_venv(venv_abs_path: str) -> None:
+    _build_venv(venv_abs_path)
+    py_version = f"{sys.version_info[0]}.{sys.version_info[1]}"
+    compileall.compile_dir(f"{venv_abs_path}/lib/python{py_version}/site-packages", quiet=1)
+    # gluetube itself is only symlinked into the venv, its byte-code lives next to its source
+    compileall.compile_dir(os.path.dirname(os.path.realpath(__file__)), quiet=1)
+
+
+# hardlinks, so a clone costs directory entries instead of copying data. pip replaces files rather than writing
+#   into them, so the golden venv stays untouched. the files rewritten for the new path are copied
+def _clone_venv(golden_abs_path: str, venv_abs_path: str) -> None:
+    for root, dirs, files in os.walk(golden_abs_path):
+        rel_dir = os.path.relpath(root, golden_abs_path)
+        for name in dirs:
+            src = os.path.join(root, name)
+            dst = os.path.join(venv_abs_path, rel_dir, name)
+            if os.path.islink(src):  # not walked into, e.g. lib64 and the gluetube symlink
+                os.symlink(os.readlink(src), dst)
+            else:
+                os.mkdir(dst)
+        for name in files:
+            src = os.path.join(root, name)
+            dst = os.path.join(venv_abs_path, rel_dir, name)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+            elif rel_dir == 'bin' or (rel_dir == '.' and name == 'pyvenv.cfg'):
+                shutil.copy2(src, dst)
+            else:
+                _link_or_copy(src, dst)
+
+    _relocate_venv(venv_abs_path, golden_abs_path, venv_abs_path)
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:  # venv cache dir on another filesystem
+        shutil.copy2(src, dst)
+
+
+# the scripts in bin/ (pip, activate) and pyvenv.cfg have the venv's path baked in
+def _relocate_venv(venv_abs_path: str, old_path: str, new_path: str) -> None:
+    files = [x for x in Path(venv_abs_path, 'bin').iterdir() if x.is_file() and not x.is_symlink()]
+    for file in files + [Path(venv_abs_path, 'pyvenv.cfg')]:
+        data = file.read_bytes()
+        if old_path.encode() in data:
+            file.write_bytes(data.replace(old_path.encode(), new_path.encode()))
+
+
+def _symlink_gluetube_to_venv(venv_dir: str) -> None:
+    # 3.10
+    py_version = f"{sys.version_info[0]}.{sys.version_info[1]}"
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    src = f"{dir_path}"
+    dst = f"{venv_dir}/lib/python{py_version}/site-packages/gluetube"
+    os.symlink(src, dst)
+
+
+def _install_pipeline_requirements(dir: str, http_proxy: str = '', https_proxy: str = '') -> None:
+    env_vars = os.environ.copy()
+    env_vars['HTTP_PROXY'] = http_proxy
+    env_vars['HTTPS_PROXY'] = https_proxy
+
+    try:
+        subprocess.check_output(['.venv/bin/pip3', 'install', '-r', 'requirements.txt'], cwd=dir, env=env_vars)
+    except CalledProcessError:
+        raise
@@ -3,30 +3,35 @@
 
 # local imports
 import util
-import exception
 from db import Pipeline, Store
+from supervisor import Supervisor, run_process
+from provision import provision_env
 import config
 
 # python imports
 import logging
-import subprocess
-from subprocess import STDOUT, CalledProcessError
-import sys
+import asyncio
 import os
-from venv import EnvBuilder
 from pathlib import Path
-import datetime
-from time import sleep
-from typing import Set
+import sqlite3
+from time import sleep, time
+from functools import partial
+import threading
+from typing import Set, Tuple
 
 # 3rd party imports
 from jinja2 import Template, FileSystemLoader, Environment, meta
 
+# compiled pipeline templates and their variables, (dir, py_file): (py_file mtime, template, variables)
+#   module level so they outlive any one Runner
+_template_cache = {}
+_template_cache_lock = threading.Lock()
+
 
 class Runner:
 
     def __init__(self, pipeline_id: int, pipeline_name: str, py_file_name: str, pipeline_dir_name: str,
-                 schedule_id: int, gt_cfg: config.Gluetube) -> None:
+                 schedule_id: int, gt_cfg: config.Gluetube, supervisor: Supervisor = None) -> None:
 
         self.base_dir = gt_cfg.pipeline_dir
         self.p_id = pipeline_id
@@ -41,72 +46,152 @@ class Runner:
         self.socket_file = Path(gt_cfg.socket_file)
         self.http_proxy = gt_cfg.http_proxy
         self.https_proxy = gt_cfg.https_proxy
+        self.run_timeout = int(gt_cfg.run_timeout)
+        self.artifact_dir = gt_cfg.artifact_dir
+        self.venv_cache_dir = gt_cfg.venv_cache_dir
+        self.rate_limits = gt_cfg.rate_limits
+        self.supervisor = supervisor
 
     def run(self) -> None:
 
-        dir_abs_path = Path(Path(self.base_dir).resolve() / self.p_dir).resolve().as_posix()
+        # the previous run of this schedule is still being supervised, don't stack another one on top of it
+        if self.supervisor and self.supervisor.running(self.s_id):
+            logging.warning(f"Pipeline: {self.p_name}, previous run still in progress. Skipping.")
+            return
 
-        if not _venv_exists(f"{dir_abs_path}/.venv"):
-            _create_venv(dir_abs_path)
-            _symlink_gluetube_to_venv(f"{dir_abs_path}/.venv")
+        dir_abs_path = Path(Path(self.base_dir).resolve() / self.p_dir).resolve().as_posix()
 
-        # attempt to install pipeline requirements every time it is run
-        # this is required because the pipeline could have changed along with its requirements.txt
-        if _requirements_exists(f"{dir_abs_path}/requirements.txt"):
-            _install_pipeline_requirements(dir_abs_path, self.http_proxy, self.https_proxy)
+        # normally the provisioner built the environment in the background already, then this is only a few stats
+        provision_env(dir_abs_path, self.http_proxy, self.https_proxy, self.venv_cache_dir)
+
+        # a schedule in a rate-limit pool waits its turn for a token, as a run with the rate_limited status. no thread
+        #   waits with it, the daemon fires the schedule again once the token is there and that fire starts the run.
+        #   fires before then are skipped, like those of a run still in progress
+        db = Pipeline(db_path=Path(self.db_dir, self.db_app_name), pooled=True)
+        waiting = db.rate_limited_run(self.p_id, self.s_id)
+        pipeline_run_id = None
+        if waiting:
+            pipeline_run_id, waiting_since = waiting[0], waiting[1] / 1000000
+            if time() < waiting_since + (waiting[2] or 0.0):
+                logging.warning(f"Pipeline: {self.p_name}, previous run still waiting for a rate limit token. Skipping.")
+                return
+        else:
+            wait = self._take_rate_limit_token(db)
+            if wait > 0:
+                self._new_run(db, 'rate_limited', wait)
+                logging.info(f"Pipeline: {self.p_name}, rate limited. Starting in {round(wait)} seconds.")
+                return
 
         # ### THE 'START' of the pipeline ###
 
         # substitute variables in pipeline with database elements and write new tmp pipeline py file
-        env = _load_template_env(Path(dir_abs_path))
-        template = _jinja_template(env, self.py_file)
-        variables = _all_variables_in_template(env, Path(dir_abs_path), self.py_file)
-        db_kv = Store(self.db_kv_password.encode(), db_path=Path(self.db_dir, self.db_kv_name))
+        template, variables = _cached_template(dir_abs_path, self.p_dir, self.py_file)
+        db_kv = Store(self.db_kv_password.encode(), db_path=Path(self.db_dir, self.db_kv_name), pooled=True)
         pairs = _variable_value_pairs_for_template(variables, db_kv)
         pipeline_as_a_string = template.render(pairs)
 
-        # get current time and create a new db entry for current run
-        start_time = datetime.datetime.now(datetime.timezone.utc).isoformat()
         logging.info(f"Pipeline: {self.p_name}, started.")
+        if pipeline_run_id is None:
+            pipeline_run_id = self._new_run(db, 'running')
+        else:
+            util.send_rpc_msg_to_daemon(
+                util.craft_rpc_msg('set_pipeline_run_started', [
+                    pipeline_run_id, util.epoch_us(), time() - waiting_since
+                ]),
+                self.socket_file
+            )
+
+        # modified environment variables of pipeline for gluetube system
+        gluetube_env_vars = os.environ.copy()
+        gluetube_env_vars['PIPELINE_RUN_ID'] = str(pipeline_run_id)
+        gluetube_env_vars['SOCKET_FILE'] = self.socket_file.resolve().as_posix()
+        gluetube_env_vars['ARTIFACT_DIR'] = Path(self.artifact_dir).resolve().as_posix()
+
+        # a schedule's own timeout wins over the global one, 0 means no timeout
+        timeout = db.pipeline_schedule_timeout(self.s_id) or self.run_timeout
+
+        # Finally, actually fork the pipeline process
+        # the supervisor owns the process from here on, so the scheduler thread is released right away
+        if self.supervisor:
+            self.supervisor.submit(self.s_id, [".venv/bin/python3", "-"], dir_abs_path, gluetube_env_vars,
+                                   pipeline_as_a_string, partial(self._finished, pipeline_run_id), timeout)
+            return
+
+        loop = asyncio.new_event_loop()
+        try:
+            returncode, output, timed_out = loop.run_until_complete(
+                run_process([".venv/bin/python3", "-"], dir_abs_path, gluetube_env_vars, pipeline_as_a_string, timeout)
+            )
+        finally:
+            loop.close()
+        self._finished(pipeline_run_id, returncode, output, timed_out)
+
+    # a new run of the schedule, also its latest run
+    def _new_run(self, db: Pipeline, status: str, rate_limit_wait: float = None) -> int:
+
+        # get current time and create a new db entry for current run
+        start_time = util.epoch_us()
         util.send_rpc_msg_to_daemon(
-            util.craft_rpc_msg('set_pipeline_run', [self.p_id, self.s_id, 'running', start_time]), self.socket_file)
+            util.craft_rpc_msg('set_pipeline_run', [self.p_id, self.s_id, status, start_time, rate_limit_wait]),
+            self.socket_file
+        )
 
         sleep(1)  # avoid race condition on db lookup, a hack i know TODO: fix
 
         # get pipeline_run_id, also set the current_run of pipeline to the pipeline_run_id
-        db = Pipeline(db_path=Path(self.db_dir, self.db_app_name))
         pipeline_run_id = db.pipeline_run_id_by_pipeline_id_and_start_time(self.p_id, start_time)
         util.send_rpc_msg_to_daemon(util.craft_rpc_msg('set_schedule_latest_run', [self.s_id, pipeline_run_id]),
                                     self.socket_file)
+        return pipeline_run_id
 
-        # modified environment variables of pipeline for gluetube system
-        gluetube_env_vars = os.environ.copy()
-        gluetube_env_vars['PIPELINE_RUN_ID'] = str(pipeline_run_id)
-        gluetube_env_vars['SOCKET_FILE'] = self.socket_file.resolve().as_posix()
+    # seconds until the schedule's token is there, 0 without a rate limit. a rate limit that can't be looked at
+    #   doesn't keep the run from starting
+    def _take_rate_limit_token(self, db: Pipeline) -> float:
 
-        # Finally, actually fork the pipeline process
+        rate_limit = db.pipeline_schedule_rate_limit(self.s_id)
+        if not rate_limit:
+            return 0.0
+        try:
+            pool, (runs, seconds) = util.rate_limit_pool(rate_limit, self.s_id, self.rate_limits)
+        except ValueError:
+            logging.error(f"Pipeline: {self.p_name}, rate limit {rate_limit} is not a pool or a rate. Not waiting.")
+            return 0.0
+
+        db_rw = Pipeline(db_path=Path(self.db_dir, self.db_app_name), read_only=False, pooled=True)
         try:
-            subprocess.check_output(
-                [".venv/bin/python3", "-"],
-                text=True, cwd=dir_abs_path,
-                env=gluetube_env_vars,
-                input=pipeline_as_a_string,
-                stderr=STDOUT
+            return db_rw.take_rate_limit_token(pool, runs, seconds, time())
+        except sqlite3.Error as e:
+            logging.error(f"Pipeline: {self.p_name}, failed to take a rate limit token. Not waiting. {e}")
+            return 0.0
+
+    def _finished(self, pipeline_run_id: int, returncode: int, output: str, timed_out: bool = False) -> None:
+
+        if timed_out:
+            util.send_rpc_msg_to_daemon(
+                util.craft_rpc_msg(
+                    'set_pipeline_run_finished',
+                    [pipeline_run_id, 'timed_out', output, util.epoch_us()]
+                ),
+                self.socket_file
             )
-        except CalledProcessError as e:
+            logging.error(f"Pipeline: {self.p_name}, timed out.")
+            return
+
+        if returncode != 0:
             util.send_rpc_msg_to_daemon(
                 util.craft_rpc_msg(
                     'set_pipeline_run_finished',
-                    [pipeline_run_id, 'crashed', e.output, datetime.datetime.now(datetime.timezone.utc).isoformat()]
+                    [pipeline_run_id, 'crashed', output, util.epoch_us()]
                 ),
                 self.socket_file
             )
-            raise exception.RunnerError(f'Pipeline {self.p_name} crashed.') from None  # don't leak things
+            logging.error(f"Pipeline: {self.p_name}, crashed.")
+            return
 
         util.send_rpc_msg_to_daemon(
             util.craft_rpc_msg(
                 'set_pipeline_run_finished',
-                [pipeline_run_id, 'finished', '', datetime.datetime.now(datetime.timezone.utc).isoformat()]
+                [pipeline_run_id, 'finished', '', util.epoch_us()]
             ),
             self.socket_file
         )
@@ -116,41 +201,43 @@ class Runner:
 # helper functions
 
 
-def _venv_exists(path: str) -> bool:
-    path = Path(path)
-    return path.is_dir()
+# the runner of a schedule is only created when it fires. the pipeline is looked up with the pooled connection of the
+#   scheduler or worker thread this runs on
+def run_schedule(schedule_id: int, gt_cfg: config.Gluetube, supervisor: Supervisor = None) -> None:
+
+    db = Pipeline(db_path=Path(gt_cfg.sqlite_dir, gt_cfg.sqlite_app_name), pooled=True)
+    pipeline = db.pipeline_from_schedule_id(schedule_id)
+    if not pipeline:
+        logging.error(f"Schedule {schedule_id} fired, but its pipeline no longer exists.")
+        return
 
+    Runner(pipeline[0], pipeline[1], pipeline[2], pipeline[3], schedule_id, gt_cfg, supervisor).run()
 
-def _requirements_exists(path: str) -> bool:
-    path = Path(path)
-    return path.is_file()
 
+# auto-discovery found the pipeline's py file modified, forget what's cached for it
+def invalidate_cache(pipeline_dir_name: str, py_file_name: str) -> None:
 
-def _create_venv(dir: str) -> None:
-    venv_abs_path = f"{dir}/.venv"
-    venv = EnvBuilder(with_pip=True, symlinks=True)
-    venv.ensure_directories(venv_abs_path)
-    venv.create(venv_abs_path)
+    with _template_cache_lock:
+        _template_cache.pop((pipeline_dir_name, py_file_name), None)
 
 
-def _symlink_gluetube_to_venv(venv_dir: str) -> None:
-    # 3.10
-    py_version = f"{sys.version_info[0]}.{sys.version_info[1]}"
-    dir_path = os.path.dirname(os.path.realpath(__file__))
-    src = f"{dir_path}"
-    dst = f"{venv_dir}/lib/python{py_version}/site-packages/gluetube"
-    os.symlink(src, dst)
+def _cached_template(dir_abs_path: str, pipeline_dir_name: str, py_file_name: str) -> Tuple[Template, Set[str]]:
 
+    # one stat per run, so an edit is never missed even before auto-discovery reports it
+    py_mtime = Path(dir_abs_path, py_file_name).stat().st_mtime
+    key = (pipeline_dir_name, py_file_name)
 
-def _install_pipeline_requirements(dir: str, http_proxy: str = '', https_proxy: str = '') -> None:
-    env_vars = os.environ.copy()
-    env_vars['HTTP_PROXY'] = http_proxy
-    env_vars['HTTPS_PROXY'] = https_proxy
+    with _template_cache_lock:
+        cached = _template_cache.get(key)
+    if cached and cached[0] == py_mtime:
+        return cached[1], cached[2]
 
-    try:
-        subprocess.check_output(['.venv/bin/pip3', 'install', '-r', 'requirements.txt'], cwd=dir, env=env_vars)
-    except CalledProcessError:
-        raise
+    env = _load_template_env(Path(dir_abs_path))
+    template = _jinja_template(env, py_file_name)
+    variables = _all_variables_in_template(env, Path(dir_abs_path), py_file_name)
+    with _template_cache_lock:
+        _template_cache[key] = (py_mtime, template, variables)
+    return template, variables
 
 
 def _load_template_env(directory: Path) -> Environment:
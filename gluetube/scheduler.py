@@ -0,0 +1,321 @@
+# Craig Tomkow
+# 2023-01-23
+
+# python imports
+import hashlib
+import heapq
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Callable, Hashable, List, Tuple, Union
+
+# 3rd party imports
+from apscheduler.triggers.base import BaseTrigger
+from apscheduler.triggers.cron import CronTrigger
+
+# a fire that is this many seconds late is skipped, the next one is scheduled as usual
+MISFIRE_GRACE_TIME = 30
+
+# the values an H token spreads over, per crontab field. days stop at 28 so every month has them
+_HASH_RANGES = ((0, 59), (0, 23), (1, 28), (1, 12), (0, 6))
+_HASH_TOKEN = re.compile(r'^H(?:\((\d+)-(\d+)\))?(?:/(\d+))?$')
+
+
+# one per scheduled job. no runner, no closure, only what's needed to find the next fire time
+class _Record:
+
+    __slots__ = ('key', 'trigger', 'func', 'next_fire', 'seq')
+
+    def __init__(self, key: Hashable, trigger: Union[BaseTrigger, None], func: Union[Callable[[], None], None],
+                 next_fire: float, seq: int) -> None:
+
+        self.key = key
+        self.trigger = trigger
+        self.func = func
+        self.next_fire = next_fire
+        self.seq = seq
+
+
+# fires jobs from a heap ordered by next fire time, one thread waits for the earliest and a pool runs them.
+#   a job is a schedule id, run by the fire callback, or any key with its own func (e.g. the pipeline scanner).
+#   paused and unscheduled schedules are simply never added
+class Scheduler:
+
+    def __init__(self, max_workers: int, fire: Callable[[Hashable], None]) -> None:
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scheduler')
+        self._fire = fire
+        self._records = {}
+        self._heap = []
+        self._seq = 0
+        self._active = set()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self._first_fires = (0, {})
+
+    @property
+    def running(self) -> bool:
+
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+
+        if self.running:
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run_loop, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def shutdown(self, wait: bool = True) -> None:
+
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self._executor.shutdown(wait=wait)
+
+    def __contains__(self, key: Hashable) -> bool:
+
+        return key in self._records
+
+    def __len__(self) -> int:
+
+        return len(self._records)
+
+    # adds, or replaces, a job. a trigger that never fires (a run date in the past) leaves no job behind
+    def add(self, key: Hashable, trigger: BaseTrigger, func: Callable[[], None] = None,
+            next_fire_time: datetime = None) -> bool:
+
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        if next_fire_time is None:
+            next_fire_time = self._first_fire(trigger, now)
+
+        with self._cond:
+            self._records.pop(key, None)
+            if next_fire_time is None or next_fire_time.timestamp() < now.timestamp() - MISFIRE_GRACE_TIME:
+                return False
+            self._push(_Record(key, trigger, func, next_fire_time.timestamp(), 0))
+        return True
+
+    def remove(self, key: Hashable) -> bool:
+
+        with self._cond:
+            return self._records.pop(key, None) is not None
+
+    # fire now, once. a job keeps its trigger and carries on from now, a key without a job is run and forgotten
+    def run_now(self, key: Hashable) -> None:
+
+        with self._cond:
+            record = self._records.get(key)
+            if record:
+                record.next_fire = time.time()
+                self._push(record)
+            else:
+                self._push(_Record(key, None, None, time.time(), 0))
+
+    def next_fire_time(self, key: Hashable) -> Union[datetime, None]:
+
+        with self._cond:
+            record = self._records.get(key)
+        if not record:
+            return None
+        return datetime.fromtimestamp(record.next_fire, timezone.utc)
+
+    def jobs(self) -> List[Tuple[Hashable, datetime]]:
+
+        with self._cond:
+            records = list(self._records.values())
+        return [(x.key, datetime.fromtimestamp(x.next_fire, timezone.utc)) for x in records]
+
+    # jobs sharing a trigger (see cron_trigger) share their first fire time, it's worked out once per second.
+    #   the trigger math is most of the daemon's startup time
+    def _first_fire(self, trigger: BaseTrigger, now: datetime) -> Union[datetime, None]:
+
+        second, first_fires = self._first_fires
+        if second != now.timestamp():
+            first_fires = {}
+            self._first_fires = (now.timestamp(), first_fires)
+        if trigger not in first_fires:
+            first_fires[trigger] = trigger.get_next_fire_time(None, now)
+        return first_fires[trigger]
+
+    # caller holds the lock
+    def _push(self, record: _Record) -> None:
+
+        # an older heap entry of this job is recognised by its seq and skipped when it comes up
+        self._seq += 1
+        record.seq = self._seq
+        self._records[record.key] = record
+        heapq.heappush(self._heap, (record.next_fire, record.seq, record.key))
+
+        # removed and replaced jobs leave entries behind, drop them before they outnumber the live ones
+        if len(self._heap) > 2 * len(self._records) + 1024:
+            self._heap = [(x.next_fire, x.seq, x.key) for x in self._records.values()]
+            heapq.heapify(self._heap)
+
+        self._cond.notify()
+
+    def _run_loop(self) -> None:
+
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                now = time.time()
+                due = self._pop_due(now)
+                if not due:
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+                    continue
+
+            for record, fire_time in due:
+                if now - fire_time > MISFIRE_GRACE_TIME:
+                    logging.warning(f"Job {record.key} missed its fire time by {int(now - fire_time)} seconds. Skipping.")
+                    continue
+                self._submit(record)
+
+    # caller holds the lock. pops every job that is due, and schedules its next fire
+    def _pop_due(self, now: float) -> List[Tuple[_Record, float]]:
+
+        due = []
+        next_fires = {}
+        while self._heap and self._heap[0][0] <= now:
+            fire_time, seq, key = heapq.heappop(self._heap)
+            record = self._records.get(key)
+            if record is None or record.seq != seq:
+                continue
+            due.append((record, fire_time))
+
+            next_fire = self._next_fire(record, fire_time, now, next_fires)
+            if next_fire is None:
+                del self._records[key]
+            else:
+                record.next_fire = next_fire
+                self._seq += 1
+                record.seq = self._seq
+                heapq.heappush(self._heap, (record.next_fire, record.seq, key))
+        return due
+
+    # fires missed while the daemon was busy are coalesced into the one that just happened.
+    #   jobs due at the same time on the same trigger share the result
+    @staticmethod
+    def _next_fire(record: _Record, fire_time: float, now: float, next_fires: dict) -> Union[float, None]:
+
+        if record.trigger is None:
+            return None
+
+        if (record.trigger, fire_time) not in next_fires:
+            next_fires[(record.trigger, fire_time)] = Scheduler._compute_next_fire(record.trigger, fire_time, now)
+        return next_fires[(record.trigger, fire_time)]
+
+    @staticmethod
+    def _compute_next_fire(trigger: BaseTrigger, fire_time: float, now: float) -> Union[float, None]:
+
+        now_dt = datetime.fromtimestamp(now, timezone.utc)
+        next_dt = trigger.get_next_fire_time(datetime.fromtimestamp(fire_time, timezone.utc), now_dt)
+        if next_dt is not None and next_dt.timestamp() <= now:
+            next_dt = trigger.get_next_fire_time(None, now_dt)
+        if next_dt is None or next_dt.timestamp() <= now:
+            return None
+        return next_dt.timestamp()
+
+    def _submit(self, record: _Record) -> None:
+
+        # like a cron job, a run still going when the next fire comes isn't run twice
+        with self._cond:
+            if record.key in self._active:
+                logging.warning(f"Job {record.key} still running from its last fire time. Skipping.")
+                return
+            self._active.add(record.key)
+
+        try:
+            self._executor.submit(self._run, record.key, record.func)
+        except RuntimeError:  # shutting down
+            with self._cond:
+                self._active.discard(record.key)
+
+    def _run(self, key: Hashable, func: Union[Callable[[], None], None]) -> None:
+
+        try:
+            if func:
+                func()
+            else:
+                self._fire(key)
+        except Exception as e:  # catch all exceptions, one failed job must not take a worker down
+            logging.error(f"Job {key} failed. {e}")
+        finally:
+            with self._cond:
+                self._active.discard(key)
+
+
+# helper functions
+
+
+# triggers don't keep state between fire times, so every schedule with the same crontab shares one.
+#   H tokens are replaced first, using the schedule id as the seed (see hashed_crontab)
+def cron_trigger(crontab: str, seed: Hashable = None) -> CronTrigger:
+    if 'H' in crontab:
+        crontab = hashed_crontab(crontab, seed)
+    return _cron_trigger(crontab)
+
+
+@lru_cache(maxsize=None)
+def _cron_trigger(crontab: str) -> CronTrigger:
+    return CronTrigger.from_crontab(crontab)
+
+
+# jenkins style H tokens: H, H/step, H(low-high) and H(low-high)/step. H is a value picked by hashing the seed,
+#   so '0 * * * *' on every schedule fires them all at once, while 'H * * * *' spreads them over the hour. a
+#   schedule keeps its minute across restarts, because the seed is its id
+def hashed_crontab(crontab: str, seed: Hashable) -> str:
+    fields = crontab.split()
+    if len(fields) != 5:
+        raise ValueError(f"Wrong number of fields; got {len(fields)}, expected 5")
+    return ' '.join(','.join(_hashed_token(x, seed, i) for x in field.split(',')) for i, field in enumerate(fields))
+
+
+def _hashed_token(token: str, seed: Hashable, field: int) -> str:
+    match = _HASH_TOKEN.match(token)
+    if not match:
+        return token
+
+    low, high = _HASH_RANGES[field]
+    if match.group(1):
+        low, high = int(match.group(1)), int(match.group(2))
+        if not _HASH_RANGES[field][0] <= low <= high <= _HASH_RANGES[field][1]:
+            raise ValueError(f"Invalid H range, {token}")
+    digest = int(hashlib.sha256(f"{seed}:{field}".encode()).hexdigest(), 16)
+
+    if match.group(3):
+        step = int(match.group(3))
+        if step < 1:
+            raise ValueError(f"Invalid H step, {token}")
+        return f"{low + digest % min(step, high - low + 1)}-{high}/{step}"
+    return str(low + digest % (high - low + 1))
+
+
+# the fire times of a trigger from start, up to but not including end
+def fire_times(trigger: BaseTrigger, start: datetime, end: datetime) -> List[datetime]:
+    fires = []
+    fire_time = trigger.get_next_fire_time(None, start)
+    while fire_time is not None and fire_time < end:
+        fires.append(fire_time)
+        fire_time = trigger.get_next_fire_time(fire_time, fire_time + timedelta(seconds=1))
+    return fires
+
+
+# the fire times of a trigger after since (a run starts a moment after its fire time), up to and including now.
+#   stops after limit + 1, so the caller can tell the list was cut short
+def missed_fire_times(trigger: BaseTrigger, since: datetime, now: datetime, limit: int) -> List[datetime]:
+    fires = []
+    fire_time = trigger.get_next_fire_time(None, since + timedelta(seconds=1))
+    while fire_time is not None and fire_time <= now and len(fires) <= limit:
+        fires.append(fire_time)
+        fire_time = trigger.get_next_fire_time(fire_time, fire_time + timedelta(seconds=1))
+    return fires
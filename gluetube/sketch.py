@@ -0,0 +1,69 @@
+# Craig Tomkow
+# 2023-01-31
+
+# python imports
+import json
+import math
+from typing import Dict, Union
+
+# quantiles come back within this relative error of the true value, e.g. a p95 of 100s is somewhere in 99s..101s
+RELATIVE_ACCURACY = 0.01
+
+# buckets kept per sketch. 2048 of them cover durations from a millisecond to years at 1%. past that the smallest
+#   buckets are merged, only the low quantiles lose accuracy
+MAX_BUCKETS = 2048
+
+
+# a DDSketch of run durations in seconds. each duration is counted in a bucket of logarithmically growing width, so
+#   the sketch stays a few KB however many runs go in, and is added to one run at a time. durations of 0 (or less,
+#   a clock that went back) have a bucket of their own
+class DurationSketch:
+
+    def __init__(self, zeros: int = 0, buckets: Dict[int, int] = None) -> None:
+
+        self._gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+        self._log_gamma = math.log(self._gamma)
+        self.zeros = zeros
+        self.buckets = buckets or {}
+
+    @property
+    def count(self) -> int:
+
+        return self.zeros + sum(self.buckets.values())
+
+    def add(self, seconds: float) -> None:
+
+        if seconds <= 0:
+            self.zeros += 1
+            return
+        index = math.ceil(math.log(seconds) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        if len(self.buckets) > MAX_BUCKETS:
+            lowest = sorted(self.buckets)[:len(self.buckets) - MAX_BUCKETS + 1]
+            self.buckets[lowest[-1]] += sum(self.buckets.pop(x) for x in lowest[:-1])
+
+    # the duration at quantile q (0..1), None for an empty sketch
+    def quantile(self, q: float) -> Union[float, None]:
+
+        count = self.count
+        if not count:
+            return None
+        rank = q * (count - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return 2 * self._gamma ** index / (self._gamma + 1)
+        return 2 * self._gamma ** max(self.buckets) / (self._gamma + 1)
+
+    def dumps(self) -> str:
+
+        return json.dumps([self.zeros, sorted(self.buckets.items())], separators=(',', ':'))
+
+    @classmethod
+    def loads(cls, text: str) -> 'DurationSketch':
+
+        zeros, buckets = json.loads(text)
+        return cls(zeros, {index: count for index, count in buckets})
@@ -0,0 +1,163 @@
+# Craig Tomkow
+# 2023-01-09
+
+# python imports
+import asyncio
+from asyncio.subprocess import PIPE, STDOUT
+import threading
+import logging
+import os
+import signal
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+# seconds a timed out process group gets between SIGTERM and SIGKILL
+KILL_GRACE_PERIOD = 10
+
+
+# launches and monitors pipeline processes from one asyncio event loop, instead of one blocked thread per run
+class Supervisor:
+
+    def __init__(self, kill_grace_period: float = KILL_GRACE_PERIOD) -> None:
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = None
+        self._running = set()
+        self._lock = threading.Lock()
+        self.kill_grace_period = kill_grace_period
+
+    def start(self) -> None:
+
+        if self._thread and self._thread.is_alive():
+            return
+
+        # pre-3.8 child watchers only reap processes for a loop attached from the main thread
+        if sys.version_info < (3, 8):
+            asyncio.get_child_watcher().attach_loop(self._loop)
+
+        self._thread = threading.Thread(target=self._run_loop, name='supervisor', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+
+        if not self._thread:
+            return
+
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+
+    def running(self, key: int) -> bool:
+
+        with self._lock:
+            return key in self._running
+
+    # on_exit is called from the event loop thread with (returncode, output, timed_out)
+    def submit(self, key: int, args: List[str], cwd: str, env: Dict[str, str], stdin: str,
+               on_exit: Callable[[int, str, bool], None], timeout: float = 0) -> None:
+
+        with self._lock:
+            self._running.add(key)
+
+        asyncio.run_coroutine_threadsafe(self._supervise(key, args, cwd, env, stdin, on_exit, timeout), self._loop)
+
+    def _run_loop(self) -> None:
+
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _supervise(self, key: int, args: List[str], cwd: str, env: Dict[str, str], stdin: str,
+                         on_exit: Callable[[int, str, bool], None], timeout: float) -> None:
+
+        try:
+            returncode, output, timed_out = await run_process(args, cwd, env, stdin, timeout, self.kill_grace_period)
+        except Exception as e:  # catch all exceptions, a run must always report back
+            returncode, output, timed_out = -1, str(e), False
+        finally:
+            with self._lock:
+                self._running.discard(key)
+
+        try:
+            on_exit(returncode, output, timed_out)
+        except Exception as e:  # a failed callback must not take down the event loop
+            logging.error(f"Supervisor exit callback failed. {e}")
+
+
+# helper functions
+
+
+# run a process in its own process group, returns (returncode, output, timed_out)
+#   a timeout of 0 waits forever. on timeout the whole group gets SIGTERM, then SIGKILL after the grace period
+async def run_process(args: List[str], cwd: str, env: Dict[str, str], stdin: str, timeout: float = 0,
+                      grace: float = KILL_GRACE_PERIOD) -> Tuple[int, str, bool]:
+
+    proc = await asyncio.create_subprocess_exec(*args, cwd=cwd, env=env, stdin=PIPE, stdout=PIPE, stderr=STDOUT,
+                                                start_new_session=True)
+
+    # read and write concurrently so partial output is kept if the process has to be killed
+    output = bytearray()
+    io_tasks = [asyncio.ensure_future(_read_all(proc.stdout, output)),
+                asyncio.ensure_future(_write_all(proc.stdin, stdin.encode()))]
+
+    timed_out = False
+    try:
+        await asyncio.wait_for(proc.wait(), timeout if timeout > 0 else None)
+    except asyncio.TimeoutError:
+        timed_out = True
+        await _kill_process_group(proc, grace)
+
+    # an orphaned grandchild outside the group can hold the pipe open, don't wait on it forever
+    _, pending = await asyncio.wait(io_tasks, timeout=grace)
+    for task in pending:
+        task.cancel()
+
+    return proc.returncode, output.decode(errors='replace'), timed_out
+
+
+async def _read_all(stream: asyncio.StreamReader, output: bytearray) -> None:
+
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+        output.extend(chunk)
+
+
+async def _write_all(stream: asyncio.StreamWriter, data: bytes) -> None:
+
+    try:
+        stream.write(data)
+        await stream.drain()
+        stream.close()
+    except (BrokenPipeError, ConnectionResetError):  # process exited without reading all of stdin
+        pass
+
+
+# SIGTERM to the group, SIGKILL to whatever of it is left after the grace period. the leader exiting doesn't mean
+#   the group did, a child ignoring SIGTERM outlives it
+async def _kill_process_group(proc: asyncio.subprocess.Process, grace: float) -> None:
+
+    pgid = proc.pid
+    try:
+        os.killpg(pgid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+
+    deadline = time.monotonic() + grace
+    try:
+        await asyncio.wait_for(proc.wait(), grace)
+    except asyncio.TimeoutError:
+        pass
+    while time.monotonic() < deadline:
+        try:
+            os.killpg(pgid, 0)
+        except ProcessLookupError:  # the whole group is gone
+            break
+        await asyncio.sleep(0.05)
+
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    await proc.wait()
@@ -7,6 +7,7 @@ import exception
 
 # python imports
 from pathlib import Path
+from datetime import datetime, timedelta, timezone
 import json
 import struct
 import socket
@@ -19,6 +20,8 @@ from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
 
 def append_name_to_dir_list(name: str, dirs: list) -> List[str]:
 
@@ -75,6 +78,70 @@ def send_rpc_msg_to_daemon(msg: bytes, socket_file: Path) -> None:
         raise exception.rpcError(f"RPC call failed. {e}") from e
 
 
+# a span of time like 90s, 30m, 24h or 7d (plain numbers are seconds) in seconds
+def duration(text: str) -> int:
+
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    text = text.strip().lower()
+    if text[-1:] in units:
+        return int(text[:-1]) * units[text[-1]]
+    return int(text)
+
+
+# a whole number of at least 1, e.g. slots. an argparse type
+def positive_int(text: str) -> int:
+
+    value = int(text)
+    if value < 1:
+        raise ValueError(f"{text} is less than 1")
+    return value
+
+
+# a whole number of at least 0, e.g. a limit where 0 means none. an argparse type
+def non_negative_int(text: str) -> int:
+
+    value = int(text)
+    if value < 0:
+        raise ValueError(f"{text} is negative")
+    return value
+
+
+# runs allowed to start per span of time, RUNS/SPAN like 10/60 or 10/1m (see duration). returns (runs, seconds)
+def rate(text: str) -> Tuple[int, int]:
+
+    runs, _, span = text.partition('/')
+    runs, seconds = int(runs), duration(span)
+    if runs < 1 or seconds < 1:
+        raise ValueError(f"Invalid rate, {text}")
+    return runs, seconds
+
+
+# the token bucket a schedule's rate limit takes from. the name of a pool in the [rate_limits] config section is
+#   shared by every schedule naming it, a RUNS/SPAN is a pool of the schedule's own. returns (bucket, (runs, seconds))
+def rate_limit_pool(rate_limit: str, schedule_id: int, pools: dict) -> Tuple[str, Tuple[int, int]]:
+
+    if rate_limit.lower() in pools:
+        return rate_limit.lower(), rate(pools[rate_limit.lower()])
+    return f"schedule {schedule_id}", rate(rate_limit)
+
+
+# run times are stored as integer microseconds since the epoch, UTC. now, if no time is given
+def epoch_us(dt: datetime = None) -> int:
+
+    return ((dt or datetime.now(timezone.utc)) - _EPOCH) // timedelta(microseconds=1)
+
+
+def from_epoch_us(us: int) -> datetime:
+
+    return _EPOCH + timedelta(microseconds=us)
+
+
+# a run time for people to read, ISO 8601. empty for a run that hasn't got one (yet)
+def iso_time(us: int) -> str:
+
+    return '' if us is None else from_epoch_us(us).isoformat()
+
+
 def encrypt(data: str, sys_password: base64.urlsafe_b64encode) -> Tuple[str, str]:
 
     salt = os.urandom(16)
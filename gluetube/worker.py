@@ -0,0 +1,132 @@
+# Craig Tomkow
+# 2023-01-27
+
+# local imports
+import config
+from db import Pipeline, set_busy_timeout
+from runner import run_schedule
+from supervisor import Supervisor
+
+# python imports
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# seconds between looks at the run queue, while there's nothing to claim or no free slot
+POLL_INTERVAL = 1
+
+# a run claimed this many times never got to finish, most likely it takes its worker down with it. it's dropped
+MAX_ATTEMPTS = 3
+
+
+# claims fires from the run queue and runs them. any number of workers, on this host or on another one sharing the
+#   database, take from the same queue, while the daemon stays the only scheduler (execution = queue)
+class Worker:
+
+    def __init__(self, gt_cfg: config.Gluetube, slots: int) -> None:
+
+        self.gt_cfg = gt_cfg
+        self.slots = slots
+        self.lease = int(gt_cfg.worker_lease)
+        set_busy_timeout(int(gt_cfg.sqlite_busy_timeout))
+        self.name = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._db_path = Path(gt_cfg.sqlite_dir, gt_cfg.sqlite_app_name)
+        self._supervisor = Supervisor()
+        self._executor = ThreadPoolExecutor(max_workers=slots, thread_name_prefix='worker')
+        self._claims = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._done = threading.Event()
+
+    # blocks until stop() is called, then waits for the runs it claimed to end
+    def run(self) -> None:
+
+        self._supervisor.start()
+        heartbeat = threading.Thread(target=self._heartbeat, name='heartbeat', daemon=True)
+        heartbeat.start()
+        logging.info(f"Worker {self.name} started, {self.slots} slots.")
+
+        db = Pipeline(db_path=self._db_path, read_only=False)
+        try:
+            while not self._stopped.is_set():
+                try:
+                    claimed = self._claim(db)
+                except sqlite3.Error as e:
+                    logging.error(f"Worker {self.name} failed to claim a run. {e}")
+                    claimed = False
+                if not claimed:
+                    self._stopped.wait(POLL_INTERVAL)
+        finally:
+            db.close()
+            self._executor.shutdown(wait=True)
+            self._done.set()
+            heartbeat.join()
+            self._supervisor.stop()
+            logging.info(f"Worker {self.name} stopped.")
+
+    def stop(self) -> None:
+
+        self._stopped.set()
+
+    def _claim(self, db: Pipeline) -> bool:
+
+        with self._lock:
+            if len(self._claims) >= self.slots:
+                return False
+
+        now = time.time()
+        claim = db.claim_run(self.name, now, now + self.lease)
+        if not claim:
+            return False
+        queue_id, schedule_id, attempts = claim
+
+        if attempts > MAX_ATTEMPTS:
+            logging.error(f"Schedule {schedule_id} was claimed {attempts - 1} times without finishing. Dropping it.")
+            db.delete_queued_run(queue_id, self.name)
+            return True
+        if attempts > 1:
+            logging.warning(f"Schedule {schedule_id}, the lease of its worker ran out. Running it again.")
+
+        with self._lock:
+            self._claims.add(queue_id)
+        self._executor.submit(self._execute, queue_id, schedule_id)
+        return True
+
+    # the claim is held, and its lease renewed, until the pipeline process ended
+    def _execute(self, queue_id: int, schedule_id: int) -> None:
+
+        try:
+            run_schedule(schedule_id, self.gt_cfg, self._supervisor)
+            while self._supervisor.running(schedule_id):
+                time.sleep(POLL_INTERVAL)
+        except Exception as e:  # catch all exceptions, the claim must always be given back
+            logging.error(f"Schedule {schedule_id} failed to run. {e}")
+        finally:
+            with self._lock:
+                self._claims.discard(queue_id)
+            try:
+                Pipeline(db_path=self._db_path, read_only=False, pooled=True).delete_queued_run(queue_id, self.name)
+            except sqlite3.Error as e:  # the lease runs out, and another worker runs it again
+                logging.error(f"Schedule {schedule_id} failed to leave the run queue. {e}")
+
+    def _heartbeat(self) -> None:
+
+        db = Pipeline(db_path=self._db_path, read_only=False)
+        try:
+            while not self._done.wait(self.lease / 3):
+                with self._lock:
+                    claims = list(self._claims)
+                if not claims:
+                    continue
+                try:
+                    db.renew_run_leases(self.name, claims, time.time() + self.lease)
+                except sqlite3.Error as e:
+                    logging.error(f"Worker {self.name} failed to renew its leases. {e}")
+        finally:
+            db.close()
@@ -3,7 +3,8 @@
 
 # local imports
 
-from gluetube.autodiscovery import PipelineScanner
+from gluetube.autodiscovery import PipelineScanner, PipelineWatcher
+from gluetube import autodiscovery
 from gluetube.db import Pipeline
 # for some reason, from gluetube.exception import AutodiscoveryError doesn't work, but this does
 #   , and it works ONLY if the import is after the PipelineScanner import (where sys.path if modified in __init__.py)
@@ -12,6 +13,9 @@ from exception import AutodiscoveryError
 # 3rd part imports
 import pytest
 import os
+import json
+import time
+import threading
 from pathlib import Path
 
 
@@ -40,22 +44,44 @@ class TestPipelineScanner:
 
         assert set(dirs) == set(test_dirs)
 
-    def test_all_py_files(self, scanner, abspath_test_pipeline_dir) -> None:
-
-        py_files = scanner._all_py_files(Path(f"{abspath_test_pipeline_dir}/test_1"))
-        test_files = [Path(f"{abspath_test_pipeline_dir}/test_1/example_pipeline1.py"),
-                      Path(f"{abspath_test_pipeline_dir}/test_1/example_pipeline2.py")]
-
-        assert set(py_files) == set(test_files)
-
     def test_enumerate_fs_pipelines(self, scanner, abspath_test_pipeline_dir) -> None:
 
-        tuples = scanner._enumerate_fs_pipelines([Path(f"{abspath_test_pipeline_dir}/test_1")])
+        tuples = scanner._enumerate_fs_pipelines()
         test_tuples = [('example_pipeline2.py', 'test_1', Path(f"{abspath_test_pipeline_dir}/test_1/example_pipeline2.py").lstat().st_mtime),
                        ('example_pipeline1.py', 'test_1', Path(f"{abspath_test_pipeline_dir}/test_1/example_pipeline1.py").lstat().st_mtime)]
 
         assert set(tuples) == set(test_tuples)
 
+    def test_enumerate_fs_pipelines_recursive(self, tmp_path) -> None:
+
+        for dir in ['a/b/c', 'a/.venv/lib', 'a/__pycache__', 'a/tests', 'd/lib']:
+            Path(tmp_path, dir).mkdir(parents=True)
+        for file in ['top.py', 'a/a.py', 'a/b/c/c.py', 'a/b/c/c_test.py', 'a/b/notes.txt', 'a/.venv/lib/site.py',
+                     'a/__pycache__/a.py', 'a/tests/t.py', 'd/lib/l.py']:
+            Path(tmp_path, file).write_text('')
+        scanner = PipelineScanner(tmp_path, Path('sock'), db_name='memory', exclude=['tests/', '*_test.py', '/d/lib'])
+
+        assert {x[:2] for x in scanner._enumerate_fs_pipelines()} == {('a.py', 'a'), ('c.py', 'a/b/c')} \
+            and set(scanner._all_dirs(tmp_path)) == {Path(tmp_path, x) for x in ['a', 'a/b', 'a/b/c', 'd']}
+
+    def test_enumerate_fs_pipelines_include(self, tmp_path) -> None:
+
+        Path(tmp_path, 'a').mkdir()
+        for file in ['a/a.py', 'a/pipeline_a.py']:
+            Path(tmp_path, file).write_text('')
+        scanner = PipelineScanner(tmp_path, Path('sock'), db_name='memory', include=['pipeline_*.py'])
+
+        assert [x[:2] for x in scanner._enumerate_fs_pipelines()] == [('pipeline_a.py', 'a')]
+
+    def test_enumerate_fs_pipelines_symlink_loop(self, tmp_path) -> None:
+
+        Path(tmp_path, 'a').mkdir()
+        Path(tmp_path, 'a', 'a.py').write_text('')
+        Path(tmp_path, 'a', 'loop').symlink_to(tmp_path)
+
+        assert [x[:2] for x in PipelineScanner(tmp_path, Path('sock'), db_name='memory')._enumerate_fs_pipelines()] \
+            == [('a.py', 'a')]
+
     def test_enumerate_db_pipelines(self, scanner) -> None:
 
         enumerated = scanner._enumerate_db_pipelines([(1, 'myname', 'file.py', 'mydir', 1.1, 1)])
@@ -63,6 +89,14 @@ class TestPipelineScanner:
 
         assert set(enumerated) == set(test_tuples)
 
+    def test_modified_pipelines(self, scanner) -> None:
+
+        fs_pipelines = [('file.py', 'mydir', 2.2), ('same.py', 'mydir', 1.1), ('new.py', 'mydir', 1.1)]
+        db_data = [(1, 'myname', 'file.py', 'mydir', 1.1), (2, 'other', 'same.py', 'mydir', 1.1),
+                   (3, 'gone', 'gone.py', 'mydir', 1.1)]
+
+        assert scanner._modified_pipelines(fs_pipelines, db_data) == [(1, 2.2)]
+
     def test_cmp_two_elems_a_diff_b(self, scanner) -> None:
 
         list_a = ['a', 'b', 'd']
@@ -95,17 +129,180 @@ class TestPipelineScanner:
 
         assert set(result) == set(['a', 'b'])
 
-    def test_random_middle_english_adjective_and_noun(self, scanner) -> None:
+    def test_random_middle_english_adjective_and_noun(self) -> None:
 
-        result = scanner._random_middle_english_adjective_and_noun()
+        result = autodiscovery._random_middle_english_adjective_and_noun()
         parts = result.split('-', 1)
 
         assert parts[0].isalpha() and parts[0].islower() and parts[1].isalpha() and parts[1].islower()
 
-    def test_generate_unique_pipeline_name(self, scanner) -> None:
+    def test_generate_unique_pipeline_name(self) -> None:
 
+        names = set()
+        for _ in range(500):
+            names.add(autodiscovery.generate_unique_pipeline_name(names))
+
+        assert len(names) == 500
+
+    def test_scan_sends_one_rpc(self, tmp_path, monkeypatch) -> None:
+
+        for i in range(3):
+            Path(tmp_path, f'dir_{i}').mkdir()
+            Path(tmp_path, f'dir_{i}', 'pipeline.py').write_text('print(1)')
         db = Pipeline(in_memory=True)
         db.create_schema()
-        scanner._generate_unique_pipeline_name(db)
+        db.insert_pipeline('gone', 'gone.py', 'dir_0', 1.1)
+        scanner = PipelineScanner(tmp_path, Path('sock'), db_name='memory')
+        monkeypatch.setattr(scanner, '_connect_to_db', lambda name, dir_path: db)
+        msgs = []
+        monkeypatch.setattr(autodiscovery.util, 'send_rpc_msg_to_daemon', lambda msg, socket_file: msgs.append(msg))
+        scanner.scan()
+
+        payload = json.loads(msgs[0][4:])
+        assert len(msgs) == 1 and payload['func'] == 'reconcile_pipelines' \
+            and sorted(x[1] for x in payload['params'][0]) == ['dir_0', 'dir_1', 'dir_2'] \
+            and payload['params'][1] == [1] and payload['params'][2] == [] \
+            and payload['params'][3] == ['dir_0', 'dir_1', 'dir_2']
+
+    def test_scan_provision_requirements_changed(self, tmp_path, monkeypatch) -> None:
+
+        Path(tmp_path, 'dir_0').mkdir()
+        Path(tmp_path, 'dir_0', 'pipeline.py').write_text('print(1)')
+        db = Pipeline(in_memory=True)
+        db.create_schema()
+        scanner = PipelineScanner(tmp_path, Path('sock'), db_name='memory')
+        monkeypatch.setattr(scanner, '_connect_to_db', lambda name, dir_path: db)
+        msgs = []
+        monkeypatch.setattr(autodiscovery.util, 'send_rpc_msg_to_daemon', lambda msg, socket_file: msgs.append(msg))
+        scanner.scan()
+        db.insert_pipeline('known', 'pipeline.py', 'dir_0', Path(tmp_path, 'dir_0', 'pipeline.py').lstat().st_mtime)
+        scanner.scan()
+        Path(tmp_path, 'dir_0', 'requirements.txt').write_text('requests')
+        scanner.scan()
+
+        assert len(msgs) == 2 and json.loads(msgs[1][4:])['params'] == [[], [], [], ['dir_0']]
+
+    def test_scan_nothing_changed(self, scanner, monkeypatch) -> None:
+
+        msgs = []
+        monkeypatch.setattr(scanner, '_connect_to_db', lambda name, dir_path: Pipeline(in_memory=True))
+        monkeypatch.setattr(scanner, '_walk', lambda top, files=True: ([], [], {}, {}))
+        monkeypatch.setattr(Pipeline, 'all_pipelines', lambda self: [])
+        monkeypatch.setattr(autodiscovery.util, 'send_rpc_msg_to_daemon', lambda msg, socket_file: msgs.append(msg))
+        scanner.scan()
+
+        assert msgs == []
+
+    def test_walk_fingerprint(self, scanner) -> None:
+
+        fingerprint = scanner._walk(scanner.pipeline_dir)[3]
+
+        assert fingerprint['test_1'] is None and len(fingerprint['test_1/example_pipeline1.py']) == 2
+
+    def test_scan_if_changed_unchanged(self, scanner, monkeypatch) -> None:
+
+        scans = []
+        monkeypatch.setattr(scanner, '_scan', lambda walk: scans.append(1))
+        scanner.scan_if_changed()
+        scanner.scan_if_changed()
+
+        assert scans == [1]
+
+    def test_scan_if_changed_failed(self, scanner, monkeypatch) -> None:
+
+        scans = []
+
+        def failed_scan(walk: tuple) -> None:
+            scans.append(1)
+            raise ConnectionRefusedError('daemon not running')
+
+        monkeypatch.setattr(scanner, '_scan', failed_scan)
+        for _ in range(2):
+            with pytest.raises(ConnectionRefusedError):
+                scanner.scan_if_changed()
+
+        assert scans == [1, 1]
+
+    def test_scan_if_changed_full_scan(self, scanner, monkeypatch) -> None:
+
+        scans = []
+        monkeypatch.setattr(scanner, '_scan', lambda walk: scans.append(1))
+        for _ in range(autodiscovery.FULL_SCAN_POLLS + 1):
+            scanner.scan_if_changed()
+
+        assert scans == [1, 1]
+
+    def test_scan_if_changed_new_dir(self, tmp_path, monkeypatch) -> None:
+
+        scanner = PipelineScanner(tmp_path, Path('sock'), db_name='memory')
+        scans = []
+        monkeypatch.setattr(scanner, '_scan', lambda walk: scans.append(1))
+        scanner.scan_if_changed()
+        Path(tmp_path, 'new_pipeline').mkdir()
+        scanner.scan_if_changed()
+
+        assert scans == [1, 1]
+
+    # an edit in place leaves the directory's mtime as it was
+    def test_scan_if_changed_edited_in_place(self, tmp_path, monkeypatch) -> None:
+
+        Path(tmp_path, 'a').mkdir()
+        Path(tmp_path, 'a', 'a.py').write_text('')
+        Path(tmp_path, 'a', 'requirements.txt').write_text('')
+        scanner = PipelineScanner(tmp_path, Path('sock'), db_name='memory')
+        scans = []
+        monkeypatch.setattr(scanner, '_scan', lambda walk: scans.append(walk[1]))
+        scanner.scan_if_changed()
+        dir_mtime = Path(tmp_path, 'a').stat().st_mtime_ns
+        with open(Path(tmp_path, 'a', 'a.py'), 'a') as f:
+            f.write('print(1)')
+        scanner.scan_if_changed()
+        with open(Path(tmp_path, 'a', 'requirements.txt'), 'a') as f:
+            f.write('requests')
+        scanner.scan_if_changed()
+
+        assert len(scans) == 3 and Path(tmp_path, 'a').stat().st_mtime_ns == dir_mtime
+
+
+@pytest.mark.skipif(not PipelineWatcher.available(), reason='inotify not available')
+class TestPipelineWatcher:
+
+    @pytest.fixture
+    def scanner(self, tmp_path) -> PipelineScanner:
+
+        Path(tmp_path, 'test_1').mkdir()
+        return PipelineScanner(tmp_path, Path('sock'), db_name='memory')
+
+    def test_watcher_scans_on_new_file(self, scanner, tmp_path, monkeypatch) -> None:
+
+        scanned = threading.Event()
+        monkeypatch.setattr(scanner, 'scan', scanned.set)
+        watcher = PipelineWatcher(scanner, debounce=0.05)
+        watcher.start()
+        Path(tmp_path, 'test_1', 'new_pipeline.py').write_text('print(1)')
+
+        assert scanned.wait(5)
+        watcher.stop()
+
+    def test_watcher_debounces_burst(self, scanner, tmp_path, monkeypatch) -> None:
+
+        scans = []
+        monkeypatch.setattr(scanner, 'scan', lambda: scans.append(1))
+        watcher = PipelineWatcher(scanner, debounce=0.2)
+        watcher.start()
+        for i in range(200):
+            Path(tmp_path, 'test_1', f'pipeline_{i}.py').write_text('print(1)')
+        time.sleep(1)
+        watcher.stop()
+
+        assert scans == [1]
+
+    def test_watcher_watches_new_dir(self, scanner, tmp_path, monkeypatch) -> None:
+
+        watcher = PipelineWatcher(scanner, debounce=0.05)
+        watcher.start()
+        Path(tmp_path, 'test_2').mkdir()
+        time.sleep(0.5)
+        watcher.stop()
 
-        assert True
+        assert Path(tmp_path, 'test_2') in watcher._watches
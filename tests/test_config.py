@@ -42,3 +42,23 @@ class TestGluetube:
         with pytest.raises(ConfigFileParseError):
             gt_cfg = Gluetube(Path(Path(__file__).parent.resolve(), 'cfg', 'bad_key.cfg').resolve().as_posix())
             gt_cfg.parse()
+
+    def test_config_parse_optional_key_default(self, tmp_path) -> None:
+
+        # a config file from before RUN_TIMEOUT existed
+        cfg = Path(Path(__file__).parent.resolve(), 'cfg', 'gluetube.cfg').read_text().replace('run_timeout = 0\n', '')
+        Path(tmp_path, 'gluetube.cfg').write_text(cfg)
+        gt_cfg = Gluetube(Path(tmp_path, 'gluetube.cfg').as_posix())
+        gt_cfg.parse()
+
+        assert gt_cfg.run_timeout == '0'
+
+    def test_config_parse_pipeline_patterns(self, tmp_path) -> None:
+
+        cfg = Path(Path(__file__).parent.resolve(), 'cfg', 'gluetube.cfg').read_text()
+        cfg = cfg.replace('pipeline_exclude = \n', 'pipeline_exclude = tests/, *_test.py,\n    lib/\n')
+        Path(tmp_path, 'gluetube.cfg').write_text(cfg)
+        gt_cfg = Gluetube(Path(tmp_path, 'gluetube.cfg').as_posix())
+        gt_cfg.parse()
+
+        assert gt_cfg.pipeline_include == ['*.py'] and gt_cfg.pipeline_exclude == ['tests/', '*_test.py', 'lib/']
@@ -2,12 +2,17 @@
 # 2022-11-14
 
 # local imports
-from gluetube.db import Store, Pipeline
+from gluetube.db import Store, Pipeline, close_pooled, set_busy_timeout
 from gluetube import util
+from gluetube.sketch import DurationSketch
 from exception import dbError
 
 # python imports
 import base64
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
 
 # 3rd party imports
 import pytest
@@ -50,6 +55,14 @@ class TestStore:
         assert util.decrypt(results[0], base64.urlsafe_b64encode('system_password'.encode()), results[1]) == 'pass_asdf'
         db.close()
 
+    def test_insert_key_values(self, db) -> None:
+
+        db.create_table('TABLEA')
+        db.insert_key_values('TABLEA', [('user_bob', 'pass_asdf'), ('user_alice', 'pass_qwer')])
+
+        assert sorted(x[0] for x in db.all_keys('TABLEA')) == ['user_alice', 'user_bob']
+        db.close()
+
     def test_insert_key_empty_value(self, db) -> None:
 
         db.create_table('TABLEA')
@@ -127,7 +140,7 @@ class TestPipeline:
     def run(self, db) -> None:
 
         db.create_schema()
-        db.insert_pipeline_run(1, 1, 'running', '2023-01-01 00:00:00')
+        db.insert_pipeline_run(1, 1, 'running', 1672531200000000)
 
     def test_create_schema(self, db) -> None:
 
@@ -135,7 +148,38 @@ class TestPipeline:
         query = "SELECT name FROM sqlite_master WHERE type='table';"
         results = db._conn.cursor().execute(query)
 
-        assert results.fetchall() == [('pipeline',), ('pipeline_schedule',), ('pipeline_run',)]
+        assert results.fetchall() == [('pipeline',), ('pipeline_schedule',), ('pipeline_run',),
+                                      ('pipeline_schedule_dependency',), ('pipeline_artifact',), ('run_queue',),
+                                      ('rate_limit_bucket',), ('schedule_state',), ('pipeline_stats',)]
+        db.close()
+
+    def test_create_schema_add_missing_column(self, db) -> None:
+
+        # a pipeline_schedule table from before the timeout column existed
+        db._conn.cursor().execute("CREATE TABLE pipeline_schedule(id INTEGER PRIMARY KEY NOT NULL, pipeline_id INTEGER)")
+        db.create_schema()
+        columns = [x[1] for x in db._conn.cursor().execute("PRAGMA table_info(pipeline_schedule)").fetchall()]
+
+        assert 'timeout' in columns and 'catchup' in columns and 'rate_limit' in columns
+        db.close()
+
+    def test_create_schema_duplicate_pipelines(self, db, pipeline) -> None:
+
+        # a database from before the unique index, with the same py file in it twice
+        db._conn.execute("DROP INDEX py_name_dir_name_index")
+        db.insert_pipeline('test_again', 'test.py', 'test_dir', 111.1)
+        db.create_schema()
+
+        assert [x[:2] for x in db.all_pipelines()] == [(1, 'test')]
+        with pytest.raises(dbError):
+            db.insert_pipeline('test_again', 'test.py', 'test_dir', 111.1)
+        db.close()
+
+    def test_create_schema_incremental_vacuum(self, db) -> None:
+
+        db.create_schema()
+
+        assert db._conn.execute('pragma auto_vacuum').fetchone()[0] == 2
         db.close()
 
     def test_create_schema_tables_exist_with_data(self, db, pipeline) -> None:
@@ -149,6 +193,42 @@ class TestPipeline:
 
     # ##### PIPELINE TABLE TESTS ##### #
 
+    def test_transaction(self, db, pipeline) -> None:
+
+        commits = []
+        db._conn.set_trace_callback(lambda x: commits.append(x) if x == 'COMMIT' else None)
+        with db.transaction():
+            db.update_pipeline_name(1, 'renamed')
+            with db.transaction():
+                db.update_pipeline_py_timestamp(1, 222.2)
+
+        assert commits == ['COMMIT'] and db.pipeline(1)[1:5:3] == ('renamed', 222.2)
+        db.close()
+
+    def test_transaction_rolled_back(self, db, pipeline) -> None:
+
+        with pytest.raises(dbError):
+            with db.transaction():
+                db.update_pipeline_name(1, 'renamed')
+                db.insert_pipeline('renamed', 'test.py', 'test_dir', '111.1')
+
+        assert db.pipeline(1)[1] == 'test'
+        db.close()
+
+    def test_after_commit(self, db, pipeline) -> None:
+
+        called = []
+        with db.transaction():
+            db.after_commit(lambda: called.append('committed'))
+            assert called == []
+        with pytest.raises(dbError):
+            with db.transaction():
+                db.after_commit(lambda: called.append('rolled back'))
+                db.insert_pipeline('test', 'test.py', 'test_dir', '111.1')
+
+        assert called == ['committed']
+        db.close()
+
     def test_insert_pipeline(self, db, pipeline) -> None:
 
         query = "SELECT name, py_name, dir_name, py_timestamp from pipeline where id = 1"
@@ -312,6 +392,24 @@ class TestPipeline:
             db.insert_pipeline_schedule(1, '', '2022-12-20 00:00:00', 0, 0, 0, 0)
         db.close()
 
+    def test_update_pipeline_env_statuses(self, db, pipeline) -> None:
+
+        db.insert_pipeline('other', 'other.py', 'other_dir', 222.2)
+        db.update_pipeline_env_statuses(['test_dir', 'other_dir'], 'pending')
+        query = "SELECT env_status FROM pipeline"
+
+        assert db._conn.cursor().execute(query).fetchall() == [('pending',), ('pending',)]
+        db.close()
+
+    def test_update_pipeline_keep_days_and_runs(self, db, pipeline) -> None:
+
+        db.update_pipeline_keep_days(1, 30)
+        db.update_pipeline_keep_runs(1, 100)
+        query = "SELECT keep_days, keep_runs FROM pipeline WHERE id = 1"
+
+        assert db._conn.cursor().execute(query).fetchone() == (30, 100)
+        db.close()
+
     def test_update_pipeline_schedule_cron(self, db, pipeline, schedule_cron) -> None:
 
         db.update_pipeline_schedule_cron(1, '*/5 * * * *')
@@ -468,6 +566,227 @@ class TestPipeline:
 
         assert results.fetchone()[0] is None
 
+    def test_update_pipeline_schedule_timeout(self, db, pipeline, schedule_cron) -> None:
+
+        db.update_pipeline_schedule_timeout(1, 300)
+        query = "SELECT timeout from pipeline_schedule where id = 1"
+        results = db._conn.cursor().execute(query)
+
+        assert results.fetchone()[0] == 300
+
+    def test_update_pipeline_schedule_catchup(self, db, pipeline, schedule_cron) -> None:
+
+        db.update_pipeline_schedule_catchup(1, 'all')
+        query = "SELECT catchup from pipeline_schedule where id = 1"
+        results = db._conn.cursor().execute(query)
+
+        assert results.fetchone()[0] == 'all'
+
+    def test_update_pipeline_schedule_rate_limit(self, db, pipeline, schedule_cron) -> None:
+
+        db.update_pipeline_schedule_rate_limit(1, 'crm_api')
+
+        assert db.pipeline_schedule_rate_limit(1) == 'crm_api'
+
+    def test_update_pipeline_env_status(self, db, pipeline) -> None:
+
+        db.insert_pipeline('other', 'other.py', 'other_dir', 222.2)
+        db.update_pipeline_env_status('test_dir', 'ready')
+        results = db._conn.cursor().execute("SELECT env_status FROM pipeline ORDER BY id")
+
+        assert results.fetchall() == [('ready',), (None,)]
+        db.close()
+
+    def test_reconcile_pipelines(self, db, pipeline, schedule_cron) -> None:
+
+        ids = db.reconcile_pipelines([('new', 'new.py', 'new_dir', 1.1)], [1], [])
+
+        assert len(ids) == 1 and [x[1:] for x in db.all_pipelines()] == [('new', 'new.py', 'new_dir', 1.1)] \
+            and db.pipeline_schedule(*ids[0])[5] == ''
+        db.close()
+
+    def test_reconcile_pipelines_modified(self, db, pipeline) -> None:
+
+        db.reconcile_pipelines([], [], [(1, 222.2)])
+
+        assert db.pipeline(1)[4] == 222.2
+        db.close()
+
+    def test_reconcile_pipelines_duplicate_name_rollback(self, db, pipeline) -> None:
+
+        with pytest.raises(dbError):
+            db.reconcile_pipelines([('new', 'new.py', 'new_dir', 1.1), ('new', 'b.py', 'new_dir', 1.1)], [], [(1, 222.2)])
+
+        assert db.all_pipelines() == [(1, 'test', 'test.py', 'test_dir', 111.1)]
+        db.close()
+
+    # ##### PIPELINE SCHEDULE DEPENDENCY TABLE TESTS ##### #
+
+    @pytest.fixture
+    def dependency(self, db, pipeline, schedule_cron) -> None:
+
+        db.insert_pipeline_schedule(1)
+        db.insert_pipeline_schedule_dependency(2, 1, 'finished')
+
+    def test_insert_pipeline_schedule_dependency(self, db, dependency) -> None:
+
+        query = "SELECT schedule_id, upstream_schedule_id, on_status, satisfied_run FROM pipeline_schedule_dependency"
+        results = db._conn.cursor().execute(query)
+
+        assert results.fetchall() == [(2, 1, 'finished', None)]
+        db.close()
+
+    def test_insert_pipeline_schedule_dependency_replace_status(self, db, dependency) -> None:
+
+        db.insert_pipeline_schedule_dependency(2, 1, 'crashed')
+
+        assert db.pipeline_schedule_dependencies(2) == [(2, 1, 'crashed', None)]
+        db.close()
+
+    def test_insert_pipeline_schedule_dependency_on_itself(self, db, pipeline, schedule_cron) -> None:
+
+        with pytest.raises(dbError):
+            db.insert_pipeline_schedule_dependency(1, 1, 'finished')
+        db.close()
+
+    def test_insert_pipeline_schedule_dependency_no_schedule(self, db, pipeline, schedule_cron) -> None:
+
+        with pytest.raises(dbError):
+            db.insert_pipeline_schedule_dependency(1, 5, 'finished')
+        db.close()
+
+    def test_delete_pipeline_schedule_dependency(self, db, dependency) -> None:
+
+        db.delete_pipeline_schedule_dependency(2, 1)
+
+        assert db.pipeline_schedule_dependencies(2) == []
+        db.close()
+
+    def test_delete_pipeline_schedule_dependency_cascade(self, db, dependency) -> None:
+
+        db.delete_pipeline_schedule(1)
+
+        assert db.all_pipeline_schedule_dependencies() == []
+        db.close()
+
+    def test_update_pipeline_schedule_dependency_satisfied_run(self, db, dependency) -> None:
+
+        db.update_pipeline_schedule_dependency_satisfied_run(1, 7)
+
+        assert db.pipeline_schedule_dependencies(2) == [(1, 1, 'finished', 7)]
+        db.close()
+
+    def test_reset_pipeline_schedule_dependencies(self, db, dependency) -> None:
+
+        db.update_pipeline_schedule_dependency_satisfied_run(1, 7)
+        db.reset_pipeline_schedule_dependencies(2)
+
+        assert db.pipeline_schedule_dependencies(2) == [(1, 1, 'finished', None)]
+        db.close()
+
+    def test_pipeline_schedule_dependents(self, db, dependency) -> None:
+
+        assert db.pipeline_schedule_dependents(1) == [(1, 2, 'finished')] and db.pipeline_schedule_dependents(2) == []
+        db.close()
+
+    def test_all_pipeline_schedule_dependencies(self, db, dependency) -> None:
+
+        assert db.all_pipeline_schedule_dependencies() == [(2, 1)]
+        db.close()
+
+    # ##### PIPELINE ARTIFACT TABLE TESTS ##### #
+
+    def test_insert_pipeline_artifact(self, db, pipeline, schedule_cron, run) -> None:
+
+        db.insert_pipeline_artifact(1, 'inventory.json', 1024)
+
+        assert db.pipeline_artifacts(1) == [('inventory.json', 1024)]
+        db.close()
+
+    def test_insert_pipeline_artifact_no_run(self, db, pipeline, schedule_cron) -> None:
+
+        with pytest.raises(dbError):
+            db.insert_pipeline_artifact(1, 'inventory.json', 1024)
+        db.close()
+
+    def test_delete_pipeline_artifact_cascade(self, db, pipeline, schedule_cron, run) -> None:
+
+        db.insert_pipeline_artifact(1, 'inventory.json', 1024)
+        db.delete_pipeline(1)
+
+        assert db.pipeline_artifacts(1) == []
+        db.close()
+
+    # ##### RUN QUEUE TABLE TESTS ##### #
+
+    def test_enqueue_run(self, db, pipeline, schedule_cron) -> None:
+
+        assert db.enqueue_run(1, 100.0) and not db.enqueue_run(1, 101.0) and db.run_queued(1)
+        db.close()
+
+    def test_claim_run(self, db, pipeline, schedule_cron) -> None:
+
+        db.enqueue_run(1, 100.0)
+
+        assert db.claim_run('a', 200.0, 260.0) == (1, 1, 1) and db.claim_run('b', 200.0, 260.0) is None
+        db.close()
+
+    def test_claim_run_lease_expired(self, db, pipeline, schedule_cron) -> None:
+
+        db.enqueue_run(1, 100.0)
+        db.claim_run('a', 200.0, 260.0)
+
+        assert db.claim_run('b', 261.0, 321.0) == (1, 1, 2)
+        db.close()
+
+    def test_renew_run_leases(self, db, pipeline, schedule_cron) -> None:
+
+        db.enqueue_run(1, 100.0)
+        db.claim_run('a', 200.0, 260.0)
+        db.renew_run_leases('a', [1], 300.0)
+        db.renew_run_leases('b', [1], 900.0)  # not its claim
+
+        assert db.claim_run('b', 261.0, 321.0) is None and db.claim_run('b', 301.0, 361.0) == (1, 1, 2)
+        db.close()
+
+    def test_delete_queued_run(self, db, pipeline, schedule_cron) -> None:
+
+        db.enqueue_run(1, 100.0)
+        db.claim_run('a', 200.0, 260.0)
+        db.delete_queued_run(1, 'b')
+        still_queued = db.run_queued(1)
+        db.delete_queued_run(1, 'a')
+
+        assert still_queued and not db.run_queued(1)
+        db.close()
+
+    # ##### RATE LIMIT BUCKET TABLE TESTS ##### #
+
+    def test_take_rate_limit_token(self, db) -> None:
+
+        db.create_schema()
+        waits = [db.take_rate_limit_token('api', 2, 60, 100.0) for _ in range(4)]
+
+        assert waits == [0.0, 0.0, 30.0, 60.0]
+        db.close()
+
+    def test_take_rate_limit_token_refill(self, db) -> None:
+
+        db.create_schema()
+        db.take_rate_limit_token('api', 2, 60, 100.0)
+        db.take_rate_limit_token('api', 2, 60, 100.0)
+
+        assert db.take_rate_limit_token('api', 2, 60, 130.0) == 0.0 and db.take_rate_limit_token('api', 2, 60, 130.0) == 30.0
+        db.close()
+
+    def test_take_rate_limit_token_pools_apart(self, db) -> None:
+
+        db.create_schema()
+        db.take_rate_limit_token('api', 1, 60, 100.0)
+
+        assert db.take_rate_limit_token('other', 1, 60, 100.0) == 0.0
+        db.close()
+
     # ##### PIPELINE RUN TABLE TESTS ##### #
 
     def test_insert_pipeline_run_return_id(self, db, pipeline) -> None:
@@ -482,7 +801,7 @@ class TestPipeline:
         db.create_schema()
 
         with pytest.raises(dbError):
-            db.insert_pipeline_run(1, 'running', '2023-01-01 00:00:00')
+            db.insert_pipeline_run(1, 'running', 1672531200000000)
         db.close()
 
     def test_insert_pipeline_run_empty_data(self, db, pipeline) -> None:
@@ -493,12 +812,12 @@ class TestPipeline:
 
     def test_insert_pipeline_run(self, db, pipeline, schedule_cron) -> None:
 
-        db.insert_pipeline_run(1, 1, 'running', '2023-01-01 00:00:00')
+        db.insert_pipeline_run(1, 1, 'running', 1672531200000000)
 
         query = "SELECT pipeline_id, schedule_id, status, start_time FROM pipeline_run WHERE id = 1"
         results = db._conn.cursor().execute(query)
 
-        assert results.fetchone() == (1, 1, 'running', '2023-01-01 00:00:00')
+        assert results.fetchone() == (1, 1, 'running', 1672531200000000)
         db.close()
 
     def test_update_pipeline_run_status(self, db, pipeline, schedule_cron, run) -> None:
@@ -511,6 +830,25 @@ class TestPipeline:
         assert results.fetchone() == ('crashed',)
         db.close()
 
+    def test_update_pipeline_run_started(self, db, pipeline, schedule_cron) -> None:
+
+        db.insert_pipeline_run(1, 1, 'rate_limited', 1672531200000000)
+        db.update_pipeline_run_started(1, 1672531230000000, 30.0)
+
+        query = "SELECT status, start_time, rate_limit_wait FROM pipeline_run WHERE id = 1"
+        results = db._conn.cursor().execute(query)
+
+        assert results.fetchone() == ('running', 1672531230000000, 30.0)
+        db.close()
+
+    def test_rate_limited_run(self, db, pipeline, schedule_cron) -> None:
+
+        db.insert_pipeline_run(1, 1, 'finished', 1672531200000000)
+        db.insert_pipeline_run(1, 1, 'rate_limited', 1672531260000000, 30.0)
+
+        assert db.rate_limited_run(1, 1) == (2, 1672531260000000, 30.0) and db.rate_limited_run(1, 2) is None
+        db.close()
+
     def test_update_pipeline_run_status_wrong_id(self, db, pipeline, schedule_cron, run) -> None:
 
         db.update_pipeline_run_status(2, 'crashed')
@@ -583,17 +921,17 @@ class TestPipeline:
 
     def test_update_pipeline_run_end_time(self, db, pipeline, schedule_cron, run) -> None:
 
-        db.update_pipeline_run_end_time(1, '2025-01-01 00:00:00')
+        db.update_pipeline_run_end_time(1, 1735689600000000)
 
         query = "SELECT end_time FROM pipeline_run WHERE id = 1"
         results = db._conn.cursor().execute(query)
 
-        assert results.fetchone() == ('2025-01-01 00:00:00',)
+        assert results.fetchone() == (1735689600000000,)
         db.close()
 
     def test_update_pipeline_run_end_time_wrong_id(self, db, pipeline, schedule_cron, run) -> None:
 
-        db.update_pipeline_run_end_time(2, '2025-01-01 00:00:00')
+        db.update_pipeline_run_end_time(2, 1735689600000000)
 
         query = "SELECT end_time FROM pipeline_run WHERE id = 1"
         results = db._conn.cursor().execute(query)
@@ -615,12 +953,198 @@ class TestPipeline:
 
     def test_update_pipeline_run_status_exit_msg_end_time(self, db, pipeline, schedule_cron, run) -> None:
 
-        db.update_pipeline_run_status_exit_msg_end_time(1, 'crashed', 'stacktrace', '2025-03-03 00:00:00')
+        db.update_pipeline_run_status_exit_msg_end_time(1, 'crashed', 'stacktrace', 1740960000000000)
 
         query = "SELECT status, exit_msg, end_time FROM pipeline_run WHERE id = 1"
         results = db._conn.cursor().execute(query)
 
-        assert results.fetchone() == ('crashed', 'stacktrace', '2025-03-03 00:00:00')
+        assert results.fetchone() == ('crashed', 'stacktrace', 1740960000000000)
+        db.close()
+
+    @pytest.fixture
+    def history(self, db, pipeline, schedule_cron) -> None:
+
+        # ended runs, one a month from 2023-01 to 2023-06. 2023-06 is the schedule's latest run
+        for month in range(1, 7):
+            start_time = util.epoch_us(datetime(2023, month, 1, tzinfo=timezone.utc))
+            run_id = db.insert_pipeline_run(1, 1, 'finished', start_time)
+            db.update_pipeline_run_end_time(run_id, start_time + 60000000)
+        db.update_pipeline_schedule_latest_run(1, 6)
+
+    def test_expired_pipeline_runs_keep_runs(self, db, history) -> None:
+
+        assert [x[0] for x in db.expired_pipeline_runs(0, 2, 1685664000000000, 100)] == [1, 2, 3, 4]
+        db.close()
+
+    def test_expired_pipeline_runs_keep_days(self, db, history) -> None:
+
+        assert db.expired_pipeline_runs(70, 0, 1685664000000000, 100) == [
+            (1, 1672531200000000), (2, 1675209600000000), (3, 1677628800000000)]
+        db.close()
+
+    def test_expired_pipeline_runs_pipeline_overrides(self, db, history) -> None:
+
+        db.update_pipeline_keep_runs(1, 5)
+
+        assert [x[0] for x in db.expired_pipeline_runs(0, 2, 1685664000000000, 100)] == [1]
+        db.close()
+
+    def test_expired_pipeline_runs_keep_everything(self, db, history) -> None:
+
+        assert db.expired_pipeline_runs(0, 0, 1685664000000000, 100) == []
+        db.close()
+
+    def test_expired_pipeline_runs_latest_and_running_stay(self, db, history) -> None:
+
+        db.insert_pipeline_run(1, 1, 'running', 1673740800000000)
+
+        assert [x[0] for x in db.expired_pipeline_runs(1, 0, 1704067200000000, 100)] == [1, 2, 3, 4, 5]
+        db.close()
+
+    def test_delete_pipeline_runs(self, db, history) -> None:
+
+        db.delete_pipeline_runs([1, 2])
+
+        assert db.pipeline_run(1) is None and db.pipeline_run(2) is None and db.pipeline_run(3)
+        db.close()
+
+    def test_move_pipeline_runs(self, db, history, tmp_path) -> None:
+
+        db.insert_pipeline_artifact(1, 'report.csv', 10)
+        db.move_pipeline_runs([1, 2], Path(tmp_path, 'runs-2023-01.db'))
+        db.move_pipeline_runs([1], Path(tmp_path, 'runs-2023-01.db'))  # moved again after a crash, nothing doubles
+
+        archive = sqlite3.connect(Path(tmp_path, 'runs-2023-01.db'))
+        assert archive.execute("SELECT id, pipeline_name, status FROM pipeline_run").fetchall() == [
+            (1, 'test', 'finished'), (2, 'test', 'finished')]
+        assert archive.execute("SELECT run_id, name, size FROM pipeline_artifact").fetchall() == [(1, 'report.csv', 10)]
+        assert db.pipeline_run(1) is None and db.pipeline_artifacts(1) == []
+        assert db._conn.execute("PRAGMA database_list").fetchall()[1:] == []
+        archive.close()
+        db.close()
+
+    def test_move_pipeline_runs_older_partition(self, db, history, tmp_path) -> None:
+
+        archive = sqlite3.connect(Path(tmp_path, 'runs-2023-01.db'))
+        archive.executescript("""
+            CREATE TABLE pipeline_run(id INTEGER PRIMARY KEY NOT NULL, pipeline_id INTEGER NOT NULL, pipeline_name TEXT,
+                schedule_id INTEGER NOT NULL, status TEXT NOT NULL, stage INTEGER, stage_msg TEXT, exit_msg TEXT,
+                start_time TEXT NOT NULL, end_time TEXT, rate_limit_wait REAL);
+            INSERT INTO pipeline_run (id, pipeline_id, pipeline_name, schedule_id, status, start_time, end_time)
+                VALUES (100, 1, 'test', 1, 'finished', '2023-01-01T00:00:00+00:00', '2023-01-01T00:01:00+00:00');
+        """)
+        archive.close()
+        db.move_pipeline_runs([1], Path(tmp_path, 'runs-2023-01.db'))
+
+        archive = sqlite3.connect(Path(tmp_path, 'runs-2023-01.db'))
+        assert archive.execute("SELECT id, start_time, end_time FROM pipeline_run").fetchall() == [
+            (1, 1672531200000000, 1672531260000000), (100, 1672531200000000, 1672531260000000)]
+        archive.close()
+        db.close()
+
+    def test_incremental_vacuum(self, tmp_path) -> None:
+
+        db = Pipeline(db_path=Path(tmp_path, 'gluetube.db'), read_only=False)
+        db.create_schema()
+        db.insert_pipeline('test', 'test.py', 'test_dir', 111.1)
+        db.insert_pipeline_schedule(1)
+        with db.transaction():
+            for i in range(2000):
+                run_id = db.insert_pipeline_run(1, 1, 'finished', 1672531200000000 + i)
+                db.update_pipeline_run_exit_msg(run_id, 'x' * 200)
+        db.delete_pipeline_runs(list(range(1, 2001)))
+        db._conn.execute('pragma wal_checkpoint(TRUNCATE)')
+
+        assert db._conn.execute('pragma freelist_count').fetchone()[0] > 10
+        assert db.incremental_vacuum(10) > 0
+        assert db.incremental_vacuum(100000) == 0
+        db.close()
+
+    # ##### SCHEDULE STATE TABLE TESTS ##### #
+
+    def test_schedule_state_new_schedule(self, db, pipeline, schedule_cron) -> None:
+
+        assert db.schedule_state(1) == (None, None, None, None, None, 0, None)
+        db.close()
+
+    def test_schedule_state_follows_latest_run(self, db, pipeline, schedule_cron) -> None:
+
+        db.insert_pipeline_run(1, 1, 'running', 1672531200000000)
+        db.insert_pipeline_run(1, 1, 'running', 1672617600000000)
+        db.update_pipeline_run_stage_and_stage_msg(2, 1, 'fetching')
+        db.update_pipeline_run_status_exit_msg_end_time(1, 'crashed', 'stacktrace', 1672704000000000)
+
+        assert db.schedule_state(1) == (2, 'running', 'fetching', 1672617600000000, None, 0, None)
+        db.close()
+
+    def test_schedule_state_consecutive_failures(self, db, pipeline, schedule_cron) -> None:
+
+        for status in ('crashed', 'timed_out', 'finished', 'crashed'):
+            run_id = db.insert_pipeline_run(1, 1, 'running', 1672531200000000)
+            db.update_pipeline_run_status_exit_msg_end_time(run_id, status, '', 1672531260000000)
+            if run_id == 2:
+                assert db.schedule_state(1)[5] == 2
+        db.update_pipeline_run_status(4, 'crashed')  # a change after it ended doesn't count it again
+
+        assert db.schedule_state(1)[1:] == ('crashed', None, 1672531200000000, 1672531260000000,
+                                            1, None)
+        db.close()
+
+    def test_schedule_state_next_fire_times(self, db, pipeline, schedule_cron) -> None:
+
+        db.update_schedule_state_next_fire_times([('2023-01-01T00:01:00+00:00', 1)])
+
+        assert db.schedule_state(1)[6] == '2023-01-01T00:01:00+00:00'
+        db.close()
+
+    def test_schedule_state_backfilled(self, db, pipeline, schedule_cron) -> None:
+
+        db.insert_pipeline_run(1, 1, 'finished', 1672531200000000)
+        db.insert_pipeline_run(1, 1, 'crashed', 1672617600000000)
+        db._conn.execute("DROP TABLE schedule_state")
+        db.create_schema()
+
+        assert db.schedule_state(1)[:2] == (2, 'crashed')
+        db.close()
+
+    def test_schedule_state_cascade(self, db, pipeline, schedule_cron) -> None:
+
+        db.delete_pipeline_schedule(1)
+
+        assert db.schedule_state(1) is None
+        db.close()
+
+    # ##### PIPELINE STATS TABLE TESTS ##### #
+
+    def test_add_pipeline_stats(self, db, pipeline, schedule_cron) -> None:
+
+        for i, status in enumerate(('finished', 'crashed', 'finished')):
+            run_id = db.insert_pipeline_run(1, 1, 'running', 1672531200000000)
+            db.update_pipeline_run_status_exit_msg_end_time(run_id, status, '', 1672531200000000 + (i + 1) * 10000000)
+            db.add_pipeline_stats(run_id)
+        db.insert_pipeline_run(1, 1, 'running', 1672531200000000)
+        db.add_pipeline_stats(4)  # hasn't ended, nothing to add
+
+        name, runs, succeeded, total_duration, sketch = db.pipeline_stats(1)[0]
+        assert (name, runs, succeeded, total_duration) == ('test', 3, 2, 60000000)
+        assert DurationSketch.loads(sketch).quantile(0.5) == pytest.approx(20, rel=0.01)
+        db.close()
+
+    def test_pipeline_stats_backfilled(self, db, history) -> None:
+
+        db._conn.execute("DROP TABLE pipeline_stats")
+        db.create_schema()
+
+        assert db.pipeline_stats()[0][:4] == ('test', 6, 6, 360000000)
+        assert db.pipeline_stats(2) == []
+        db.close()
+
+    def test_pipeline_stats_cascade(self, db, history) -> None:
+
+        db.add_pipeline_stats(1)
+        db.delete_pipeline(1)
+
+        assert db._conn.execute("SELECT * FROM pipeline_stats").fetchall() == []
         db.close()
 
     # ##### CLI COMMAND TESTS ##### #
@@ -629,7 +1153,53 @@ class TestPipeline:
 
         results = db.summary_pipelines()
 
-        assert results == [('test', 'test.py', 1, '* * * * *', '', 0, None, None, None)]
+        assert results == [('test', 'test.py', None, 1, '* * * * *', '', 0, 'running', None, None, 0, None)]
+        db.close()
+
+    def test_pipeline_runs(self, db, history) -> None:
+
+        db.update_pipeline_run_status(5, 'crashed')
+
+        assert [x[0] for x in db.pipeline_runs()] == [6, 5, 4, 3, 2, 1]
+        assert db.pipeline_runs(status='crashed') == [
+            (5, 'test', 1, 'crashed', 1682899200000000, 1682899260000000)]
+        assert [x[0] for x in db.pipeline_runs(pipeline_id=1, since=1680307200000000)] == [6, 5, 4]
+        assert db.pipeline_runs(pipeline_id=2) == []
+        db.close()
+
+    def test_export_pipeline_runs(self, db, history) -> None:
+
+        chunks = list(db.export_pipeline_runs(since=1675209600000000, chunk_size=2))
+
+        assert [[x[0] for x in chunk] for chunk in chunks] == [[2, 3], [4, 5], [6]]
+        assert chunks[0][0] == (2, 'test', 1, '* * * * *', 'finished', None, None, None, 1675209600000000,
+                                1675209660000000, 60000000, None)
+        db.close()
+
+    def test_pipeline_runs_keyset_pages(self, db, history) -> None:
+
+        # a run started at the same time as the last one on a page still makes the next page
+        db.insert_pipeline_run(1, 1, 'finished', 1680307200000000)
+        pages, after = [], None
+        while True:
+            page = db.pipeline_runs(after=after, limit=2)
+            if not page:
+                break
+            pages.append([x[0] for x in page])
+            after = (page[-1][4], page[-1][0])
+
+        assert pages == [[6, 5], [7, 4], [3, 2], [1]]
+        db.close()
+
+    def test_pipeline_runs_uses_index(self, db, history) -> None:
+
+        query = """
+            EXPLAIN QUERY PLAN SELECT id FROM pipeline_run WHERE pipeline_id = 1 AND start_time <= 1672531200000000
+            ORDER BY start_time DESC, id DESC
+        """
+        plan = ' '.join(x[3] for x in db._conn.execute(query).fetchall())
+
+        assert 'pipeline_id_start_time_index' in plan and 'TEMP B-TREE' not in plan
         db.close()
 
     # ##### DB READS TESTS ##### #
@@ -656,6 +1226,51 @@ class TestPipeline:
         assert results == [(1, 'test', 'test.py', 'test_dir', 1, '* * * * *', '', 0)]
         db.close()
 
+    def test_recent_run_durations(self, db, pipeline, schedule_cron) -> None:
+
+        db.insert_pipeline_run(1, 1, 'finished', 1672531200000000)
+        db.insert_pipeline_run(1, 1, 'running', 1672534800000000)
+        db.insert_pipeline_run(1, 1, 'crashed', 1672538400000000)
+        db.insert_pipeline_run(1, 1, 'finished', 1672542000000000)
+        db.update_pipeline_run_end_time(1, 1672531260000000)
+        db.update_pipeline_run_end_time(3, 1672538700000000)
+        db.update_pipeline_run_end_time(4, 1672542000500000)
+
+        assert db.recent_run_durations(2) == [(1, 0.5), (1, 300.0)]
+        assert db.pipeline_run(3)[6:] == (1672538400000000, 1672538700000000)
+        assert db._conn.execute("SELECT duration FROM pipeline_run WHERE id = 1").fetchone() == (60000000,)
+        db.close()
+
+    def test_run_times_are_integers(self, db, pipeline, schedule_cron) -> None:
+
+        with pytest.raises(dbError):
+            db.insert_pipeline_run(1, 1, 'running', '2023-01-01T00:00:00+00:00')
+        db.close()
+
+    def test_migrate_run_times(self, db, pipeline, schedule_cron) -> None:
+
+        # pipeline_run as it was, ISO 8601 text times. unparseable ones start at the epoch and never end
+        db._conn.executescript("""
+            PRAGMA foreign_keys = OFF;
+            DROP TABLE pipeline_run;
+            CREATE TABLE pipeline_run(id INTEGER PRIMARY KEY NOT NULL, pipeline_id INTEGER NOT NULL,
+                schedule_id INTEGER NOT NULL, status TEXT NOT NULL, stage INTEGER, stage_msg TEXT, exit_msg TEXT,
+                start_time TEXT NOT NULL, end_time TEXT, rate_limit_wait REAL);
+            INSERT INTO pipeline_run (pipeline_id, schedule_id, status, start_time, end_time) VALUES
+                (1, 1, 'finished', '2023-01-01T00:00:00+00:00', '2023-01-01T00:01:00.5+00:00'),
+                (1, 1, 'finished', '2023-01-01 02:00:00', '2023-01-01T03:00:00+01:00'),
+                (1, 1, 'crashed', 'garbage', '');
+            PRAGMA foreign_keys = ON;
+        """)
+        db.insert_pipeline_artifact(1, 'report.csv', 10)
+        db.create_schema()
+
+        assert db._conn.execute("SELECT start_time, end_time, duration FROM pipeline_run").fetchall() == [
+            (1672531200000000, 1672531260500000, 60500000), (1672538400000000, 1672538400000000, 0), (0, None, None)]
+        assert db.pipeline_artifacts(1) == [('report.csv', 10)]
+        assert db._conn.execute("PRAGMA foreign_key_check").fetchall() == []
+        db.close()
+
     def test_all_pipelines_scheduling_no_pipline(self, db) -> None:
 
         db.create_schema()
@@ -795,6 +1410,55 @@ class TestPipeline:
         assert results is None
         db.close()
 
+    def test_pipeline_schedule_timeout(self, db, pipeline, schedule_cron) -> None:
+
+        results = db.pipeline_schedule_timeout(1)
+
+        assert results == 0
+        db.close()
+
+    def test_pipeline_schedule_timeout_no_schedule(self, db, pipeline) -> None:
+
+        results = db.pipeline_schedule_timeout(1)
+
+        assert results is None
+        db.close()
+
+    def test_catchup_schedules(self, db, pipeline, schedule_cron) -> None:
+
+        db.insert_pipeline_schedule(1, '* * * * *', paused=1)
+        db.insert_pipeline_schedule(1, '* * * * *')
+        for schedule_id in (1, 2, 3):
+            db.update_pipeline_schedule_catchup(schedule_id, 'latest')
+        db.insert_pipeline_run(1, 1, 'finished', 1672531200000000)
+        db.insert_pipeline_run(1, 1, 'finished', 1672617600000000)
+        db.insert_pipeline_run(1, 2, 'finished', 1672617600000000)
+        results = db.catchup_schedules()
+
+        assert results == [(1, '* * * * *', 'latest', 1672617600000000)]
+        db.close()
+
+    def test_rate_limited_schedules(self, db, pipeline, schedule_cron) -> None:
+
+        db.insert_pipeline_schedule(1, '* * * * *')
+        db.update_pipeline_schedule_rate_limit(1, 'crm_api')
+        db.insert_pipeline_run(1, 1, 'finished', 1672531200000000)
+        db.insert_pipeline_run(1, 1, 'finished', 1672531260000000)
+        db.update_pipeline_run_started(2, 1672531290000000, 30.0)
+        db.insert_pipeline_run(1, 1, 'rate_limited', 1672531320000000)
+        results = db.rate_limited_schedules()
+
+        assert results == [(1, 'crm_api', 3, 1, 1, 30.0, 30.0)]
+        db.close()
+
+    def test_pipeline_schedule_paused(self, db, pipeline, schedule_cron) -> None:
+
+        db.update_pipeline_schedule_paused(1, 1)
+        results = db.pipeline_schedule_paused(1)
+
+        assert results == 1
+        db.close()
+
     def test_pipeline_schedules_id(self, db, pipeline, schedule_cron) -> None:
 
         results = db.pipeline_schedules_id(1)
@@ -811,14 +1475,110 @@ class TestPipeline:
 
     def test_pipeline_run_id_by_pipeline_id_and_start_time(self, db, pipeline, schedule_cron, run) -> None:
 
-        results = db.pipeline_run_id_by_pipeline_id_and_start_time(1, '2023-01-01 00:00:00')
+        results = db.pipeline_run_id_by_pipeline_id_and_start_time(1, 1672531200000000)
 
         assert results == 1
         db.close()
 
+    def test_pipeline_run_ids(self, db, pipeline, schedule_cron, run) -> None:
+
+        assert db.pipeline_run_ids(pipeline_id=1) == [1] and db.pipeline_run_ids(schedule_id=1) == [1] \
+            and db.pipeline_run_ids(schedule_id=2) == []
+        db.close()
+
     def test_pipeline_run_id_by_pipeline_id_and_start_time_no_run(self, db, pipeline) -> None:
 
-        results = db.pipeline_run_id_by_pipeline_id_and_start_time(1, '2023-01-01 00:00:00')
+        results = db.pipeline_run_id_by_pipeline_id_and_start_time(1, 1672531200000000)
 
         assert results is None
         db.close()
+
+
+class TestPool:
+
+    @pytest.fixture
+    def db_path(self, tmp_path) -> Path:
+
+        db = Pipeline(db_path=Path(tmp_path, 'gluetube.db'), read_only=False)
+        db.create_schema()
+        db.close()
+        yield Path(tmp_path, 'gluetube.db')
+        close_pooled()
+
+    def test_pooled_reused(self, db_path) -> None:
+
+        db = Pipeline(db_path=db_path, pooled=True)
+        db.close()
+
+        assert Pipeline(db_path=db_path, pooled=True)._conn is db._conn
+
+    def test_pooled_per_read_only(self, db_path) -> None:
+
+        assert Pipeline(db_path=db_path, pooled=True)._conn is not \
+            Pipeline(db_path=db_path, read_only=False, pooled=True)._conn
+
+    def test_pooled_per_thread(self, db_path) -> None:
+
+        conns = []
+        thread = threading.Thread(target=lambda: conns.append(Pipeline(db_path=db_path, pooled=True)._conn))
+        thread.start()
+        thread.join()
+
+        assert Pipeline(db_path=db_path, pooled=True)._conn is not conns[0]
+
+    # another database on the connection doesn't roll back, or commit, the unit of work of the first one
+    def test_pooled_in_transaction(self, db_path) -> None:
+
+        db = Pipeline(db_path=db_path, read_only=False, pooled=True)
+        with db.transaction():
+            db.insert_pipeline('test', 'test.py', 'test_dir', 111.1)
+            other = Pipeline(db_path=db_path, read_only=False, pooled=True)
+            with other.transaction():
+                other.insert_pipeline('other', 'other.py', 'other_dir', 111.1)
+            assert Pipeline(db_path=db_path).all_pipelines() == []
+
+        assert [x[1] for x in Pipeline(db_path=db_path).all_pipelines()] == ['test', 'other']
+
+    def test_pooled_closed_by_hand(self, db_path) -> None:
+
+        db = Pipeline(db_path=db_path, pooled=True)
+        db._conn.close()
+
+        assert Pipeline(db_path=db_path, pooled=True).all_pipelines() == []
+
+    def test_pooled_file_replaced(self, db_path) -> None:
+
+        Pipeline(db_path=db_path, read_only=False, pooled=True)
+        db_path.unlink()
+        db = Pipeline(db_path=db_path, read_only=False)
+        db.create_schema()
+        db.insert_pipeline('test', 'test.py', 'test_dir', 111.1)
+        db.close()
+
+        assert len(Pipeline(db_path=db_path, read_only=False, pooled=True).all_pipelines()) == 1
+
+    def test_pooled_open_transaction_rolled_back(self, db_path) -> None:
+
+        db = Pipeline(db_path=db_path, read_only=False, pooled=True)
+        db._conn.execute("INSERT INTO pipeline (name, py_name, dir_name, py_timestamp) VALUES ('a', 'a.py', 'a', 1)")
+
+        assert Pipeline(db_path=db_path, read_only=False, pooled=True).all_pipelines() == []
+
+    def test_close_pooled(self, db_path) -> None:
+
+        db = Pipeline(db_path=db_path, pooled=True)
+        close_pooled()
+
+        assert Pipeline(db_path=db_path, pooled=True)._conn is not db._conn
+
+    def test_busy_timeout(self, db_path) -> None:
+
+        set_busy_timeout(1234)
+        try:
+            db = Pipeline(db_path=db_path)
+            timeout = db._conn.execute('pragma busy_timeout').fetchone()[0]
+            db.close()
+        finally:
+            set_busy_timeout(5000)
+
+        assert timeout == 1234
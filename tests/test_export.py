@@ -0,0 +1,67 @@
+# Craig Tomkow
+# 2023-02-01
+
+# local imports
+from gluetube.export import export_runs, COLUMNS
+
+# python imports
+import csv
+from pathlib import Path
+
+# 3rd party imports
+import pytest
+
+
+class TestExport:
+
+    # (run_id, pipeline_name, schedule_id, schedule_cron, status, stage, stage_msg, exit_msg, start_time, end_time,
+    #   duration_us, rate_limit_wait), two chunks
+    chunks = [
+        [(1, 'test', 1, '* * * * *', 'finished', 2, 'done', '', 1672531200000000, 1672531260000000, 60000000, None),
+         (2, 'test', 1, '* * * * *', 'crashed', 1, 'fetching', 'oops', 1672531320000000, 1672531330000000, 10000000,
+          None)],
+        [(3, 'test', 1, None, 'running', None, None, None, 1672531400000000, None, None, 1.5)],
+    ]
+
+    def test_export_csv(self, tmp_path) -> None:
+
+        summary = export_runs(iter(self.chunks), Path(tmp_path, 'runs.csv'), 'csv')
+
+        with open(Path(tmp_path, 'runs.csv'), newline='') as f:
+            rows = list(csv.reader(f))
+        assert rows[0] == [x[0] for x in COLUMNS] and len(rows) == 4
+        assert rows[1][8:11] == ['2023-01-01T00:00:00+00:00', '2023-01-01T00:01:00+00:00', '60000000']
+        assert rows[3][9:] == ['', '', '1.5']
+        assert summary == {'runs': 3, 'statuses': {'finished': 1, 'crashed': 1, 'running': 1},
+                           'mean_duration': 35.0, 'min_duration': 10.0, 'max_duration': 60.0}
+
+    def test_export_failed_leaves_no_file(self, tmp_path) -> None:
+
+        def chunks():
+            yield self.chunks[0]
+            raise OSError('disk full')
+
+        with pytest.raises(OSError):
+            export_runs(chunks(), Path(tmp_path, 'runs.csv'), 'csv')
+        assert list(tmp_path.iterdir()) == []
+
+    def test_export_unknown_format(self, tmp_path) -> None:
+
+        with pytest.raises(ValueError):
+            export_runs(iter(self.chunks), Path(tmp_path, 'runs.xlsx'), 'xlsx')
+
+    def test_export_parquet(self, tmp_path) -> None:
+
+        parquet = pytest.importorskip('pyarrow.parquet')
+        export_runs(iter(self.chunks), Path(tmp_path, 'runs.parquet'), 'parquet')
+
+        table = parquet.read_table(Path(tmp_path, 'runs.parquet'))
+        assert table.num_rows == 3 and table.column('duration_us')[0].value == 60000000
+
+    def test_export_arrow(self, tmp_path) -> None:
+
+        ipc = pytest.importorskip('pyarrow.ipc')
+        export_runs(iter(self.chunks), Path(tmp_path, 'runs.arrow'), 'arrow')
+
+        reader = ipc.open_file(Path(tmp_path, 'runs.arrow'))
+        assert reader.num_record_batches == 2 and reader.read_all().column('pipeline_name')[2].as_py() == 'test'
@@ -7,19 +7,21 @@ from gluetube.db import Pipeline, Store
 from exception import DaemonError
 from gluetube.config import Gluetube
 from gluetube import util
-from gluetube.runner import Runner
+from gluetube.supervisor import Supervisor
+from gluetube.provision import Provisioner
+from scheduler import Scheduler, cron_trigger, hashed_crontab
 
 # python imports
 from pathlib import Path
 import os
+import sqlite3
 import socket
 from typing import Any, Dict, Union
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import time
 import base64
 
 # 3rd party imports
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.date import DateTrigger
 import pytest
 from cryptography.fernet import Fernet
 
@@ -37,11 +39,10 @@ class TestGluetubeDaemon:
         return GluetubeDaemon()._setup_listener_unix_socket(Path(abspath_test_tmp_dir, 'gluetube.sock'))
 
     @pytest.fixture
-    def scheduler(self, gt_cfg) -> BackgroundScheduler:
+    def scheduler(self, gt_cfg) -> Scheduler:
 
-        scheduler = GluetubeDaemon()._setup_scheduler(101)
-        runner = Runner(1, 'test', 'test.py', 'test_dir', 1, gt_cfg)
-        scheduler.add_job(runner.run, trigger=DateTrigger(datetime(2999, 1, 1)), id=str(1))
+        scheduler = GluetubeDaemon()._setup_scheduler(101, gt_cfg)
+        scheduler.add(1, cron_trigger('0 0 1 1 *'))
         return scheduler
 
     @ pytest.fixture
@@ -51,7 +52,7 @@ class TestGluetubeDaemon:
         db.create_schema()
         db.insert_pipeline('test', 'test.py', 'test_dir', 'null')
         db.insert_pipeline_schedule(1)
-        db.insert_pipeline_run(1, 1, 'running', '2022:01:01 00:00:00')
+        db.insert_pipeline_run(1, 1, 'running', 1640995200000000)
         return db
 
     @pytest.fixture
@@ -70,9 +71,24 @@ class TestGluetubeDaemon:
         return gt_cfg
 
     @pytest.fixture
-    def kwargs(self, scheduler, db_p, db_s, gt_cfg) -> Dict[str, Any]:
+    def supervisor(self) -> Supervisor:
+
+        return Supervisor()
+
+    @pytest.fixture
+    def provisioner(self, gt_cfg, monkeypatch) -> Provisioner:
+
+        # record what would be built, instead of building venvs
+        provisioner = Provisioner(gt_cfg)
+        provisioner.submitted = []
+        monkeypatch.setattr(provisioner, 'submit', provisioner.submitted.append)
+        return provisioner
+
+    @pytest.fixture
+    def kwargs(self, scheduler, db_p, db_s, gt_cfg, supervisor, provisioner) -> Dict[str, Any]:
 
-        return {'scheduler': scheduler, 'db_p': db_p, 'db_s': db_s, 'gt_cfg': gt_cfg}
+        return {'scheduler': scheduler, 'db_p': db_p, 'db_s': db_s, 'gt_cfg': gt_cfg, 'supervisor': supervisor,
+                'provisioner': provisioner}
 
     def test_write_pid(self, abspath_test_tmp_dir) -> None:
 
@@ -102,7 +118,7 @@ class TestGluetubeDaemon:
     def test_setup_scheduler(self) -> None:
 
         scheduler = GluetubeDaemon()._setup_scheduler(101)
-        assert isinstance(scheduler, BackgroundScheduler)
+        assert isinstance(scheduler, Scheduler)
 
     def test_setup_scheduler_zero_threads(self) -> None:
 
@@ -112,7 +128,7 @@ class TestGluetubeDaemon:
     def test_setup_scheduler_million_threads(self) -> None:
 
         scheduler = GluetubeDaemon()._setup_scheduler(1000000)
-        assert isinstance(scheduler, BackgroundScheduler)
+        assert isinstance(scheduler, Scheduler)
 
     def test_recv_all(self, sock, abspath_test_tmp_dir) -> None:
 
@@ -125,59 +141,159 @@ class TestGluetubeDaemon:
 
         assert rcv_data.decode() == 'asdf'
 
-    def test_schedule_pipelines(self, scheduler, db_p, gt_cfg) -> None:
+    def test_schedule_pipelines(self, db_p, gt_cfg) -> None:
 
-        GluetubeDaemon()._schedule_pipelines(scheduler, db_p, gt_cfg)
-        assert scheduler.get_job('1')
+        scheduler = GluetubeDaemon()._setup_scheduler(101, gt_cfg)
+        db_p.update_pipeline_schedule_cron(1, '* * * * *')
+        db_p.insert_pipeline_schedule(1)
+        db_p.insert_pipeline_schedule(1, cron='* * * * *', paused=1)
+        GluetubeDaemon()._schedule_pipelines(scheduler, db_p)
+        assert 1 in scheduler and len(scheduler) == 1
 
     def test_schedule_auto_discovery(self, scheduler, gt_cfg) -> None:
 
         gt_cfg.pipeline_dir = Path(Path(__file__).parent.resolve(), 'pipeline_dir').resolve().as_posix()
         gt_cfg.sqlite_app_name = 'memory'
-        GluetubeDaemon()._schedule_auto_discovery(scheduler, gt_cfg)
-        assert scheduler.get_job('pipeline_scanner')
+        watcher = GluetubeDaemon()._schedule_auto_discovery(scheduler, gt_cfg)
+        if watcher:
+            watcher.stop()
+        assert 'pipeline_scanner' in scheduler
+
+    def test_schedule_housekeeping(self, scheduler, gt_cfg) -> None:
+
+        GluetubeDaemon()._schedule_housekeeping(scheduler, gt_cfg)
+        assert 'housekeeping' in scheduler
 
     def test_set_pipeline(self, kwargs) -> None:
 
         GluetubeDaemon().set_pipeline('new_test', 'new_test.py', 'new_test_dir', '0', **kwargs)
-        assert kwargs['scheduler'].get_job('2') and kwargs['db_p'].pipeline_id_from_name('new_test') == 2
+        assert 2 not in kwargs['scheduler'] and kwargs['db_p'].pipeline_id_from_name('new_test') == 2
 
     def test_delete_pipeline(self, kwargs) -> None:
 
         GluetubeDaemon().delete_pipeline(1, **kwargs)
-        assert kwargs['scheduler'].get_job('1') is None and kwargs['db_p'].pipeline_id_from_name('test') is None
+        assert 1 not in kwargs['scheduler'] and kwargs['db_p'].pipeline_id_from_name('test') is None
+
+    def test_reconcile_pipelines(self, kwargs) -> None:
+
+        GluetubeDaemon().reconcile_pipelines([['new.py', 'new_dir', 1.1], ['other.py', 'new_dir', 2.2]], [],
+                                             [], **kwargs)
+        pipelines = kwargs['db_p'].all_pipelines()
+
+        assert [x[2:] for x in pipelines[1:]] == [('new.py', 'new_dir', 1.1), ('other.py', 'new_dir', 2.2)] \
+            and len({x[1] for x in pipelines}) == 3 \
+            and len(kwargs['db_p'].all_pipelines_scheduling()) == 3 and len(kwargs['scheduler']) == 1
+
+    # a second scan before the first one's diff was applied sends the same pipelines again
+    def test_reconcile_pipelines_already_added(self, kwargs) -> None:
+
+        GluetubeDaemon().reconcile_pipelines([['new.py', 'new_dir', 1.1]], [], [], **kwargs)
+        GluetubeDaemon().reconcile_pipelines([['new.py', 'new_dir', 1.1], ['test.py', 'test_dir', 1.1]], [], [],
+                                             **kwargs)
+
+        assert [x[2:4] for x in kwargs['db_p'].all_pipelines()] == [('test.py', 'test_dir'), ('new.py', 'new_dir')]
+
+    def test_reconcile_pipelines_removed(self, kwargs) -> None:
+
+        GluetubeDaemon().reconcile_pipelines([], [1], [], **kwargs)
+        assert kwargs['db_p'].all_pipelines() == [] and 1 not in kwargs['scheduler']
+
+    def test_reconcile_pipelines_modified(self, kwargs) -> None:
+
+        GluetubeDaemon().reconcile_pipelines([], [], [[1, 1234.5]], **kwargs)
+        assert kwargs['db_p'].pipeline(1)[4] == 1234.5
+
+    def test_reconcile_pipelines_provision(self, kwargs) -> None:
+
+        GluetubeDaemon().reconcile_pipelines([['new.py', 'new_dir', 1.1]], [], [], ['test_dir'], **kwargs)
+
+        assert kwargs['provisioner'].submitted == ['new_dir', 'test_dir'] \
+            and [x[2] for x in kwargs['db_p'].summary_pipelines()] == ['pending', 'pending']
+
+    def test_set_pipeline_env_status(self, kwargs) -> None:
+
+        GluetubeDaemon.set_pipeline_env_status('test_dir', 'ready', **kwargs)
+        assert kwargs['db_p'].summary_pipelines()[0][2] == 'ready'
+
+    def test_reconcile_pipelines_rollback(self, kwargs) -> None:
+
+        # the empty py_name fails the insert, so the removal of pipeline 1 is rolled back too
+        with pytest.raises(DaemonError):
+            GluetubeDaemon().reconcile_pipelines([['', 'new_dir', 1.1]], [1], [], **kwargs)
+        assert kwargs['db_p'].pipeline(1)
 
     def test_set_schedule(self, kwargs) -> None:
 
         GluetubeDaemon().set_schedule(1, **kwargs)
-        assert kwargs['scheduler'].get_job('2') and kwargs['db_p'].pipeline_schedule(1, 2)
+        assert 2 not in kwargs['scheduler'] and kwargs['db_p'].pipeline_schedule(1, 2)
 
     def test_set_schedule_cron(self, kwargs) -> None:
 
         GluetubeDaemon().set_schedule_cron(1, '* * * * *', **kwargs)
-        assert kwargs['scheduler'].get_job('1') and kwargs['db_p'].pipeline_schedule(1, 1)[5] == '* * * * *'
+        assert (kwargs['scheduler'].next_fire_time(1) - datetime.now(timezone.utc)).total_seconds() <= 60 \
+            and kwargs['db_p'].pipeline_schedule(1, 1)[5] == '* * * * *'
+
+    def test_call_rpc_one_commit(self, kwargs) -> None:
+
+        commits = []
+        kwargs['db_p']._conn.set_trace_callback(lambda x: commits.append(x) if x == 'COMMIT' else None)
+        kwargs['db_p'].update_pipeline_schedule_at(1, '2099-01-01 00:00:00')
+        commits.clear()
+        GluetubeDaemon()._call_rpc('set_schedule_cron', [1, '* * * * *'], kwargs)
+        assert commits == ['COMMIT'] and kwargs['db_p'].pipeline_schedule(1, 1)[5:7] == ('* * * * *', '')
+
+    def test_call_rpc_rolled_back(self, kwargs, monkeypatch) -> None:
+
+        def fail(*args) -> None:
+            raise sqlite3.OperationalError('disk I/O error')
+
+        kwargs['db_p'].update_pipeline_schedule_at(1, '2099-01-01 00:00:00')
+        job = kwargs['scheduler'].next_fire_time(1)
+        # the last write of the rpc, after the new job was asked for
+        monkeypatch.setattr(kwargs['db_p'], 'update_schedule_state_next_fire_times', fail)
+        with pytest.raises(DaemonError):
+            GluetubeDaemon()._call_rpc('set_schedule_cron', [1, '* * * * *'], kwargs)
+        assert kwargs['db_p'].pipeline_schedule_at(1) == '2099-01-01 00:00:00' and kwargs['scheduler'].next_fire_time(1) == job
 
     def test_set_schedule_cron_no_job(self, kwargs) -> None:
 
         kwargs['db_p'].insert_pipeline_schedule(1)
         GluetubeDaemon().set_schedule_cron(2, '* * * * *', **kwargs)
-        assert kwargs['scheduler'].get_job('2')
+        assert 2 in kwargs['scheduler']
+
+    def test_set_schedule_cron_hashed(self, kwargs) -> None:
+
+        GluetubeDaemon().set_schedule_cron(1, 'H * * * *', **kwargs)
+        assert kwargs['scheduler'].next_fire_time(1).minute == int(hashed_crontab('H * * * *', 1).split()[0]) \
+            and kwargs['db_p'].pipeline_schedule(1, 1)[5] == 'H * * * *'
+
+    def test_set_schedule_cron_bad_crontab(self, kwargs) -> None:
+
+        with pytest.raises(DaemonError):
+            GluetubeDaemon().set_schedule_cron(1, 'every minute', **kwargs)
+
+    def test_set_schedule_cron_paused(self, kwargs) -> None:
+
+        kwargs['db_p'].insert_pipeline_schedule(1, paused=1)
+        GluetubeDaemon().set_schedule_cron(2, '* * * * *', **kwargs)
+        assert 2 not in kwargs['scheduler'] and kwargs['db_p'].pipeline_schedule(1, 2)[5] == '* * * * *'
 
     def test_set_schedule_at(self, kwargs) -> None:
 
         GluetubeDaemon().set_schedule_at(1, '2099-01-01 00:00:00', **kwargs)
-        assert kwargs['scheduler'].get_job('1') and kwargs['db_p'].pipeline_schedule(1, 1)[6] == '2099-01-01 00:00:00'
+        assert kwargs['scheduler'].next_fire_time(1).year == 2099 \
+            and kwargs['db_p'].pipeline_schedule(1, 1)[6] == '2099-01-01 00:00:00'
 
     def test_set_schedule_at_no_job(self, kwargs) -> None:
 
         kwargs['db_p'].insert_pipeline_schedule(1)
         GluetubeDaemon().set_schedule_at(2, '2099-01-01 00:00:00', **kwargs)
-        assert kwargs['scheduler'].get_job('2')
+        assert 2 in kwargs['scheduler']
 
     def test_set_schedule_now(self, kwargs) -> None:
 
         GluetubeDaemon().set_schedule_now(1, **kwargs)
-        assert kwargs['scheduler'].get_job('1') \
+        assert kwargs['scheduler'].next_fire_time(1) <= datetime.now(timezone.utc) \
             and kwargs['db_p'].pipeline_schedule(1, 1)[5] == '' \
             and kwargs['db_p'].pipeline_schedule(1, 1)[6] == ''
 
@@ -185,12 +301,142 @@ class TestGluetubeDaemon:
 
         kwargs['db_p'].insert_pipeline_schedule(1)
         GluetubeDaemon().set_schedule_now(2, **kwargs)
-        assert True
+        assert 2 in kwargs['scheduler']
+
+    def test_set_schedule_timeout(self, kwargs) -> None:
+
+        GluetubeDaemon().set_schedule_timeout(1, 60, **kwargs)
+        assert kwargs['db_p'].pipeline_schedule_timeout(1) == 60
 
     def test_delete_pipeline_schedule(self, kwargs) -> None:
 
         GluetubeDaemon().delete_schedule(1, **kwargs)
-        assert kwargs['scheduler'].get_job('1') is None and kwargs['db_p'].pipeline_schedule(1, 1) is None
+        assert 1 not in kwargs['scheduler'] and kwargs['db_p'].pipeline_schedule(1, 1) is None
+
+    def test_set_schedule_catchup(self, kwargs) -> None:
+
+        GluetubeDaemon().set_schedule_catchup(1, 'latest', **kwargs)
+        assert kwargs['db_p']._conn.execute("SELECT catchup FROM pipeline_schedule WHERE id = 1").fetchone()[0] == 'latest'
+
+    def test_set_schedule_catchup_bad_policy(self, kwargs) -> None:
+
+        with pytest.raises(DaemonError):
+            GluetubeDaemon().set_schedule_catchup(1, 'some', **kwargs)
+
+    def test_set_schedule_rate_limit(self, kwargs) -> None:
+
+        kwargs['gt_cfg'].rate_limits = {'crm_api': '10/1m'}
+        GluetubeDaemon().set_schedule_rate_limit(1, 'crm_api', **kwargs)
+        assert kwargs['db_p'].pipeline_schedule_rate_limit(1) == 'crm_api'
+
+    def test_set_schedule_rate_limit_unknown_pool(self, kwargs) -> None:
+
+        with pytest.raises(DaemonError):
+            GluetubeDaemon().set_schedule_rate_limit(1, 'crm_api', **kwargs)
+
+    def test_set_pipeline_keep_days(self, kwargs) -> None:
+
+        GluetubeDaemon().set_pipeline_keep_days(1, 30, **kwargs)
+        GluetubeDaemon().set_pipeline_keep_runs(1, 100, **kwargs)
+        query = "SELECT keep_days, keep_runs FROM pipeline WHERE id = 1"
+        assert kwargs['db_p']._conn.execute(query).fetchone() == (30, 100)
+
+    def test_set_pipeline_keep_runs_negative(self, kwargs) -> None:
+
+        with pytest.raises(DaemonError):
+            GluetubeDaemon().set_pipeline_keep_runs(1, -1, **kwargs)
+
+    def test_set_pipeline_run_next_fire_time(self, kwargs) -> None:
+
+        GluetubeDaemon().set_pipeline_run(1, 1, 'running', 1640995320000000, **kwargs)
+        assert kwargs['db_p'].schedule_state(1)[6] == kwargs['scheduler'].next_fire_time(1).isoformat()
+
+    def test_set_schedule_now_next_fire_time(self, kwargs) -> None:
+
+        kwargs['db_p'].update_schedule_state_next_fire_times([('2023-01-01T00:00:00+00:00', 1)])
+        GluetubeDaemon().set_schedule_now(1, **kwargs)
+        assert kwargs['db_p'].schedule_state(1)[6] == kwargs['scheduler'].next_fire_time(1).isoformat()  # right away
+
+    def test_set_pipeline_run_started(self, kwargs) -> None:
+
+        GluetubeDaemon().set_pipeline_run_started(1, 1640995260000000, 60.0, **kwargs)
+        assert kwargs['db_p'].pipeline_run(1)[2] == 'running'
+
+    def test_run_schedule_queue(self, kwargs, tmp_path) -> None:
+
+        kwargs['gt_cfg'].execution = 'queue'
+        kwargs['gt_cfg'].sqlite_dir = tmp_path.as_posix()
+        db = Pipeline(db_path=Path(tmp_path, kwargs['gt_cfg'].sqlite_app_name), read_only=False)
+        db.create_schema()
+        db.insert_pipeline('test', 'test.py', 'test_dir', 111.1)
+        db.insert_pipeline_schedule(1)
+        GluetubeDaemon._run_schedule(1, kwargs['gt_cfg'])
+        GluetubeDaemon._run_schedule(1, kwargs['gt_cfg'])  # still queued
+
+        assert db._conn.execute("SELECT schedule_id FROM run_queue").fetchall() == [(1,)] \
+            and GluetubeDaemon._still_running(1, kwargs['gt_cfg'])
+
+    def test_catch_up_latest(self, kwargs) -> None:
+
+        kwargs['db_p'].update_pipeline_schedule_cron(1, '0 * * * *')
+        kwargs['db_p'].update_pipeline_schedule_catchup(1, 'latest')
+        kwargs['db_p'].insert_pipeline_run(1, 1, 'finished', util.epoch_us(datetime.now(timezone.utc) - timedelta(hours=3)))
+        GluetubeDaemon._catch_up(kwargs['scheduler'], kwargs['db_p'], kwargs['gt_cfg'])
+        assert kwargs['scheduler'].next_fire_time(1) <= datetime.now(timezone.utc)
+
+    def test_catch_up_all(self, kwargs, monkeypatch) -> None:
+
+        replayed = []
+        monkeypatch.setattr(GluetubeDaemon, '_run_schedule', lambda *args: replayed.append(args[0]))
+        kwargs['db_p'].update_pipeline_schedule_cron(1, '0 * * * *')
+        kwargs['db_p'].update_pipeline_schedule_catchup(1, 'all')
+        kwargs['db_p'].insert_pipeline_run(1, 1, 'finished', util.epoch_us(datetime.now(timezone.utc) - timedelta(hours=3)))
+        GluetubeDaemon._catch_up(kwargs['scheduler'], kwargs['db_p'], kwargs['gt_cfg'])
+        deadline = time.time() + 5
+        while len(replayed) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        assert replayed == [1, 1, 1] and kwargs['scheduler'].next_fire_time(1).year != 2099
+
+    # a replayed run of a rate limited schedule waits for its token, the next replay waits for that run
+    def test_catch_up_all_rate_limited(self, kwargs, tmp_path, monkeypatch) -> None:
+
+        kwargs['gt_cfg'].sqlite_dir = tmp_path.as_posix()
+        db = Pipeline(db_path=Path(tmp_path, kwargs['gt_cfg'].sqlite_app_name), read_only=False)
+        db.create_schema()
+        db.insert_pipeline('test', 'test.py', 'test_dir', 111.1)
+        db.insert_pipeline_schedule(1, cron='0 * * * *')
+        db.update_pipeline_schedule_catchup(1, 'all')
+        db.update_pipeline_schedule_rate_limit(1, '1/1h')
+        db.insert_pipeline_run(1, 1, 'finished', util.epoch_us(datetime.now(timezone.utc) - timedelta(hours=2)))
+
+        # the first replay only gets a run waiting an hour for its token
+        replayed = []
+
+        def run_schedule(schedule_id: int, *args) -> None:
+            replayed.append(schedule_id)
+            if len(replayed) == 1:
+                Pipeline(db_path=Path(tmp_path, kwargs['gt_cfg'].sqlite_app_name), read_only=False, pooled=True) \
+                    .insert_pipeline_run(1, 1, 'rate_limited', util.epoch_us(), 3600.0)
+
+        monkeypatch.setattr(GluetubeDaemon, '_run_schedule', run_schedule)
+        GluetubeDaemon._catch_up(kwargs['scheduler'], db, kwargs['gt_cfg'])
+        time.sleep(1.5)
+        waited = replayed == [1]
+
+        # it got its token and ran
+        db.update_pipeline_run_status(2, 'finished')
+        deadline = time.time() + 5
+        while len(replayed) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        assert waited and replayed == [1, 1]
+        db.close()
+
+    def test_catch_up_none(self, kwargs) -> None:
+
+        kwargs['db_p'].update_pipeline_schedule_cron(1, '0 * * * *')
+        kwargs['db_p'].insert_pipeline_run(1, 1, 'finished', util.epoch_us(datetime.now(timezone.utc) - timedelta(hours=3)))
+        GluetubeDaemon._catch_up(kwargs['scheduler'], kwargs['db_p'], kwargs['gt_cfg'])
+        assert kwargs['scheduler'].next_fire_time(1) > datetime.now(timezone.utc)
 
     def test_set_schedule_latest_run(self, kwargs) -> None:
 
@@ -199,9 +445,15 @@ class TestGluetubeDaemon:
 
     def test_set_pipeline_run(self, kwargs) -> None:
 
-        GluetubeDaemon().set_pipeline_run(1, 1, 'what status?', 'now', **kwargs)
+        GluetubeDaemon().set_pipeline_run(1, 1, 'what status?', 1640995200000000, **kwargs)
         assert kwargs['db_p'].pipeline_run(2)
 
+    def test_set_pipeline_run_rate_limited(self, kwargs) -> None:
+
+        GluetubeDaemon().set_pipeline_run(1, 1, 'rate_limited', 4102444800000000, 30.0, **kwargs)
+        assert kwargs['scheduler'].next_fire_time(('rate_limited', 1)) \
+            == datetime(2100, 1, 1, 0, 0, 30, tzinfo=timezone.utc)
+
     def test_set_pipeline_run_status(self, kwargs) -> None:
 
         GluetubeDaemon().set_pipeline_run_status(1, 'finished', **kwargs)
@@ -214,8 +466,144 @@ class TestGluetubeDaemon:
 
     def test_set_pipeline_run_finished(self, kwargs) -> None:
 
-        GluetubeDaemon().set_pipeline_run_finished(1, 'finished', '', '2022:01:01 00:00:00', **kwargs)
-        assert kwargs['db_p'].pipeline_run(1)[2] == 'finished' and kwargs['db_p'].pipeline_run(1)[7] == '2022:01:01 00:00:00'
+        GluetubeDaemon().set_pipeline_run_finished(1, 'finished', '', 1640995200000000, **kwargs)
+        assert kwargs['db_p'].pipeline_run(1)[2] == 'finished' and kwargs['db_p'].pipeline_run(1)[7] == 1640995200000000
+
+    def test_set_pipeline_run_finished_stats(self, kwargs) -> None:
+
+        GluetubeDaemon().set_pipeline_run_finished(1, 'crashed', 'oops', 1640995230000000, **kwargs)
+        GluetubeDaemon().set_pipeline_run_finished(1, 'crashed', 'oops', 1640995230000000, **kwargs)  # counted once
+        assert kwargs['db_p'].pipeline_stats(1)[0][:4] == ('test', 1, 0, 30000000)
+
+    def test_set_pipeline_run_finished_triggers_dependent(self, kwargs) -> None:
+
+        kwargs['db_p'].insert_pipeline_schedule(1)
+        GluetubeDaemon().set_schedule_dependency(2, 1, 'finished', **kwargs)
+        GluetubeDaemon().set_pipeline_run_finished(1, 'finished', '', 1640995200000000, **kwargs)
+        assert ('dependency', 2) in kwargs['scheduler'] and kwargs['db_p'].pipeline_schedule_dependencies(2)[0][3] is None
+
+    def test_set_pipeline_run_finished_wrong_status(self, kwargs) -> None:
+
+        kwargs['db_p'].insert_pipeline_schedule(1)
+        GluetubeDaemon().set_schedule_dependency(2, 1, 'finished', **kwargs)
+        GluetubeDaemon().set_pipeline_run_finished(1, 'crashed', 'oops', 1640995200000000, **kwargs)
+        assert ('dependency', 2) not in kwargs['scheduler']
+
+    def test_set_pipeline_run_finished_fan_in(self, kwargs) -> None:
+
+        kwargs['db_p'].insert_pipeline_schedule(1)
+        kwargs['db_p'].insert_pipeline_schedule(1)
+        GluetubeDaemon().set_schedule_dependency(3, 1, 'finished', **kwargs)
+        GluetubeDaemon().set_schedule_dependency(3, 2, 'any', **kwargs)
+        GluetubeDaemon().set_pipeline_run_finished(1, 'finished', '', 1640995200000000, **kwargs)
+        waiting = ('dependency', 3) not in kwargs['scheduler']
+
+        kwargs['db_p'].insert_pipeline_run(1, 2, 'running', 1640995200000000)
+        GluetubeDaemon().set_pipeline_run_finished(2, 'crashed', 'oops', 1640995200000000, **kwargs)
+        assert waiting and ('dependency', 3) in kwargs['scheduler']
+
+    def test_set_pipeline_run_finished_dependent_running(self, kwargs, monkeypatch) -> None:
+
+        # the dependent is still running when its upstream finishes, it's fired once it ended
+        running = {2}
+        monkeypatch.setattr(GluetubeDaemon, '_still_running', lambda schedule_id, *args: schedule_id in running)
+        monkeypatch.setattr('gluetube.gluetubed.DEFERRED_TRIGGER_INTERVAL', 0.05)
+        fired = []
+        monkeypatch.setattr(GluetubeDaemon, '_fire_dependent', lambda schedule_id, *args: fired.append(schedule_id))
+        kwargs['scheduler'].start()
+        kwargs['db_p'].insert_pipeline_schedule(1)
+        GluetubeDaemon().set_schedule_dependency(2, 1, 'finished', **kwargs)
+        GluetubeDaemon().set_pipeline_run_finished(1, 'finished', '', 1640995200000000, **kwargs)
+        time.sleep(0.2)
+        deferred = fired == [] and ('deferred_trigger', 2) in kwargs['scheduler']
+
+        running.clear()
+        deadline = time.time() + 5
+        while not fired and time.time() < deadline:
+            time.sleep(0.01)
+        kwargs['scheduler'].shutdown(wait=False)
+        assert deferred and fired == [2] and ('deferred_trigger', 2) not in kwargs['scheduler']
+
+    def test_set_pipeline_run_finished_triggers_existing_job(self, kwargs) -> None:
+
+        GluetubeDaemon().set_schedule(1, **kwargs)
+        GluetubeDaemon().set_schedule_cron(2, '0 0 1 1 *', **kwargs)
+        GluetubeDaemon().set_schedule_dependency(2, 1, 'finished', **kwargs)
+        GluetubeDaemon().set_pipeline_run_finished(1, 'finished', '', 1640995200000000, **kwargs)
+        assert kwargs['scheduler'].next_fire_time(('dependency', 2)) <= datetime.now(timezone.utc) \
+            and kwargs['scheduler'].next_fire_time(2) > datetime.now(timezone.utc) \
+            and kwargs['db_p'].pipeline_schedule(1, 2)[5] == '0 0 1 1 *'
+
+    # a dependent with an at still to come runs at its date as well
+    def test_set_pipeline_run_finished_keeps_at(self, kwargs) -> None:
+
+        kwargs['db_p'].insert_pipeline_schedule(1)
+        GluetubeDaemon().set_schedule_at(2, '2100-01-01T00:00:00+00:00', **kwargs)
+        GluetubeDaemon().set_schedule_dependency(2, 1, 'finished', **kwargs)
+        GluetubeDaemon().set_pipeline_run_finished(1, 'finished', '', 1640995200000000, **kwargs)
+        assert ('dependency', 2) in kwargs['scheduler'] \
+            and kwargs['scheduler'].next_fire_time(2) == datetime(2100, 1, 1, tzinfo=timezone.utc)
+
+    def test_set_schedule_dependency_cycle(self, kwargs) -> None:
+
+        kwargs['db_p'].insert_pipeline_schedule(1)
+        kwargs['db_p'].insert_pipeline_schedule(1)
+        GluetubeDaemon().set_schedule_dependency(2, 1, 'finished', **kwargs)
+        GluetubeDaemon().set_schedule_dependency(3, 2, 'finished', **kwargs)
+        with pytest.raises(DaemonError):
+            GluetubeDaemon().set_schedule_dependency(1, 3, 'finished', **kwargs)
+
+    def test_set_schedule_dependency_bad_status(self, kwargs) -> None:
+
+        kwargs['db_p'].insert_pipeline_schedule(1)
+        with pytest.raises(DaemonError):
+            GluetubeDaemon().set_schedule_dependency(2, 1, 'exploded', **kwargs)
+
+    def test_delete_schedule_dependency(self, kwargs) -> None:
+
+        kwargs['db_p'].insert_pipeline_schedule(1)
+        GluetubeDaemon().set_schedule_dependency(2, 1, 'finished', **kwargs)
+        GluetubeDaemon().delete_schedule_dependency(2, 1, **kwargs)
+        assert kwargs['db_p'].pipeline_schedule_dependencies(2) == []
+
+    def test_set_pipeline_artifact(self, kwargs) -> None:
+
+        GluetubeDaemon().set_pipeline_artifact(1, 'inventory.json', 1024, **kwargs)
+        assert kwargs['db_p'].pipeline_artifacts(1) == [('inventory.json', 1024)]
+
+    def test_prune_artifacts(self, kwargs, tmp_path) -> None:
+
+        kwargs['gt_cfg'].artifact_dir = tmp_path.as_posix()
+        Path(tmp_path, '1').mkdir()
+        Path(tmp_path, '2').mkdir()
+        Path(tmp_path, 'latest').mkdir()
+        Path(tmp_path, 'latest', 'kept').symlink_to('../1/kept')
+        Path(tmp_path, '1', 'kept').write_text('x')
+        Path(tmp_path, 'latest', 'gone').symlink_to('../2/gone')
+        Path(tmp_path, '2', 'gone').write_text('x')
+
+        # run 2 doesn't exist in pipeline_run
+        GluetubeDaemon()._prune_artifacts(kwargs['db_p'], kwargs['gt_cfg'])
+        assert Path(tmp_path, '1').exists() and not Path(tmp_path, '2').exists() \
+            and Path(tmp_path, 'latest', 'kept').is_symlink() and not Path(tmp_path, 'latest', 'gone').is_symlink()
+
+    def test_delete_pipeline_prunes_artifacts(self, kwargs, tmp_path) -> None:
+
+        kwargs['gt_cfg'].artifact_dir = tmp_path.as_posix()
+        Path(tmp_path, '1').mkdir()
+        GluetubeDaemon().delete_pipeline(1, **kwargs)
+        assert not Path(tmp_path, '1').exists()
+
+    def test_delete_pipeline_rolled_back_keeps_artifacts(self, kwargs, tmp_path) -> None:
+
+        kwargs['gt_cfg'].artifact_dir = tmp_path.as_posix()
+        Path(tmp_path, '1').mkdir()
+        with pytest.raises(RuntimeError):
+            with kwargs['db_p'].transaction():
+                GluetubeDaemon().delete_pipeline(1, **kwargs)
+                assert Path(tmp_path, '1').exists()
+                raise RuntimeError('rolled back')
+        assert Path(tmp_path, '1').exists() and kwargs['db_p'].pipeline_run(1)
 
     def test_set_key_value(self, kwargs) -> None:
 
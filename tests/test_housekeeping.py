@@ -0,0 +1,94 @@
+# Craig Tomkow
+# 2023-01-30
+
+# local imports
+from gluetube.housekeeping import housekeep, expire_runs, open_partition, compress_partitions
+from gluetube.db import Pipeline
+from gluetube.config import Gluetube
+from gluetube import util
+
+# python imports
+import gzip
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# 3rd party imports
+import pytest
+
+
+class TestHousekeeping:
+
+    @pytest.fixture
+    def gt_cfg(self, tmp_path) -> Gluetube:
+
+        gt_cfg = Gluetube(Path(Path(__file__).parent.resolve(), 'cfg', 'gluetube.cfg').resolve().as_posix())
+        gt_cfg.parse()
+        gt_cfg.sqlite_dir = tmp_path.as_posix()
+        gt_cfg.run_archive_dir = Path(tmp_path, 'archive').as_posix()
+        gt_cfg.run_keep_runs = '2'
+        return gt_cfg
+
+    @pytest.fixture
+    def db(self, gt_cfg) -> Pipeline:
+
+        # ended runs in 2022-11, 2022-12 and 2023-01, the newest is the schedule's latest run
+        db = Pipeline(db_path=Path(gt_cfg.sqlite_dir, gt_cfg.sqlite_app_name), read_only=False)
+        db.create_schema()
+        db.insert_pipeline('test', 'test.py', 'test_dir', 111.1)
+        db.insert_pipeline_schedule(1)
+        for start_time in ((2022, 11, 1), (2022, 11, 2), (2022, 12, 1), (2023, 1, 1), (2023, 1, 2)):
+            start_time = util.epoch_us(datetime(*start_time, tzinfo=timezone.utc))
+            run_id = db.insert_pipeline_run(1, 1, 'finished', start_time)
+            db.update_pipeline_run_end_time(run_id, start_time + 60000000)
+        db.update_pipeline_schedule_latest_run(1, 5)
+        yield db
+        db.close()
+
+    def test_expire_runs_partitioned_by_month(self, db, gt_cfg) -> None:
+
+        assert expire_runs(db, 0, 2, gt_cfg.run_archive_dir) == 3
+
+        assert sorted(os.listdir(gt_cfg.run_archive_dir)) == ['runs-2022-11.db', 'runs-2022-12.db']
+        archive = sqlite3.connect(Path(gt_cfg.run_archive_dir, 'runs-2022-11.db'))
+        assert archive.execute("SELECT id FROM pipeline_run").fetchall() == [(1,), (2,)]
+        archive.close()
+        assert db.pipeline_run(3) is None and db.pipeline_run(4)
+
+    def test_expire_runs_no_archive(self, db, gt_cfg) -> None:
+
+        assert expire_runs(db, 0, 2, '') == 3
+
+        assert not Path(gt_cfg.run_archive_dir).exists()
+        assert db.pipeline_run(1) is None and db.pipeline_run(4)
+
+    def test_compress_partitions(self, db, gt_cfg) -> None:
+
+        expire_runs(db, 0, 2, gt_cfg.run_archive_dir)
+        quiet = time.time() - 2 * 86400
+        os.utime(Path(gt_cfg.run_archive_dir, 'runs-2022-11.db'), (quiet, quiet))
+
+        assert compress_partitions(Path(gt_cfg.run_archive_dir)) == [Path(gt_cfg.run_archive_dir, 'runs-2022-11.db.gz')]
+        assert sorted(os.listdir(gt_cfg.run_archive_dir)) == ['runs-2022-11.db.gz', 'runs-2022-12.db']
+
+    def test_open_partition_compressed(self, db, gt_cfg) -> None:
+
+        expire_runs(db, 0, 2, gt_cfg.run_archive_dir)
+        partition = Path(gt_cfg.run_archive_dir, 'runs-2022-11.db')
+        with open(partition, 'rb') as src, gzip.open(f"{partition}.gz", 'wb') as dst:
+            dst.write(src.read())
+        partition.unlink()
+
+        assert open_partition(Path(gt_cfg.run_archive_dir), '2022-11') == partition
+        assert not Path(f"{partition}.gz").exists()
+        archive = sqlite3.connect(partition)
+        assert archive.execute("SELECT id FROM pipeline_run").fetchall() == [(1,), (2,)]
+        archive.close()
+
+    def test_housekeep(self, db, gt_cfg) -> None:
+
+        assert housekeep(gt_cfg) == 3
+        assert housekeep(gt_cfg) == 0
+        assert db._conn.execute('pragma freelist_count').fetchone()[0] == 0
@@ -0,0 +1,82 @@
+# Craig Tomkow
+# 2023-01-16
+
+# local imports
+from gluetube import pipeline
+from gluetube.gluetubed import GluetubeDaemon
+
+# python imports
+from pathlib import Path
+import mmap
+import os
+
+# 3rd party imports
+import pytest
+
+
+@pytest.fixture
+def artifact_env(tmp_path, monkeypatch) -> Path:
+
+    # a listening socket so the publish RPC has somewhere to go
+    sock = GluetubeDaemon()._setup_listener_unix_socket(Path(tmp_path, 'gluetube.sock'))
+    monkeypatch.setenv('PIPELINE_RUN_ID', '1')
+    monkeypatch.setenv('SOCKET_FILE', Path(tmp_path, 'gluetube.sock').as_posix())
+    monkeypatch.setenv('ARTIFACT_DIR', Path(tmp_path, 'artifacts').as_posix())
+    yield Path(tmp_path, 'artifacts')
+    sock.close()
+
+
+def test_publish_bytes(artifact_env) -> None:
+
+    path = pipeline.publish('inventory.json', b'{"hosts": []}')
+    assert path == Path(artifact_env, '1', 'inventory.json') and path.read_bytes() == b'{"hosts": []}'
+
+
+def test_publish_file_hard_linked(artifact_env, tmp_path) -> None:
+
+    src = Path(tmp_path, 'snapshot.bin')
+    src.write_bytes(os.urandom(1024))
+    path = pipeline.publish('snapshot.bin', src)
+
+    assert path.read_bytes() == src.read_bytes() and path.stat().st_ino == src.stat().st_ino
+
+
+def test_publish_bad_name(artifact_env) -> None:
+
+    with pytest.raises(ValueError):
+        pipeline.publish('../escape', b'data')
+
+
+def test_open_latest(artifact_env, monkeypatch) -> None:
+
+    pipeline.publish('report', b'first')
+    monkeypatch.setenv('PIPELINE_RUN_ID', '2')
+    pipeline.publish('report', b'second')
+
+    with pipeline.open('report') as m:
+        assert isinstance(m, mmap.mmap) and m[:] == b'second'
+
+
+def test_open_run_id(artifact_env, monkeypatch) -> None:
+
+    pipeline.publish('report', b'first')
+    monkeypatch.setenv('PIPELINE_RUN_ID', '2')
+    pipeline.publish('report', b'second')
+
+    with pipeline.open('report', run_id=1) as m:
+        assert m[:] == b'first'
+
+
+def test_open_read_only(artifact_env) -> None:
+
+    pipeline.publish('report', b'data')
+
+    with pipeline.open('report') as m:
+        with pytest.raises(TypeError):
+            m[0:1] = b'x'
+
+
+def test_open_missing(artifact_env) -> None:
+
+    with pytest.raises(FileNotFoundError):
+        pipeline.open('no_such_artifact')
@@ -0,0 +1,49 @@
+# Craig Tomkow
+# 2023-01-25
+
+# local imports
+from gluetube.plan import p95_durations, percentile, simulate
+
+# python imports
+from datetime import datetime, timedelta, timezone
+
+
+class TestPlan:
+
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+    def test_percentile(self) -> None:
+
+        assert percentile(list(range(1, 101)), 95) == 95 and percentile([7], 95) == 7
+
+    def test_p95_durations(self) -> None:
+
+        runs = [(1, float(x)) for x in range(1, 21)] + [(2, 5.0)]
+        assert p95_durations(runs) == {1: 19.0, 2: 5.0}
+
+    def test_simulate_enough_slots(self) -> None:
+
+        result = simulate([(self.start, x, 60) for x in range(10)], 10)
+        assert result['peak'] == 10 and result['demand'] == 10 and result['queued'] == 0 and result['max_delay'] == 0
+
+    def test_simulate_queueing(self) -> None:
+
+        result = simulate([(self.start, x, 60) for x in range(10)], 4)
+        assert result['peak'] == 4 and result['demand'] == 10 and result['queued'] == 6 \
+            and result['max_delay'] == 120 and result['worst_minutes'][0] == (self.start, 10, 120)
+
+    def test_simulate_back_to_back(self) -> None:
+
+        # a run ending as the next one starts doesn't overlap it
+        result = simulate([(self.start, 1, 60), (self.start + timedelta(seconds=60), 2, 60)], 1)
+        assert result['peak'] == 1 and result['queued'] == 0
+
+    def test_simulate_still_running_skipped(self) -> None:
+
+        result = simulate([(self.start, 1, 90), (self.start + timedelta(seconds=60), 1, 90)], 10)
+        assert result['runs'] == 1 and result['skipped'] == 1
+
+    def test_simulate_nothing(self) -> None:
+
+        result = simulate([], 10)
+        assert result['runs'] == 0 and result['peak'] == 0 and result['worst_minutes'] == []
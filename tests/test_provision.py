@@ -0,0 +1,237 @@
+# Craig Tomkow
+# 2023-01-18
+
+# local imports
+from gluetube import provision
+from gluetube.provision import Provisioner
+from gluetube.config import Gluetube
+
+# python imports
+from pathlib import Path
+import fcntl
+import threading
+import os
+import time
+import sys
+
+# 3rd party imports
+import pytest
+
+
+@pytest.fixture
+def gt_cfg(tmp_path) -> Gluetube:
+
+    gt_cfg = Gluetube(Path(Path(__file__).parent.resolve(), 'cfg', 'gluetube.cfg').resolve().as_posix())
+    gt_cfg.parse()
+    gt_cfg.pipeline_dir = tmp_path.as_posix()
+    gt_cfg.provision_workers = '1'
+    return gt_cfg
+
+
+def test_submit_queued_once(gt_cfg, monkeypatch) -> None:
+
+    started = threading.Event()
+    release = threading.Event()
+    provisioned = []
+
+    def fake_provision(pipeline_dir_name: str) -> None:
+        with provisioner._lock:
+            provisioner._queued.discard(pipeline_dir_name)
+        started.set()
+        release.wait(5)
+        provisioned.append(pipeline_dir_name)
+
+    provisioner = Provisioner(gt_cfg)
+    monkeypatch.setattr(provisioner, '_provision', fake_provision)
+    first = provisioner.submit('a')
+    started.wait(5)
+    # 'a' is building, so one more build is queued behind it, but only one
+    second = provisioner.submit('a')
+    third = provisioner.submit('a')
+    release.set()
+    provisioner._executor.shutdown(wait=True)
+
+    assert (first, second, third) == (True, True, False) and provisioned == ['a', 'a']
+
+
+def test_provision_removed_dir(gt_cfg, monkeypatch) -> None:
+
+    statuses = []
+    provisioner = Provisioner(gt_cfg)
+    monkeypatch.setattr(provisioner, '_set_status', lambda name, status: statuses.append(status))
+    provisioner._provision('no_exists_dir')
+
+    assert statuses == [] and not Path(gt_cfg.pipeline_dir, 'no_exists_dir').exists()
+
+
+def test_provision_env_compiles(tmp_path) -> None:
+
+    Path(tmp_path, '.venv', 'lib').mkdir(parents=True)
+    Path(tmp_path, '.venv', 'lib', 'site.py').write_text('')
+    Path(tmp_path, 'helper.py').write_text('VALUE = 1\n')
+    provision.provision_env(tmp_path.as_posix())
+
+    assert list(Path(tmp_path, '__pycache__').glob('helper.*.pyc')) \
+        and not Path(tmp_path, '.venv', 'lib', '__pycache__').exists()
+
+
+def test_provision_env_single_flight(tmp_path, monkeypatch) -> None:
+
+    builds = []
+
+    def fake_create_venv(dir: str, venv_cache_dir: str = '') -> None:
+        time.sleep(0.2)
+        builds.append(dir)
+        Path(dir, '.venv').mkdir()
+
+    monkeypatch.setattr(provision, '_create_venv', fake_create_venv)
+    threads = [threading.Thread(target=provision.provision_env, args=(tmp_path.as_posix(),)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert builds == [tmp_path.as_posix()]
+
+
+# another process (a gt worker) building the same environment holds the flock, not our thread lock
+def test_provision_env_waits_on_other_process(tmp_path, monkeypatch) -> None:
+
+    builds = []
+
+    def fake_create_venv(dir: str, venv_cache_dir: str = '') -> None:
+        builds.append(dir)
+        Path(dir, '.venv').mkdir()
+
+    monkeypatch.setattr(provision, '_create_venv', fake_create_venv)
+    with open(Path(tmp_path, '.provision.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        thread = threading.Thread(target=provision.provision_env, args=(tmp_path.as_posix(),))
+        thread.start()
+        time.sleep(0.2)
+        waited = builds == []
+        Path(tmp_path, '.venv').mkdir()  # the other process's build
+    thread.join()
+
+    assert waited and builds == []
+
+
+def test_provision_env_max_builds(tmp_path, monkeypatch) -> None:
+
+    running = []
+    most_running = []
+
+    def fake_create_venv(dir: str, venv_cache_dir: str = '') -> None:
+        running.append(dir)
+        most_running.append(len(running))
+        time.sleep(0.1)
+        running.remove(dir)
+        Path(dir, '.venv').mkdir()
+
+    monkeypatch.setattr(provision, '_create_venv', fake_create_venv)
+    provision.set_max_builds(2)
+    dirs = [Path(tmp_path, str(i)) for i in range(6)]
+    threads = []
+    for dir in dirs:
+        dir.mkdir()
+        threads.append(threading.Thread(target=provision.provision_env, args=(dir.as_posix(),)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(most_running) == 6 and max(most_running) == 2
+
+
+def test_create_venv_failed_leaves_nothing(tmp_path, monkeypatch) -> None:
+
+    def failed_create(self, env_dir: str) -> None:
+        Path(env_dir, 'bin').mkdir()
+        raise OSError('no space left on device')
+
+    monkeypatch.setattr(provision.EnvBuilder, 'create', failed_create)
+    Path(tmp_path, '.venv.tmpleftover').mkdir()
+    with pytest.raises(OSError):
+        provision._create_venv(tmp_path.as_posix())
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_relocate_venv(tmp_path) -> None:
+
+    old_path = Path(tmp_path, '.venv.tmp1234').as_posix()
+    new_path = Path(tmp_path, '.venv').as_posix()
+    Path(old_path, 'bin').mkdir(parents=True)
+    Path(old_path, 'bin', 'pip3').write_text(f"#!{old_path}/bin/python\nimport pip\n")
+    Path(old_path, 'bin', 'python').symlink_to(sys.executable)
+    Path(old_path, 'pyvenv.cfg').write_text(f"home = /usr/bin\ncommand = python -m venv {old_path}\n")
+    provision._relocate_venv(old_path, old_path, new_path)
+
+    assert Path(old_path, 'bin', 'pip3').read_text() == f"#!{new_path}/bin/python\nimport pip\n" \
+        and Path(old_path, 'pyvenv.cfg').read_text().endswith(f"venv {new_path}\n")
+
+
+def test_clone_venv(tmp_path) -> None:
+
+    golden = Path(tmp_path, 'python3').as_posix()
+    clone = Path(tmp_path, 'pipeline', '.venv').as_posix()
+    Path(golden, 'bin').mkdir(parents=True)
+    Path(golden, 'lib', 'site-packages').mkdir(parents=True)
+    Path(golden, 'lib64').symlink_to('lib')
+    Path(golden, 'bin', 'python').symlink_to(sys.executable)
+    Path(golden, 'bin', 'pip3').write_text(f"#!{golden}/bin/python\n")
+    Path(golden, 'pyvenv.cfg').write_text(f"command = python -m venv {golden}\n")
+    Path(golden, 'lib', 'site-packages', 'gluetube').symlink_to(Path(provision.__file__).parent)
+    Path(golden, 'lib', 'site-packages', 'six.py').write_text('')
+    Path(clone).mkdir(parents=True)
+    provision._clone_venv(golden, clone)
+
+    assert Path(clone, 'bin', 'pip3').read_text() == f"#!{clone}/bin/python\n" \
+        and Path(golden, 'bin', 'pip3').read_text() == f"#!{golden}/bin/python\n" \
+        and Path(clone, 'pyvenv.cfg').read_text() == f"command = python -m venv {clone}\n" \
+        and os.readlink(Path(clone, 'lib64')) == 'lib' \
+        and os.readlink(Path(clone, 'bin', 'python')) == sys.executable \
+        and Path(clone, 'lib', 'site-packages', 'gluetube').is_symlink() \
+        and Path(clone, 'lib', 'site-packages', 'six.py').stat().st_ino \
+        == Path(golden, 'lib', 'site-packages', 'six.py').stat().st_ino
+
+
+def test_create_venv_from_golden(tmp_path, monkeypatch) -> None:
+
+    golden_builds = []
+
+    def fake_build_golden_venv(venv_abs_path: str) -> None:
+        golden_builds.append(venv_abs_path)
+        Path(venv_abs_path, 'bin').mkdir()
+        Path(venv_abs_path, 'bin', 'python').symlink_to(sys.executable)
+        Path(venv_abs_path, 'pyvenv.cfg').write_text(f"command = python -m venv {venv_abs_path}\n")
+
+    monkeypatch.setattr(provision, '_build_golden_venv', fake_build_golden_venv)
+    for name in ['a', 'b']:
+        Path(tmp_path, name).mkdir()
+        provision._create_venv(Path(tmp_path, name).as_posix(), Path(tmp_path, 'venvs').as_posix())
+
+    golden = Path(tmp_path, 'venvs', f"python{sys.version_info[0]}.{sys.version_info[1]}")
+    assert len(golden_builds) == 1 and Path(golden, 'pyvenv.cfg').read_text() == f"command = python -m venv {golden}\n" \
+        and Path(tmp_path, 'b', '.venv', 'pyvenv.cfg').read_text().endswith(f"{tmp_path}/b/.venv\n") \
+        and sorted(x.name for x in Path(tmp_path, 'venvs').iterdir()) == [f".{golden.name}.provision.lock", golden.name]
+
+
+def test_installed_requirements_fingerprint(tmp_path) -> None:
+
+    Path(tmp_path, '.venv').mkdir()
+    Path(tmp_path, 'requirements.txt').write_text('requests==2.28.1\n')
+    fingerprint = provision._requirements_fingerprint(tmp_path.as_posix())
+    before = provision._installed_requirements_fingerprint(tmp_path.as_posix())
+    provision._write_installed_requirements_fingerprint(tmp_path.as_posix(), fingerprint)
+
+    assert before == '' and provision._installed_requirements_fingerprint(tmp_path.as_posix()) == fingerprint
+
+
+def test_requirements_fingerprint_changed(tmp_path) -> None:
+
+    Path(tmp_path, 'requirements.txt').write_text('requests==2.28.1\n')
+    fingerprint = provision._requirements_fingerprint(tmp_path.as_posix())
+    Path(tmp_path, 'requirements.txt').write_text('requests==2.28.2\n')
+
+    assert provision._requirements_fingerprint(tmp_path.as_posix()) != fingerprint
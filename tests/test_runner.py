@@ -3,11 +3,14 @@
 
 # local imports
 from gluetube import runner
-from gluetube.db import Store
+from gluetube.db import Pipeline, Store
+from gluetube.config import Gluetube
 
 # python imports
 from pathlib import Path
 import base64
+import json
+import os
 
 # 3rd party imports
 from jinja2 import Environment, FileSystemLoader, Template, exceptions
@@ -88,3 +91,96 @@ def test_variable_value_pairs_for_template_bad_key() -> None:
 
     assert pairs == {}
     db.close()
+
+
+def test_cached_template() -> None:
+
+    directory = Path(Path(__file__).parent.resolve(), 'pipeline_dir', 'test_1')
+    template, variables = runner._cached_template(directory.as_posix(), 'test_1', 'example_pipeline1.py')
+    template_again, _ = runner._cached_template(directory.as_posix(), 'test_1', 'example_pipeline1.py')
+
+    assert template is template_again and variables == {'API1_PASSWORD', 'API1_USERNAME'}
+    runner.invalidate_cache('test_1', 'example_pipeline1.py')
+
+
+def test_cached_template_modified(tmp_path) -> None:
+
+    Path(tmp_path, 'pipeline.py').write_text('print({{ A }})')
+    os.utime(Path(tmp_path, 'pipeline.py'), (1, 1))
+    _, variables = runner._cached_template(tmp_path.as_posix(), 'tmp', 'pipeline.py')
+
+    Path(tmp_path, 'pipeline.py').write_text('print({{ B }})')
+    os.utime(Path(tmp_path, 'pipeline.py'), (2, 2))
+    _, variables_modified = runner._cached_template(tmp_path.as_posix(), 'tmp', 'pipeline.py')
+
+    assert variables == {'A'} and variables_modified == {'B'}
+    runner.invalidate_cache('tmp', 'pipeline.py')
+
+
+def test_invalidate_cache() -> None:
+
+    directory = Path(Path(__file__).parent.resolve(), 'pipeline_dir', 'test_1')
+    template, _ = runner._cached_template(directory.as_posix(), 'test_1', 'example_pipeline1.py')
+    runner.invalidate_cache('test_1', 'example_pipeline1.py')
+    template_again, _ = runner._cached_template(directory.as_posix(), 'test_1', 'example_pipeline1.py')
+
+    assert template is not template_again
+    runner.invalidate_cache('test_1', 'example_pipeline1.py')
+
+
+def test_take_rate_limit_token(tmp_path) -> None:
+
+    gt_cfg = Gluetube(Path(Path(__file__).parent.resolve(), 'cfg', 'gluetube.cfg').resolve().as_posix())
+    gt_cfg.parse()
+    gt_cfg.sqlite_dir = tmp_path.as_posix()
+    db = Pipeline(db_path=Path(tmp_path, gt_cfg.sqlite_app_name), read_only=False)
+    db.create_schema()
+    db.insert_pipeline('test', 'test.py', 'test_dir', 111.1)
+    db.insert_pipeline_schedule(1)
+    db.update_pipeline_schedule_rate_limit(1, '1/1h')
+    pipeline_runner = runner.Runner(1, 'test', 'test.py', 'test_dir', 1, gt_cfg)
+
+    assert pipeline_runner._take_rate_limit_token(db) == 0.0 and pipeline_runner._take_rate_limit_token(db) > 3500
+    db.close()
+
+
+@pytest.fixture
+def rate_limited(tmp_path, monkeypatch) -> Gluetube:
+
+    gt_cfg = Gluetube(Path(Path(__file__).parent.resolve(), 'cfg', 'gluetube.cfg').resolve().as_posix())
+    gt_cfg.parse()
+    gt_cfg.sqlite_dir = tmp_path.as_posix()
+    db = Pipeline(db_path=Path(tmp_path, gt_cfg.sqlite_app_name), read_only=False)
+    db.create_schema()
+    db.insert_pipeline('test', 'test.py', 'test_dir', 111.1)
+    db.insert_pipeline_schedule(1)
+    db.update_pipeline_schedule_rate_limit(1, '1/1h')
+    db.close()
+    monkeypatch.setattr(runner, 'provision_env', lambda *args: None)
+    monkeypatch.setattr(runner, 'sleep', lambda seconds: None)
+    return gt_cfg
+
+
+# the run is only recorded, no thread sits out the wait
+def test_run_rate_limited(rate_limited, monkeypatch) -> None:
+
+    msgs = []
+    monkeypatch.setattr(runner.util, 'send_rpc_msg_to_daemon', lambda msg, socket_file: msgs.append(msg))
+    pipeline_runner = runner.Runner(1, 'test', 'test.py', 'test_dir', 1, rate_limited)
+    pipeline_runner._take_rate_limit_token(Pipeline(db_path=Path(rate_limited.sqlite_dir, rate_limited.sqlite_app_name)))
+    pipeline_runner.run()
+
+    params = json.loads(msgs[0][4:])['params']
+    assert len(msgs) == 2 and params[2] == 'rate_limited' and params[4] > 3500
+
+
+def test_run_rate_limited_waiting(rate_limited, monkeypatch) -> None:
+
+    db = Pipeline(db_path=Path(rate_limited.sqlite_dir, rate_limited.sqlite_app_name), read_only=False)
+    db.insert_pipeline_run(1, 1, 'rate_limited', runner.util.epoch_us(), 3600.0)
+    msgs = []
+    monkeypatch.setattr(runner.util, 'send_rpc_msg_to_daemon', lambda msg, socket_file: msgs.append(msg))
+    runner.Runner(1, 'test', 'test.py', 'test_dir', 1, rate_limited).run()
+
+    assert msgs == []
+    db.close()
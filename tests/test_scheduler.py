@@ -0,0 +1,175 @@
+# Craig Tomkow
+# 2023-01-23
+
+# local imports
+import gluetube.scheduler
+from gluetube.scheduler import Scheduler, cron_trigger, fire_times, hashed_crontab, missed_fire_times
+
+# python imports
+import threading
+import time
+from typing import Callable
+from datetime import datetime, timedelta, timezone
+
+# 3rd party imports
+import pytest
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+
+class TestScheduler:
+
+    @pytest.fixture
+    def fired(self) -> list:
+
+        return []
+
+    @pytest.fixture
+    def scheduler(self, fired) -> Scheduler:
+
+        scheduler = Scheduler(4, fired.append)
+        yield scheduler
+        scheduler.shutdown()
+
+    @staticmethod
+    def _wait_until(condition: Callable[[], bool], timeout: float = 5) -> bool:
+
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def test_add(self, scheduler) -> None:
+
+        assert scheduler.add(1, cron_trigger('* * * * *')) and 1 in scheduler and len(scheduler) == 1
+
+    def test_add_replaces(self, scheduler) -> None:
+
+        scheduler.add(1, cron_trigger('* * * * *'))
+        scheduler.add(1, DateTrigger(datetime(2099, 1, 1, tzinfo=timezone.utc)))
+        assert len(scheduler) == 1 and scheduler.next_fire_time(1).year == 2099
+
+    def test_add_date_in_past(self, scheduler) -> None:
+
+        assert not scheduler.add(1, DateTrigger(datetime(2000, 1, 1, tzinfo=timezone.utc))) and 1 not in scheduler
+
+    def test_remove(self, scheduler) -> None:
+
+        scheduler.add(1, cron_trigger('* * * * *'))
+        assert scheduler.remove(1) and not scheduler.remove(1) and 1 not in scheduler
+
+    def test_run_now_no_job(self, scheduler, fired) -> None:
+
+        scheduler.start()
+        scheduler.run_now(1)
+        assert self._wait_until(lambda: fired == [1]) and 1 not in scheduler
+
+    def test_run_now_keeps_trigger(self, scheduler, fired) -> None:
+
+        scheduler.add(1, cron_trigger('0 0 1 1 *'))
+        scheduler.start()
+        scheduler.run_now(1)
+        assert self._wait_until(lambda: fired == [1]) and scheduler.next_fire_time(1) > datetime.now(timezone.utc)
+
+    def test_func(self, scheduler, fired) -> None:
+
+        done = threading.Event()
+        scheduler.add('scanner', IntervalTrigger(seconds=60), func=done.set, next_fire_time=datetime.now(timezone.utc))
+        scheduler.start()
+        assert done.wait(5) and fired == [] and 'scanner' in scheduler
+
+    def test_missed_fire_skipped(self, scheduler, fired, monkeypatch) -> None:
+
+        scheduler.add(1, cron_trigger('* * * * *'), next_fire_time=datetime.now(timezone.utc) - timedelta(seconds=20))
+        monkeypatch.setattr(gluetube.scheduler, 'MISFIRE_GRACE_TIME', 10)
+        scheduler.start()
+        scheduler.run_now(2)
+        assert self._wait_until(lambda: fired) and fired == [2] and scheduler.next_fire_time(1) > datetime.now(timezone.utc)
+
+    def test_active_job_not_fired_twice(self) -> None:
+
+        fired = []
+        started, release, done = threading.Event(), threading.Event(), threading.Event()
+
+        def fire(key: int) -> None:
+            fired.append(key)
+            if key == 1:
+                started.set()
+                release.wait(5)
+            else:
+                done.set()
+
+        scheduler = Scheduler(4, fire)
+        scheduler.start()
+        scheduler.run_now(1)
+        assert started.wait(5)
+        scheduler.run_now(1)  # still running
+        scheduler.run_now(2)
+        assert done.wait(5)
+        release.set()
+        scheduler.shutdown()
+        assert fired == [1, 2]
+
+    def test_heap_compacted(self, scheduler) -> None:
+
+        for _ in range(5000):
+            scheduler.add(1, cron_trigger('* * * * *'))
+        assert len(scheduler._heap) <= 2 * len(scheduler) + 1024
+
+    def test_cron_trigger_shared(self) -> None:
+
+        assert cron_trigger('*/5 * * * *') is cron_trigger('*/5 * * * *')
+
+    def test_cron_trigger_hashed(self) -> None:
+
+        assert cron_trigger('H * * * *', 7) is cron_trigger(hashed_crontab('H * * * *', 7))
+
+    def test_hashed_crontab_stable(self) -> None:
+
+        assert hashed_crontab('H H * * *', 1) == hashed_crontab('H H * * *', 1)
+
+    def test_hashed_crontab_spread(self) -> None:
+
+        minutes = {int(hashed_crontab('H * * * *', x).split()[0]) for x in range(1000)}
+        assert len(minutes) == 60
+
+    def test_hashed_crontab_range_and_step(self) -> None:
+
+        minute, hour, _, _, day_of_week = hashed_crontab('H(0-9)/5 H(9-17) * * MON,THU', 3).split()
+        assert minute in ('0-9/5', '1-9/5', '2-9/5', '3-9/5', '4-9/5') and 9 <= int(hour) <= 17 \
+            and day_of_week == 'MON,THU'
+
+    def test_hashed_crontab_bad_range(self) -> None:
+
+        with pytest.raises(ValueError):
+            hashed_crontab('H(50-70) * * * *', 1)
+
+    def test_hashed_crontab_wrong_fields(self) -> None:
+
+        with pytest.raises(ValueError):
+            hashed_crontab('H * * *', 1)
+
+    def test_fire_times(self) -> None:
+
+        start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        fires = fire_times(cron_trigger('*/15 * * * *'), start, start + timedelta(hours=1))
+        assert [x.minute for x in fires] == [0, 15, 30, 45]
+
+    def test_cron_trigger_invalid(self) -> None:
+
+        with pytest.raises(ValueError):
+            cron_trigger('every minute')
+
+    def test_missed_fire_times(self) -> None:
+
+        since = datetime(2023, 1, 1, 0, 0, 0, 500000, tzinfo=timezone.utc)  # the run of the midnight fire
+        fires = missed_fire_times(cron_trigger('0 * * * *'), since, datetime(2023, 1, 1, 3, tzinfo=timezone.utc), 10)
+        assert [x.hour for x in fires] == [1, 2, 3]
+
+    def test_missed_fire_times_limit(self) -> None:
+
+        since = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        fires = missed_fire_times(cron_trigger('* * * * *'), since, datetime(2023, 1, 2, tzinfo=timezone.utc), 10)
+        assert len(fires) == 11
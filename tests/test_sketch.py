@@ -0,0 +1,60 @@
+# Craig Tomkow
+# 2023-01-31
+
+# local imports
+from gluetube.sketch import DurationSketch, RELATIVE_ACCURACY
+from gluetube import sketch
+
+# python imports
+import random
+
+# 3rd party imports
+import pytest
+
+
+class TestSketch:
+
+    def test_quantiles_within_relative_accuracy(self) -> None:
+
+        rand = random.Random(48)
+        durations = [rand.lognormvariate(4, 1.5) for _ in range(10000)]
+        durations_sketch = DurationSketch()
+        for duration in durations:
+            durations_sketch.add(duration)
+
+        ordered = sorted(durations)
+        for q in (0.5, 0.95, 0.99):
+            assert durations_sketch.quantile(q) == pytest.approx(ordered[int(q * (len(ordered) - 1))],
+                                                                 rel=RELATIVE_ACCURACY)
+        assert durations_sketch.count == 10000
+
+    def test_zero_durations(self) -> None:
+
+        durations_sketch = DurationSketch()
+        for duration in (0, -1, 0, 30):
+            durations_sketch.add(duration)
+
+        assert durations_sketch.quantile(0.5) == 0.0 and durations_sketch.quantile(1) == pytest.approx(30, rel=0.01)
+
+    def test_empty(self) -> None:
+
+        assert DurationSketch().quantile(0.95) is None
+
+    def test_dumps_loads(self) -> None:
+
+        durations_sketch = DurationSketch()
+        for duration in (0, 1.5, 60, 3600):
+            durations_sketch.add(duration)
+
+        loaded = DurationSketch.loads(durations_sketch.dumps())
+        assert loaded.count == 4 and loaded.quantile(0.75) == durations_sketch.quantile(0.75)
+
+    def test_buckets_bounded(self, monkeypatch) -> None:
+
+        monkeypatch.setattr(sketch, 'MAX_BUCKETS', 10)
+        durations_sketch = DurationSketch()
+        for i in range(100):
+            durations_sketch.add(1.1 ** i)
+
+        assert len(durations_sketch.buckets) == 10 and durations_sketch.count == 100 \
+            and durations_sketch.quantile(1) == pytest.approx(1.1 ** 99, rel=0.01)
@@ -0,0 +1,189 @@
+# Craig Tomkow
+# 2023-01-09
+
+# local imports
+from gluetube.supervisor import Supervisor, run_process
+
+# python imports
+import ctypes
+import os
+import signal
+import sys
+import threading
+import asyncio
+import time
+from pathlib import Path
+from typing import Tuple
+
+# 3rd party imports
+import pytest
+
+# prctl option making a process the parent of its orphaned descendants, see prctl(2)
+PR_SET_CHILD_SUBREAPER = 36
+
+
+class TestSupervisor:
+
+    @pytest.fixture
+    def supervisor(self) -> Supervisor:
+
+        supervisor = Supervisor()
+        supervisor.start()
+        yield supervisor
+        supervisor.stop()
+
+    @staticmethod
+    def _submit_and_wait(supervisor: Supervisor, key: int, code: str, stdin: str = '',
+                         timeout: float = 0) -> Tuple[int, str, bool]:
+
+        done = threading.Event()
+        result = {}
+
+        def on_exit(returncode: int, output: str, timed_out: bool) -> None:
+            result['exit'] = [returncode, output, timed_out]
+            done.set()
+
+        supervisor.submit(key, [sys.executable, '-c', code], os.getcwd(), os.environ.copy(), stdin, on_exit, timeout)
+        assert done.wait(10)
+        return result['exit'][0], result['exit'][1], result['exit'][2]
+
+    def test_submit_finished(self, supervisor) -> None:
+
+        returncode, output, timed_out = self._submit_and_wait(supervisor, 1, "print('hello')")
+        assert returncode == 0 and output == 'hello\n' and not timed_out
+
+    def test_submit_crashed(self, supervisor) -> None:
+
+        returncode, output, _ = self._submit_and_wait(supervisor, 1, "import sys; sys.stderr.write('boom'); sys.exit(3)")
+        assert returncode == 3 and output == 'boom'
+
+    def test_submit_stdin(self, supervisor) -> None:
+
+        returncode, output, _ = self._submit_and_wait(supervisor, 1, "import sys; print(sys.stdin.read())", 'piped')
+        assert returncode == 0 and output == 'piped\n'
+
+    def test_submit_bad_executable(self, supervisor) -> None:
+
+        done = threading.Event()
+        result = []
+
+        def on_exit(returncode: int, output: str, timed_out: bool) -> None:
+            result.append(returncode)
+            done.set()
+
+        supervisor.submit(1, ['/no/such/python3'], os.getcwd(), os.environ.copy(), '', on_exit)
+        assert done.wait(10) and result == [-1]
+
+    def test_running(self, supervisor) -> None:
+
+        done = threading.Event()
+        supervisor.submit(1, [sys.executable, '-c', 'import time; time.sleep(0.5)'], os.getcwd(), os.environ.copy(), '',
+                          lambda returncode, output, timed_out: done.set())
+
+        assert supervisor.running(1) and not supervisor.running(2)
+        assert done.wait(10) and not supervisor.running(1)
+
+    def test_many_concurrent_runs(self, supervisor) -> None:
+
+        finished = []
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def on_exit(returncode: int, output: str, timed_out: bool) -> None:
+            with lock:
+                finished.append(returncode)
+                if len(finished) == 50:
+                    done.set()
+
+        for key in range(50):
+            supervisor.submit(key, [sys.executable, '-c', 'pass'], os.getcwd(), os.environ.copy(), '', on_exit)
+
+        assert done.wait(60) and finished == [0] * 50
+
+    def test_submit_timed_out(self, supervisor) -> None:
+
+        code = "import time; print('partial', flush=True); time.sleep(30)"
+        returncode, output, timed_out = self._submit_and_wait(supervisor, 1, code, timeout=0.5)
+        assert timed_out and returncode != 0 and output == 'partial\n'
+
+
+def test_run_process_kills_process_group(tmp_path) -> None:
+
+    # the pipeline spawns a grandchild that would outlive it, the whole group has to go
+    pid_file = tmp_path / 'grandchild.pid'
+    code = (
+        "import subprocess, sys, time\n"
+        "p = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])\n"
+        f"open({pid_file.as_posix()!r}, 'w').write(str(p.pid))\n"
+        "time.sleep(30)\n"
+    )
+
+    loop = asyncio.new_event_loop()
+    try:
+        _, _, timed_out = loop.run_until_complete(
+            run_process([sys.executable, '-c', code], os.getcwd(), os.environ.copy(), '', timeout=1, grace=1)
+        )
+    finally:
+        loop.close()
+
+    # the orphaned grandchild is either reaped already or left as a zombie for init to reap
+    grandchild = Path('/proc', pid_file.read_text(), 'stat')
+    time.sleep(0.2)
+    alive = grandchild.exists() and grandchild.read_text().split(')')[-1].split()[0] != 'Z'
+
+    assert timed_out and not alive
+
+
+def test_run_process_kills_sigterm_ignoring_grandchild(tmp_path) -> None:
+
+    # the pipeline goes on SIGTERM, its grandchild ignores it and has to be killed once the grace period is over. it
+    #   doesn't hold the output pipe, nothing waits on it. the test is its subreaper, to tell how it ended
+    libc = ctypes.CDLL(None, use_errno=True)
+    pid_file = tmp_path / 'grandchild.pid'
+    grandchild_code = "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); time.sleep(30)"
+    code = (
+        "import subprocess, sys, time\n"
+        f"p = subprocess.Popen([sys.executable, '-c', {grandchild_code!r}], stdin=subprocess.DEVNULL,\n"
+        "                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)\n"
+        "time.sleep(0.3)\n"
+        f"open({pid_file.as_posix()!r}, 'w').write(str(p.pid))\n"
+        "time.sleep(30)\n"
+    )
+
+    libc.prctl(PR_SET_CHILD_SUBREAPER, 1)
+    loop = asyncio.new_event_loop()
+    try:
+        returncode, _, timed_out = loop.run_until_complete(
+            run_process([sys.executable, '-c', code], os.getcwd(), os.environ.copy(), '', timeout=1, grace=0.5)
+        )
+        grandchild = int(pid_file.read_text())
+        deadline = time.time() + 2
+        status = 0
+        while time.time() < deadline:
+            pid, status = os.waitpid(grandchild, os.WNOHANG)
+            if pid:
+                break
+            time.sleep(0.05)
+        else:
+            os.kill(grandchild, signal.SIGKILL)
+            os.waitpid(grandchild, 0)
+    finally:
+        loop.close()
+        libc.prctl(PR_SET_CHILD_SUBREAPER, 0)
+
+    assert timed_out and returncode == -15 and os.WIFSIGNALED(status) and os.WTERMSIG(status) == signal.SIGKILL
+
+
+def test_run_process_sigterm_ignored() -> None:
+
+    code = "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); time.sleep(30)"
+
+    loop = asyncio.new_event_loop()
+    try:
+        returncode, _, timed_out = loop.run_until_complete(
+            run_process([sys.executable, '-c', code], os.getcwd(), os.environ.copy(), '', timeout=0.5, grace=0.5)
+        )
+    finally:
+        loop.close()
+
+    assert timed_out and returncode == -9
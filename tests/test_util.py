@@ -8,6 +8,10 @@ from gluetube import util
 # python imports
 import json
 import struct
+from datetime import datetime, timezone
+
+# 3rd party imports
+import pytest
 
 
 def test_append_name_to_dir_list() -> None:
@@ -39,6 +43,51 @@ def test_craft_rpc_msg() -> None:
     assert result == test_payload
 
 
+def test_duration() -> None:
+
+    assert [util.duration(x) for x in ['90', '90s', '30m', '24h', '7d']] == [90, 90, 1800, 86400, 604800]
+
+
+def test_positive_int() -> None:
+
+    assert util.positive_int('4') == 4
+    with pytest.raises(ValueError):
+        util.positive_int('0')
+
+
+def test_non_negative_int() -> None:
+
+    assert util.non_negative_int('0') == 0
+    with pytest.raises(ValueError):
+        util.non_negative_int('-1')
+
+
+def test_rate() -> None:
+
+    assert util.rate('10/60') == (10, 60) and util.rate('10/1m') == (10, 60)
+
+
+def test_rate_invalid() -> None:
+
+    for text in ['10', '0/60', '10/0', 'ten/60']:
+        with pytest.raises(ValueError):
+            util.rate(text)
+
+
+def test_rate_limit_pool() -> None:
+
+    pools = {'crm_api': '10/1m'}
+    assert util.rate_limit_pool('CRM_API', 1, pools) == ('crm_api', (10, 60)) \
+        and util.rate_limit_pool('5/1h', 1, pools) == ('schedule 1', (5, 3600))
+
+
+def test_epoch_us() -> None:
+
+    dt = datetime(2023, 1, 1, 0, 0, 0, 500000, tzinfo=timezone.utc)
+    assert util.epoch_us(dt) == 1672531200500000 and util.from_epoch_us(1672531200500000) == dt \
+        and util.iso_time(1672531200500000) == '2023-01-01T00:00:00.500000+00:00' and util.iso_time(None) == ''
+
+
 def test_encrypt_decrypt() -> None:
 
     password = os.urandom(32)
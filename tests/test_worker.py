@@ -0,0 +1,94 @@
+# Craig Tomkow
+# 2023-01-27
+
+# local imports
+import gluetube.worker
+from gluetube.worker import Worker
+from gluetube.db import Pipeline
+from gluetube.config import Gluetube
+
+# python imports
+import threading
+import time
+from pathlib import Path
+
+# 3rd party imports
+import pytest
+
+
+class TestWorker:
+
+    @pytest.fixture
+    def gt_cfg(self, tmp_path) -> Gluetube:
+
+        gt_cfg = Gluetube(Path(Path(__file__).parent.resolve(), 'cfg', 'gluetube.cfg').resolve().as_posix())
+        gt_cfg.parse()
+        gt_cfg.sqlite_dir = tmp_path.as_posix()
+        return gt_cfg
+
+    @pytest.fixture
+    def db(self, gt_cfg) -> Pipeline:
+
+        db = Pipeline(db_path=Path(gt_cfg.sqlite_dir, gt_cfg.sqlite_app_name), read_only=False)
+        db.create_schema()
+        db.insert_pipeline('test', 'test.py', 'test_dir', 111.1)
+        db.insert_pipeline_schedule(1)
+        db.insert_pipeline_schedule(1)
+        yield db
+        db.close()
+
+    @pytest.fixture
+    def ran(self, monkeypatch) -> list:
+
+        ran = []
+        monkeypatch.setattr(gluetube.worker, 'POLL_INTERVAL', 0.01)
+        monkeypatch.setattr(gluetube.worker, 'run_schedule', lambda schedule_id, gt_cfg, supervisor: ran.append(schedule_id))
+        return ran
+
+    @staticmethod
+    def _run_until(worker: Worker, condition) -> bool:
+
+        thread = threading.Thread(target=worker.run)
+        thread.start()
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        worker.stop()
+        thread.join()
+        return condition()
+
+    def test_run(self, gt_cfg, db, ran) -> None:
+
+        db.enqueue_run(1, time.time())
+        db.enqueue_run(2, time.time())
+
+        assert self._run_until(Worker(gt_cfg, 2), lambda: len(ran) == 2) \
+            and sorted(ran) == [1, 2] and not db.run_queued(1) and not db.run_queued(2)
+
+    def test_run_expired_lease(self, gt_cfg, db, ran) -> None:
+
+        db.enqueue_run(1, time.time())
+        db.claim_run('dead', time.time() - 120, time.time() - 60)
+
+        assert self._run_until(Worker(gt_cfg, 1), lambda: ran == [1]) and not db.run_queued(1)
+
+    def test_run_live_lease(self, gt_cfg, db, ran) -> None:
+
+        db.enqueue_run(1, time.time())
+        db.claim_run('alive', time.time(), time.time() + 60)
+        worker = Worker(gt_cfg, 1)
+        thread = threading.Thread(target=worker.run)
+        thread.start()
+        time.sleep(0.2)
+        worker.stop()
+        thread.join()
+
+        assert ran == [] and db.run_queued(1)
+
+    def test_run_too_many_attempts(self, gt_cfg, db, ran) -> None:
+
+        db.enqueue_run(1, time.time())
+        for x in range(gluetube.worker.MAX_ATTEMPTS):
+            db.claim_run('dead', 100.0 + x * 10, 105.0 + x * 10)
+
+        assert self._run_until(Worker(gt_cfg, 1), lambda: not db.run_queued(1)) and ran == []